@@ -1,3 +1,121 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
 
-# Register your models here.
+from .models import BCP, Cliente, TarifaOperacion
+from .recalculo import recalcular_movimientos
+
+
+# Por debajo de esta cantidad estimada de filas se cuenta con COUNT(*)
+UMBRAL_CONTEO_ESTIMADO = 100000
+
+
+def conteo_estimado(modelo):
+    """
+    Cantidad aproximada de filas de la tabla del modelo según las
+    estadísticas del motor (sin recorrer la tabla), o None si el motor no
+    las expone.
+    """
+    tabla = modelo._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "microsoft":
+            # Filas del heap o del índice clustered de la tabla
+            cursor.execute(
+                "SELECT SUM(p.rows) FROM sys.partitions p "
+                "WHERE p.object_id = OBJECT_ID(%s) AND p.index_id IN (0, 1)",
+                [tabla],
+            )
+        elif connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [tabla])
+        else:
+            return None
+        fila = cursor.fetchone()
+    return int(fila[0]) if fila and fila[0] is not None and fila[0] >= 0 else None
+
+
+class PaginadorConteoEstimado(Paginator):
+    """
+    Paginador del admin para tablas grandes: sin filtros ni búsqueda el total
+    sale de las estadísticas de la tabla en lugar de un COUNT(*) sobre
+    millones de filas. Con filtros, o en tablas chicas, cuenta normalmente.
+    """
+
+    @cached_property
+    def count(self):
+        consulta = getattr(self.object_list, "query", None)
+        if consulta is not None and not consulta.where:
+            estimado = conteo_estimado(self.object_list.model)
+            if estimado is not None and estimado >= UMBRAL_CONTEO_ESTIMADO:
+                return estimado
+        return super().count
+
+
+class AdminTablaGrande(admin.ModelAdmin):
+    paginator = PaginadorConteoEstimado
+    # Evita el segundo COUNT(*) (el de la tabla completa) al filtrar o buscar
+    show_full_result_count = False
+    list_per_page = 100
+
+    def recalcular(self, request, movimientos):
+        # Las acciones recalculan en lotes (ver recalcular_movimientos), nunca de a un save()
+        actualizados, sin_tarifa = recalcular_movimientos(movimientos)
+        self.message_user(request, f"Se recalcularon {actualizados} movimientos.", messages.SUCCESS)
+        if sin_tarifa:
+            self.message_user(
+                request, f"{sin_tarifa} movimientos no se recalcularon: su tarifa no existe.", messages.WARNING
+            )
+
+
+@admin.register(BCP)
+class BCPAdmin(AdminTablaGrande):
+    list_display = (
+        "cod_bcp", "fecha", "descripcion", "monto", "saldo", "comision", "lm_pagar",
+        "ganancia_referido", "cliente", "tarifa",
+    )
+    # cliente y tarifa salen en el listado: un JOIN en lugar de una consulta por fila
+    list_select_related = ("cliente", "tarifa")
+    # Solo búsquedas por prefijo sobre columnas indexadas (LIKE 'valor%')
+    search_fields = ("^cod_bcp", "^cliente__cod_cliente", "^cliente__dni")
+    search_help_text = "Prefijo de COD_BCP, código de cliente o DNI."
+    date_hierarchy = "fecha"
+    ordering = ("-fecha", "-id")
+    # Sin desplegables con todos los clientes y tarifas en el formulario
+    raw_id_fields = ("cliente", "tarifa")
+    actions = ["recalcular_comisiones"]
+
+    @admin.action(description="Recalcular comisiones de los movimientos seleccionados")
+    def recalcular_comisiones(self, request, queryset):
+        self.recalcular(request, queryset)
+
+
+@admin.register(Cliente)
+class ClienteAdmin(AdminTablaGrande):
+    list_display = ("cod_cliente", "dni", "nombre", "apellidos", "cod_tarifa", "codigo_referido", "status")
+    search_fields = ("^cod_cliente", "^dni")
+    search_help_text = "Prefijo del código de cliente o del DNI."
+    ordering = ("cod_cliente",)
+    actions = ["recalcular_comisiones"]
+
+    @admin.action(description="Recalcular comisiones de los movimientos de los clientes seleccionados")
+    def recalcular_comisiones(self, request, queryset):
+        movimientos = BCP.objects.filter(cliente_id__in=queryset.values("cod_cliente"))
+        self.recalcular(request, movimientos)
+
+
+@admin.register(TarifaOperacion)
+class TarifaOperacionAdmin(AdminTablaGrande):
+    list_display = ("cod_tarifa", "descripcion", "costo_por_porcentaje", "costo_fijo")
+    search_fields = ("^cod_tarifa",)
+    ordering = ("cod_tarifa",)
+    actions = ["recalcular_comisiones"]
+
+    @admin.action(description="Recalcular comisiones de los movimientos con las tarifas seleccionadas")
+    def recalcular_comisiones(self, request, queryset):
+        # La tarifa efectiva es la del cliente: se recalculan los movimientos
+        # que tienen la tarifa y los de clientes que ahora la usan
+        codigos = queryset.values("cod_tarifa")
+        movimientos = BCP.objects.filter(tarifa_id__in=codigos) | BCP.objects.filter(
+            cliente_id__in=Cliente.objects.filter(cod_tarifa__in=codigos).values("cod_cliente")
+        )
+        self.recalcular(request, movimientos)
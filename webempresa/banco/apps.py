@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class BancoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'banco'
+
+    def ready(self):
+        # Conecta las señales de los caches (tarifas, reglas de referido, exportaciones,
+        # índice de clientes), del resumen diario y de la instrumentación (cuenta las
+        # consultas de cada conexión)
+        from . import (  # noqa: F401
+            cache_exportaciones, coincidencias, instrumentacion, referidos, resumenes, tarifas,
+        )
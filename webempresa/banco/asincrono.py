@@ -0,0 +1,32 @@
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+
+# Partes que se piden al iterable síncrono en cada salto al hilo
+PARTES_POR_LLAMADA = 16
+
+
+async def iterar_async(iterable, por_llamada=PARTES_POR_LLAMADA):
+    """
+    Recorre desde código async un iterable síncrono que consulta la base de
+    datos o hace trabajo de CPU (por ejemplo el contenido de una exportación).
+
+    Las partes se piden en el hilo de la petición (sync_to_async), de a
+    ``por_llamada`` por vez: el event loop nunca se bloquea y no se paga un
+    salto de hilo por cada parte. Si la descarga se corta, el iterable se
+    cierra también en ese hilo (así corren sus ``finally``).
+    """
+    iterador = iter(iterable)
+    siguientes = sync_to_async(lambda: list(islice(iterador, por_llamada)))
+    try:
+        while True:
+            partes = await siguientes()
+            if not partes:
+                return
+            for parte in partes:
+                yield parte
+    finally:
+        cerrar = getattr(iterador, "close", None)
+        if cerrar is not None:
+            await sync_to_async(cerrar)()
@@ -0,0 +1,173 @@
+import io
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+import openpyxl
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from .coincidencias import invalidar_indice_clientes
+from .models import BCP, Cliente, ExportacionGuardada, TarifaOperacion, TrabajoImportacion
+
+
+# Descripciones como las del estado de cuenta: el DNI del cliente va al final
+DESCRIPCIONES_CON_DNI = ["PAGO YAPE DE {dni}", "TRANSF.BCO.CTA {dni}", "DEP.EFECTIVO AG {dni}", "PLIN {dni}"]
+DESCRIPCIONES_SIN_DNI = ["COMISION MANTENIMIENTO", "ITF", "INTERES GANADO", "PAGO SERVICIOS LUZ"]
+
+ENCABEZADOS_LIBRO = [
+    "Fecha", "Fecha valuta", "Descripción operación", "Monto", "Sucursal agencia", "N operación", "Usuario",
+]
+
+DNI_INICIAL = 40000000
+
+
+def crear_tablas_externas():
+    """
+    Crea CLIENTE y TARIFA_OPERACION (managed = False, las migraciones no las
+    crean) y vuelve a crear BCP desde el modelo, igual que los tests.
+    """
+    with connection.schema_editor() as editor:
+        editor.create_model(Cliente)
+        editor.create_model(TarifaOperacion)
+        editor.delete_model(BCP)
+        editor.create_model(BCP)
+
+
+def sembrar_datos(cantidad_clientes, semilla=1):
+    """
+    Crea clientes y tarifas sintéticos: una tarifa por cliente (COD_TARIFA
+    es único en CLIENTE) y uno de cada cinco con el código de referido 6.
+    Devuelve los DNI de los clientes.
+    """
+    azar = random.Random(semilla)
+    TarifaOperacion.objects.bulk_create([
+        TarifaOperacion(
+            cod_tarifa=f"TARIFA{n:05d}",
+            descripcion=f"Tarifa {n}",
+            costo_por_porcentaje=Decimal(azar.choice(["0.0100", "0.0125", "0.0150"])),
+            costo_fijo=Decimal(azar.choice(["5.00", "7.50", "10.00"])),
+        )
+        for n in range(cantidad_clientes)
+    ])
+    dnis = [f"{DNI_INICIAL + n * 7}" for n in range(cantidad_clientes)]
+    Cliente.objects.bulk_create([
+        Cliente(
+            id=n + 1,
+            cod_cliente=f"CLI{n:05d}",
+            dni=dni,
+            nombre=f"Cliente {n}",
+            apellidos="Sintético",
+            cod_tarifa=f"TARIFA{n:05d}",
+            codigo_referido="6" if n % 5 == 0 else None,
+        )
+        for n, dni in enumerate(dnis)
+    ], batch_size=500)
+    # bulk_create no manda señales: se vuelve a leer el índice de clientes para
+    # medir con los clientes en el índice y no con la búsqueda por DNI en la base
+    invalidar_indice_clientes()
+    return dnis
+
+
+def generar_libro(filas, dnis, semilla=1):
+    """
+    Estado de cuenta BCP sintético (.xlsx en memoria) con ``filas`` movimientos.
+    El 85% lleva al final el DNI de un cliente, el 5% un DNI que no existe y
+    el resto ninguno; los montos van por encima y por debajo del umbral de 1500.
+    """
+    azar = random.Random(semilla)
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    hoja.append(ENCABEZADOS_LIBRO)
+    inicio = date(2025, 1, 1)
+    for n in range(filas):
+        tipo = azar.random()
+        if tipo < 0.85:
+            descripcion = azar.choice(DESCRIPCIONES_CON_DNI).format(dni=azar.choice(dnis))
+        elif tipo < 0.90:
+            descripcion = azar.choice(DESCRIPCIONES_CON_DNI).format(dni=f"{azar.randint(10000000, 39999999)}")
+        else:
+            descripcion = azar.choice(DESCRIPCIONES_SIN_DNI)
+        fecha = inicio + timedelta(days=n * 365 // max(filas, 1))
+        hoja.append([
+            fecha, fecha, descripcion, round(azar.uniform(-500, 6000), 2),
+            f"AG {azar.randint(1, 40):03d}", f"{n + 1:08d}", f"U{azar.randint(1, 9)}",
+        ])
+    archivo = io.BytesIO()
+    libro.save(archivo)
+    archivo.seek(0)
+    archivo.name = f"bcp_{filas}.xlsx"
+    return archivo
+
+
+@contextmanager
+def medir(etapa, filas, resultados, memoria=True):
+    """
+    Mide el bloque: segundos, filas por segundo, consultas a la base de datos
+    y pico de memoria de Python (tracemalloc, si ``memoria``). Agrega el
+    resultado a ``resultados``.
+    """
+    consultas = [0]
+
+    def contar(execute, sql, params, many, context):
+        consultas[0] += 1
+        return execute(sql, params, many, context)
+
+    if memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    try:
+        with connection.execute_wrapper(contar):
+            yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        pico = tracemalloc.get_traced_memory()[1] if memoria else None
+        if memoria:
+            tracemalloc.stop()
+    resultados.append({
+        "etapa": etapa,
+        "filas": filas,
+        "segundos": round(segundos, 3),
+        "filas_por_segundo": round(filas / segundos, 1) if segundos else None,
+        "memoria_pico_mb": round(pico / 2 ** 20, 1) if pico is not None else None,
+        "consultas": consultas[0],
+    })
+
+
+def medir_pipeline(filas, dnis, semilla=1, memoria=True):
+    """
+    Corre de punta a punta importar_excel, confirmar_import y exportar_excel
+    (con el cliente de tests de Django, los trabajos en el mismo hilo) sobre
+    un libro sintético de ``filas`` movimientos. Necesita los datos de
+    sembrar_datos. Devuelve los resultados de medir, uno por etapa.
+    """
+    resultados = []
+    libro = generar_libro(filas, dnis, semilla)
+    cliente = Client()
+
+    with override_settings(BANCO_TRABAJOS_SINCRONOS=True):
+        with medir("importar_excel", filas, resultados, memoria):
+            respuesta = cliente.post(reverse("banco:importar_excel"), {"archivo": libro})
+        trabajo = TrabajoImportacion.objects.filter(tipo=TrabajoImportacion.PREVIEW).latest("creado")
+        if respuesta.status_code != 302 or trabajo.estado != TrabajoImportacion.TERMINADO:
+            raise RuntimeError(f"La importación falló: {trabajo.errores[:5]}")
+
+        with medir("confirmar_import", filas, resultados, memoria):
+            cliente.post(reverse("banco:confirmar_import"), {"token": str(trabajo.token)})
+        confirmacion = TrabajoImportacion.objects.filter(tipo=TrabajoImportacion.CONFIRMACION).latest("creado")
+        if confirmacion.estado != TrabajoImportacion.TERMINADO:
+            raise RuntimeError(f"La confirmación falló: {confirmacion.errores[:5]}")
+
+    guardadas = BCP.objects.count()
+    ExportacionGuardada.objects.all().delete()
+    for etapa in ("exportar_excel", "exportar_excel (archivo guardado)"):
+        with medir(etapa, guardadas, resultados, memoria):
+            respuesta = cliente.get(reverse("banco:exportar_excel"))
+            for _ in respuesta.streaming_content:
+                pass
+    return resultados
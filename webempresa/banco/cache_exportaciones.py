@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import tempfile
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .exportacion import (
+    anchos_xlsx, contenido_csv, contenido_parquet, empaquetar_xlsx_bcp, filas_exportacion, xml_filas_xlsx,
+)
+from .models import BCP, ExportacionGuardada
+
+
+# Formatos a los que se les pueden agregar filas al final sin regenerarlos.
+# Parquet no: el índice del archivo va al final y hay que reescribirlo entero.
+FORMATOS_EXTENSIBLES = {"csv", "xlsx"}
+
+# Las exportaciones que no se piden en este tiempo se borran
+CADUCIDAD = timedelta(days=7)
+
+TAMANO_LECTURA = 64 * 1024
+
+
+def _directorio():
+    directorio = getattr(settings, "BANCO_EXPORTACIONES_DIR", None) or os.path.join(
+        tempfile.gettempdir(), "banco_exportaciones"
+    )
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def _borrar_archivo(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        # Ya no existe, o en Windows todavía lo está leyendo otra descarga
+        pass
+
+
+def clave_exportacion(formato, parametros):
+    """
+    Clave del archivo guardado: formato + filtros usados (sin los vacíos).
+    """
+    datos = [formato, sorted((k, str(v)) for k, v in parametros.items() if v not in (None, ""))]
+    return hashlib.sha256(json.dumps(datos).encode("utf-8")).hexdigest()
+
+
+def marca_de_agua(queryset):
+    """
+    (id más alto, cantidad de filas) del queryset, en una sola consulta.
+    """
+    datos = queryset.aggregate(ultimo_id=Max("id"), total=Count("id"))
+    return datos["ultimo_id"] or 0, datos["total"]
+
+
+class _Contador:
+    # Cuenta las filas a medida que pasan hacia la exportación
+    def __init__(self, filas):
+        self.filas = iter(filas)
+        self.cantidad = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        fila = next(self.filas)
+        self.cantidad += 1
+        return fila
+
+
+def _leer(archivo, tamano):
+    # Lee los primeros ``tamano`` bytes: lo que otra petición agregue después no se envía
+    try:
+        pendiente = tamano
+        while pendiente > 0:
+            datos = archivo.read(min(TAMANO_LECTURA, pendiente))
+            if not datos:
+                return
+            pendiente -= len(datos)
+            yield datos
+    finally:
+        archivo.close()
+
+
+def _servir(guardada):
+    # El archivo se abre ya: si después se reemplaza, esta descarga sigue con el suyo
+    partes = _leer(open(guardada.archivo, "rb"), guardada.tamano)
+    if guardada.formato == "xlsx":
+        return empaquetar_xlsx_bcp(partes, guardada.anchos)
+    return partes
+
+
+def _extender(guardada, nuevas, ultimo_id):
+    """
+    Agrega al archivo guardado solo los movimientos nuevos. Devuelve la
+    exportación actualizada, o None si otra petición la cambió mientras tanto.
+    """
+    with transaction.atomic():
+        actual = ExportacionGuardada.objects.select_for_update().get(pk=guardada.pk)
+        if (actual.ultimo_id, actual.total_filas, actual.archivo) != (
+            guardada.ultimo_id, guardada.total_filas, guardada.archivo
+        ):
+            return None
+
+        filas = _Contador(filas_exportacion(nuevas.order_by("id")))
+        if actual.formato == "xlsx":
+            partes = xml_filas_xlsx(filas, inicio=actual.total_filas + 2)
+        else:
+            partes = contenido_csv(filas, encabezado=False)
+
+        with open(actual.archivo, "r+b") as archivo:
+            # Lo que haya quedado de un intento anterior que falló se descarta
+            archivo.seek(actual.tamano)
+            archivo.truncate()
+            for parte in partes:
+                archivo.write(parte)
+            actual.tamano = archivo.tell()
+
+        actual.ultimo_id = ultimo_id
+        actual.total_filas += filas.cantidad
+        actual.save()
+    return actual
+
+
+def _generar(clave, formato, parametros, queryset, ultimo_id):
+    """
+    Genera la exportación completa, enviándola y guardándola en disco a la vez.
+    Solo se registra si se termina de generar (si se corta la descarga se descarta).
+    """
+    ruta = os.path.join(_directorio(), f"{clave}-{uuid.uuid4().hex}.{formato}")
+    filas = _Contador(filas_exportacion(queryset))
+    anchos = None
+    completo = False
+
+    with open(ruta, "wb") as archivo:
+        def copiar(partes):
+            for parte in partes:
+                archivo.write(parte)
+                yield parte
+
+        try:
+            if formato == "xlsx":
+                # En disco queda solo el XML de las filas, para poder seguir agregando
+                anchos, filas_xlsx = anchos_xlsx(filas)
+                yield from empaquetar_xlsx_bcp(copiar(xml_filas_xlsx(filas_xlsx)), anchos)
+            elif formato == "csv":
+                yield from copiar(contenido_csv(filas))
+            else:
+                yield from copiar(contenido_parquet(filas))
+            completo = True
+        finally:
+            tamano = archivo.tell()
+            archivo.close()
+            if not completo:
+                _borrar_archivo(ruta)
+
+    anterior = ExportacionGuardada.objects.filter(clave=clave).values_list("archivo", flat=True).first()
+    ExportacionGuardada.objects.update_or_create(
+        clave=clave,
+        defaults={
+            "formato": formato,
+            "parametros": parametros,
+            "ultimo_id": ultimo_id,
+            "total_filas": filas.cantidad,
+            "archivo": ruta,
+            "tamano": tamano,
+            "anchos": anchos,
+        },
+    )
+    if anterior and anterior != ruta:
+        _borrar_archivo(anterior)
+
+
+def purgar_exportaciones():
+    """
+    Borra las exportaciones guardadas que no se usan hace más de CADUCIDAD.
+    """
+    viejas = ExportacionGuardada.objects.filter(actualizado__lt=timezone.now() - CADUCIDAD)
+    for ruta in viejas.values_list("archivo", flat=True):
+        _borrar_archivo(ruta)
+    viejas.delete()
+
+
+def exportacion_en_cache(formato, parametros, queryset):
+    """
+    Contenido (bytes por partes) de la exportación de ``queryset`` en
+    ``formato`` ("xlsx", "csv" o "parquet"), usando el archivo guardado para
+    el mismo formato y filtros (``parametros``) si se puede:
+
+    - si la marca de agua (id más alto y cantidad de filas) no cambió, se
+      envía el archivo guardado tal cual;
+    - si solo se agregaron movimientos (id mayor que el guardado y la cantidad
+      cuadra), al archivo se le agregan esas filas (CSV y Excel);
+    - si no, se genera de nuevo y se guarda.
+
+    Las filas se exportan ordenadas por id.
+    """
+    clave = clave_exportacion(formato, parametros)
+    ultimo_id, total = marca_de_agua(queryset)
+    guardada = ExportacionGuardada.objects.filter(clave=clave).first()
+
+    if guardada and guardada.ultimo_id is not None and os.path.exists(guardada.archivo):
+        if (guardada.ultimo_id, guardada.total_filas) == (ultimo_id, total):
+            ExportacionGuardada.objects.filter(pk=guardada.pk).update(actualizado=timezone.now())
+            return _servir(guardada)
+
+        if formato in FORMATOS_EXTENSIBLES and ultimo_id > guardada.ultimo_id:
+            nuevas = queryset.filter(id__gt=guardada.ultimo_id, id__lte=ultimo_id)
+            if guardada.total_filas + nuevas.count() == total:
+                extendida = _extender(guardada, nuevas, ultimo_id)
+                if extendida is not None:
+                    return _servir(extendida)
+
+    purgar_exportaciones()
+    return _generar(clave, formato, parametros, queryset.filter(id__lte=ultimo_id).order_by("id"), ultimo_id)
+
+
+def invalidar_exportaciones():
+    """
+    Obliga a regenerar todas las exportaciones guardadas. Se usa cuando se
+    modifican movimientos ya exportados (eso no cambia la marca de agua).
+    """
+    ExportacionGuardada.objects.filter(ultimo_id__isnull=False).update(ultimo_id=None)
+
+
+@receiver(post_save, sender=BCP)
+def _movimiento_modificado(sender, created, **kwargs):
+    # Un movimiento editado no cambia la marca de agua: se fuerza regenerar todo
+    if not created:
+        invalidar_exportaciones()
@@ -0,0 +1,160 @@
+import math
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from .referidos import obtener_reglas
+
+
+# Tarifa que se aplica si el movimiento no tiene cliente o el cliente no tiene cod_tarifa
+TARIFA_POR_DEFECTO = "TARIFA01"
+
+# A partir de este monto la comisión es porcentual, si no es el costo fijo
+UMBRAL_PORCENTAJE = Decimal('1500')
+
+# Por encima de este valor los enteros escalados podrían desbordar int64
+_LIMITE_INT64 = 2 ** 62
+
+COLUMNAS_CALCULADAS = ["saldo", "comision", "lm_pagar", "ganancia_referido"]
+
+
+def cod_tarifa_efectiva(cliente_obj):
+    """
+    Código de tarifa con el que BCP.calcular_datos calcula la comisión.
+    """
+    if cliente_obj and cliente_obj.cod_tarifa:
+        return cliente_obj.cod_tarifa
+    return TARIFA_POR_DEFECTO
+
+
+def centavos_a_decimal(valor):
+    """
+    Convierte un entero en céntimos a Decimal con 2 decimales.
+    """
+    return Decimal(int(valor)).scaleb(-2)
+
+
+def _a_decimal(valor):
+    if valor is None or valor == "":
+        return Decimal('0.00')
+    if isinstance(valor, Decimal):
+        return valor
+    if isinstance(valor, float) and math.isnan(valor):
+        return Decimal('0.00')
+    return Decimal(str(valor))
+
+
+def _decimales(valores, minimo):
+    # Cantidad de decimales necesaria para representar todos los valores sin pérdida
+    exponentes = [v.as_tuple().exponent for v in valores if v.is_finite()]
+    return max([minimo] + [-e for e in exponentes])
+
+
+def _escalar(valores, decimales):
+    return [int(v.scaleb(decimales)) for v in valores]
+
+
+def _redondear_a_centavos(valores, decimales):
+    """
+    Redondea enteros escalados a 10**-decimales hasta céntimos (ROUND_HALF_EVEN,
+    el mismo redondeo que aplica Django al guardar un DecimalField y el formato .2f).
+    """
+    if decimales == 2:
+        return valores
+    escala = 10 ** (decimales - 2)
+    cociente = valores // escala
+    resto = valores % escala
+    subir = (2 * resto > escala) | ((2 * resto == escala) & (cociente % 2 == 1))
+    return cociente + subir.astype(cociente.dtype)
+
+
+def calcular_datos_lote(df, tarifas, reglas=None):
+    """
+    Versión vectorizada de BCP.calcular_datos para un DataFrame completo.
+
+    ``df`` debe tener las columnas ``monto``, ``saldo_inicial``, ``cod_tarifa``
+    (la tarifa efectiva, ver cod_tarifa_efectiva) y ``codigo_referido`` del
+    cliente. ``tarifas`` es un diccionario cod_tarifa -> TarifaOperacion y
+    ``reglas`` la TablaReferidos (por defecto la del cache, ver referidos.py).
+
+    Todo se calcula con enteros exactos escalados y se devuelve un DataFrame
+    con saldo, comision, lm_pagar y ganancia_referido en céntimos (enteros),
+    idénticos a lo que guardaría el cálculo fila por fila.
+    """
+    if reglas is None:
+        reglas = obtener_reglas()
+
+    montos = [_a_decimal(v) for v in df["monto"]]
+    saldos_iniciales = [_a_decimal(v) for v in df["saldo_inicial"]]
+
+    # Parámetros de las tarifas que aparecen en el lote
+    codigos = pd.Categorical(df["cod_tarifa"])
+    categorias = list(codigos.categories)
+    porcentajes = []
+    fijos = []
+    for cod in categorias:
+        tarifa_obj = tarifas.get(cod)
+        porcentajes.append(_a_decimal(tarifa_obj.costo_por_porcentaje if tarifa_obj else None))
+        fijos.append(_a_decimal(tarifa_obj.costo_fijo if tarifa_obj else None))
+
+    # Escalas: montos y umbrales (dm), porcentajes (dp); la comisión queda en
+    # 10**-(dm + dp) y la ganancia de referido en 10**-dr
+    dm = _decimales(montos + saldos_iniciales + reglas.umbrales + [UMBRAL_PORCENTAJE], 2)
+    dp = _decimales(porcentajes, 4)
+    dp = max(dp, _decimales(fijos, 0) - dm)
+    dc = dm + dp
+    dr = dm + max(_decimales(reglas.porcentajes, 0), _decimales(reglas.fijos, 0) - dm)
+
+    monto_i = _escalar(montos, dm)
+    saldo_ini_i = _escalar(saldos_iniciales, dm)
+    # El último elemento vale 0 y es el que toman las filas sin tarifa (código -1)
+    pct_i = _escalar(porcentajes, dp) + [0]
+    fijo_i = _escalar(fijos, dc) + [0]
+    # Reglas de referido (la última posición es la de "sin regla", todo en 0)
+    umbral_ref_i = _escalar(reglas.umbrales, dm)
+    pct_ref_i = _escalar(reglas.porcentajes, dr - dm)
+    fijo_ref_i = _escalar(reglas.fijos, dr)
+
+    # Cota de los valores intermedios (el doble cubre el redondeo)
+    cota = max([0] + [abs(v) for v in monto_i]) + max([0] + [abs(v) for v in saldo_ini_i])
+    cota = cota * (10 ** max(dp, dr - dm) + max(abs(v) for v in pct_i) + max(abs(v) for v in pct_ref_i))
+    cota = 2 * (cota + max(abs(v) for v in fijo_i) + max(abs(v) for v in fijo_ref_i))
+    cota = max(cota, max(abs(v) for v in umbral_ref_i))
+    dtype = np.int64 if cota < _LIMITE_INT64 else object
+
+    monto_a = np.array(monto_i, dtype=dtype)
+    saldo_ini_a = np.array(saldo_ini_i, dtype=dtype)
+    idx = codigos.codes
+    pct_a = np.array(pct_i, dtype=dtype)[idx]
+    fijo_a = np.array(fijo_i, dtype=dtype)[idx]
+
+    alto = monto_a > int(UMBRAL_PORCENTAJE.scaleb(dm))
+
+    # Saldo
+    saldo = monto_a + saldo_ini_a
+
+    # Comisión y LM a pagar
+    comision = np.where(alto, monto_a * pct_a, fijo_a)
+    lm_pagar = saldo * 10 ** dp - comision
+
+    # Ganancia de referido
+    # El código se busca en la tabla una sola vez por valor distinto, no por fila
+    referidos = pd.Categorical(df["codigo_referido"])
+    posiciones = [reglas.posicion(c) for c in referidos.categories] + [reglas.sin_regla]
+    pos = np.array(posiciones, dtype=np.intp)[referidos.codes]
+    ganancia = np.where(
+        monto_a > np.array(umbral_ref_i, dtype=dtype)[pos],
+        monto_a * np.array(pct_ref_i, dtype=dtype)[pos],
+        np.array(fijo_ref_i, dtype=dtype)[pos],
+    ).astype(dtype)
+
+    return pd.DataFrame(
+        {
+            "saldo": _redondear_a_centavos(saldo, dm),
+            "comision": _redondear_a_centavos(comision.astype(dtype), dc),
+            "lm_pagar": _redondear_a_centavos(lm_pagar.astype(dtype), dc),
+            "ganancia_referido": _redondear_a_centavos(ganancia, dr),
+        },
+        index=df.index,
+    )
@@ -0,0 +1,72 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Segundos máximos que se usa un catálogo sin volver a leerlo
+# (las tablas también se pueden modificar fuera de Django)
+TTL_POR_DEFECTO = 300
+
+
+class CatalogoEnCache:
+    """
+    Tabla pequeña que se lee una vez y se guarda en memoria del proceso.
+
+    ``cargar`` es la función que la lee de la base de datos. La versión se
+    publica en el cache de Django (BANCO_TARIFAS_CACHE); con un cache
+    compartido (Redis, Memcached, base de datos) todos los workers ven la
+    misma, y al invalidar todos vuelven a leer. BANCO_TARIFAS_TTL limita
+    cuánto se usa sin releer.
+
+    El valor se comparte entre hilos y no se debe modificar.
+    """
+
+    def __init__(self, clave, cargar):
+        self.clave = clave
+        self.cargar = cargar
+        self._lock = threading.Lock()
+        self._valor = None
+        self._version = None
+        self._cargado = 0.0
+
+    def _cache(self):
+        return caches[getattr(settings, "BANCO_TARIFAS_CACHE", "default")]
+
+    def _version_compartida(self):
+        version = self._cache().get(self.clave)
+        if version is None:
+            version = uuid.uuid4().hex
+            # add no pisa la versión si otro worker la publicó primero
+            self._cache().add(self.clave, version, timeout=None)
+            version = self._cache().get(self.clave, version)
+        return version
+
+    def obtener(self):
+        """
+        Devuelve el catálogo, leyéndolo de nuevo solo si cambió la versión o pasó el TTL.
+        """
+        version = self._version_compartida()
+        ttl = getattr(settings, "BANCO_TARIFAS_TTL", TTL_POR_DEFECTO)
+        with self._lock:
+            vigente = (
+                self._valor is not None
+                and self._version == version
+                and time.monotonic() - self._cargado < ttl
+            )
+            if not vigente:
+                self._valor = self.cargar()
+                self._version = version
+                self._cargado = time.monotonic()
+            return self._valor
+
+    def invalidar(self):
+        """
+        Publica una versión nueva: este proceso y los demás workers vuelven a
+        leer el catálogo en la siguiente llamada a obtener.
+        """
+        self._cache().set(self.clave, uuid.uuid4().hex, timeout=None)
+        with self._lock:
+            self._valor = None
@@ -0,0 +1,58 @@
+from django.db.models import Q
+
+from .models import Cliente
+
+
+# Resultados del autocompletado de clientes
+LIMITE_AUTOCOMPLETAR = 20
+MAX_AUTOCOMPLETAR = 50
+
+CAMPOS_AUTOCOMPLETAR = ["cod_cliente", "dni", "nombre", "apellidos", "cod_tarifa"]
+
+
+def _filtros_prefijo(termino):
+    """
+    (filtro, orden) por índice de CLIENTE (COD_CLIENTE, DNI, NOMBRE,
+    APELLIDOS): todos son por prefijo (LIKE 'termino%') y se ordenan por la
+    misma columna, así cada uno se resuelve leyendo solo el comienzo del
+    rango en su índice, nunca recorriendo la tabla.
+    """
+    filtros = [(Q(cod_cliente__istartswith=termino), "cod_cliente")]
+    if termino.isdigit():
+        filtros.append((Q(dni__startswith=termino), "dni"))
+        return filtros
+
+    filtros += [(Q(nombre__istartswith=termino), "nombre"), (Q(apellidos__istartswith=termino), "apellidos")]
+    palabras = termino.split()
+    if len(palabras) > 1:
+        # "Juan Pérez": nombre que empieza con la primera palabra y apellidos con el resto
+        filtros.append((
+            Q(nombre__istartswith=palabras[0], apellidos__istartswith=" ".join(palabras[1:])), "nombre"
+        ))
+    return filtros
+
+
+def buscar_clientes(termino, limite=LIMITE_AUTOCOMPLETAR):
+    """
+    Clientes cuyo código, DNI, nombre o apellidos empiezan con ``termino``,
+    como diccionarios (CAMPOS_AUTOCOMPLETAR) ordenados por código.
+
+    Cada filtro de _filtros_prefijo es una consulta aparte con TOP ``limite``
+    (un OR de todos obligaría a SQL Server a recorrer CLIENTE), así que el
+    costo depende de ``limite`` y no de la cantidad de clientes.
+    """
+    termino = " ".join((termino or "").split())
+    limite = max(1, min(limite, MAX_AUTOCOMPLETAR))
+    if not termino:
+        return []
+
+    encontrados = {}
+    for filtro, orden in _filtros_prefijo(termino):
+        for cliente in Cliente.objects.filter(filtro).order_by(orden).values(*CAMPOS_AUTOCOMPLETAR)[:limite]:
+            encontrados.setdefault(cliente["cod_cliente"], cliente)
+    return [encontrados[cod] for cod in sorted(encontrados)[:limite]]
+
+
+def texto_cliente(cliente):
+    # Lo que se muestra en el selector: igual que Cliente.__str__ más el DNI
+    return f"{cliente['cod_cliente']} - {cliente['nombre']} {cliente['apellidos']} (DNI {cliente['dni']})"
@@ -0,0 +1,462 @@
+import re
+import sys
+import threading
+import time
+import uuid
+from array import array
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Cliente
+
+
+# Tipos de patrón y la confianza de encontrar cada uno en la descripción
+DNI = "dni"
+COD_CLIENTE = "cod_cliente"
+NOMBRE = "nombre"
+NOMBRE_INVERTIDO = "apellidos_nombre"
+DNI_PARCIAL = "dni_parcial"
+
+TIPOS = (DNI, COD_CLIENTE, NOMBRE, NOMBRE_INVERTIDO)
+
+CONFIANZA = {
+    DNI: 1.0,
+    COD_CLIENTE: 0.95,
+    NOMBRE: 0.85,
+    NOMBRE_INVERTIDO: 0.8,
+    # Los últimos 8 dígitos de un número más largo al final (la regla anterior, extraer_dni)
+    DNI_PARCIAL: 0.7,
+}
+# El DNI suele ir al final de la descripción; en otra posición vale un poco menos
+CONFIANZA_DNI_EN_MEDIO = 0.9
+# Patrón de varios clientes (homónimos), o dos clientes distintos con la misma confianza
+FACTOR_AMBIGUO = 0.5
+# Por debajo de esta confianza no se asigna el cliente (settings.BANCO_CONFIANZA_MINIMA_CLIENTE)
+CONFIANZA_MINIMA = 0.6
+
+# Códigos de cliente más cortos no se buscan: aparecerían dentro de cualquier texto
+LETRAS_MINIMAS_CODIGO = 4
+
+# Segundos que se usa el índice sin volver a leer CLIENTE completo
+# (la tabla también se modifica fuera de Django)
+TTL_INDICE = 3600
+# Cambios que se aplican uno por uno; si hay más, se vuelve a leer todo
+MAX_CAMBIOS_INCREMENTALES = 1000
+# Secuencias nuevas que van en un autómata aparte antes de rearmar el principal
+MAX_SECUENCIAS_PENDIENTES = 500
+
+CLAVE_GENERACION = "banco:clientes:generacion"
+CLAVE_VERSION = "banco:clientes:version"
+CLAVE_CAMBIO = "banco:clientes:cambio:"
+
+Coincidencia = namedtuple("Coincidencia", ["cliente_id", "tipo", "confianza"])
+
+_SIN_TILDES = str.maketrans("ÁÉÍÓÚÜÀÈÌÒÙÂÊÎÔÛÄËÏÖ", "AEIOUUAEIOUAEIOUAEIO")
+# Palabras y números por separado: "PAGO DNI40000001" -> PAGO, DNI, 40000001
+_PALABRAS = re.compile(r"[0-9]+|[A-ZÑ]+")
+# DNI de 8 dígitos al final de la descripción de la operación
+DNI_REGEX = re.compile(r"(\d{8})$")
+
+
+def palabras(texto):
+    """
+    Texto normalizado como tupla de palabras: mayúsculas, sin tildes ni
+    signos, con letras y números separados.
+    """
+    texto = str(texto or "").upper()
+    if not texto.isascii():
+        texto = texto.translate(_SIN_TILDES)
+    return tuple(_PALABRAS.findall(texto))
+
+
+def extraer_dni(descripcion):
+    """
+    Devuelve el DNI (últimos 8 dígitos) de la descripción, o None.
+    """
+    if not isinstance(descripcion, str):
+        return None
+    match = DNI_REGEX.search(descripcion)
+    return match.group(1) if match else None
+
+
+def patrones_cliente(dni, cod_cliente, nombre, apellidos):
+    """
+    (tipo, palabras) que identifican al cliente en una descripción.
+    """
+    patrones = []
+    dni = _palabras_compartidas(dni)
+    if len(dni) == 1 and len(dni[0]) == 8 and dni[0].isdigit():
+        patrones.append((DNI, dni))
+    codigo = _palabras_compartidas(cod_cliente)
+    if sum(len(p) for p in codigo) >= LETRAS_MINIMAS_CODIGO:
+        patrones.append((COD_CLIENTE, codigo))
+    nombres = _palabras_compartidas(nombre)
+    apellidos = _palabras_compartidas(apellidos)
+    if nombres and apellidos:
+        patrones.append((NOMBRE, nombres + apellidos))
+        patrones.append((NOMBRE_INVERTIDO, apellidos + nombres))
+    return patrones
+
+
+def _palabras_compartidas(texto):
+    # Los nombres se repiten entre clientes: una sola copia de cada palabra en memoria
+    return tuple(sys.intern(p) for p in palabras(texto))
+
+
+class _Automata:
+    """
+    Autómata de Aho-Corasick sobre palabras: encuentra todas las secuencias
+    de ``secuencias`` que aparecen en un texto recorriéndolo una sola vez,
+    sin importar cuántas secuencias haya. Una secuencia se identifica por su
+    posición en la lista.
+
+    Para ocupar poco con muchos clientes, los estados con una sola
+    transición (casi todos: los nombres son cadenas sin ramas) la guardan
+    como tupla (palabra, estado) en lugar de un diccionario.
+    """
+
+    def __init__(self, secuencias):
+        # Por estado: transiciones (None si no tiene), estado de falla y secuencias que terminan ahí
+        siguiente = [{}]
+        salida = [()]
+        for id_secuencia, secuencia in enumerate(secuencias):
+            estado = 0
+            for palabra in secuencia:
+                hijos = siguiente[estado]
+                if hijos is None:
+                    hijos = siguiente[estado] = {}
+                nuevo = hijos.get(palabra)
+                if nuevo is None:
+                    nuevo = hijos[palabra] = len(siguiente)
+                    siguiente.append(None)
+                    salida.append(())
+                estado = nuevo
+            salida[estado] += (id_secuencia,)
+
+        # Fallas por niveles: la del hijo es el sufijo más largo que también es prefijo
+        falla = array("l", [0]) * len(siguiente)
+        cola = deque(siguiente[0].values())
+        while cola:
+            estado = cola.popleft()
+            for palabra, hijo in (siguiente[estado] or {}).items():
+                anterior = falla[estado]
+                while anterior and palabra not in (siguiente[anterior] or ()):
+                    anterior = falla[anterior]
+                destino = (siguiente[anterior] or {}).get(palabra, 0)
+                falla[hijo] = destino
+                if salida[destino]:
+                    salida[hijo] += salida[destino]
+                cola.append(hijo)
+
+        for estado in range(1, len(siguiente)):
+            hijos = siguiente[estado]
+            if hijos is not None and len(hijos) == 1:
+                siguiente[estado] = next(iter(hijos.items()))
+        self.siguiente = siguiente
+        self.falla = falla
+        self.salida = salida
+
+    def buscar(self, texto):
+        """
+        (id de secuencia, posición de su última palabra) de cada aparición en ``texto``.
+        """
+        siguiente = self.siguiente
+        falla = self.falla
+        salida = self.salida
+        estado = 0
+        encontradas = []
+        for posicion, palabra in enumerate(texto):
+            while True:
+                hijos = siguiente[estado]
+                if hijos is not None:
+                    if hijos.__class__ is tuple:
+                        if hijos[0] == palabra:
+                            estado = hijos[1]
+                            break
+                    else:
+                        nuevo = hijos.get(palabra)
+                        if nuevo is not None:
+                            estado = nuevo
+                            break
+                if not estado:
+                    break
+                estado = falla[estado]
+            for id_secuencia in salida[estado]:
+                encontradas.append((id_secuencia, posicion))
+        return encontradas
+
+
+class IndiceClientes:
+    """
+    Índice en memoria para encontrar al cliente de una descripción de
+    operación por su DNI, su COD_CLIENTE o su nombre, en cualquier parte del
+    texto (ver patrones_cliente).
+
+    Los patrones de todos los clientes van a un solo autómata (_Automata),
+    así cada descripción se recorre una vez. Agregar o quitar clientes
+    (agregar, quitar) cambia solo sus patrones: las secuencias de palabras
+    nuevas van a un autómata chico de pendientes y el principal se rearma
+    (en memoria, sin leer la base de datos) recién cuando se juntan
+    MAX_SECUENCIAS_PENDIENTES.
+    """
+
+    def __init__(self, clientes=()):
+        # palabras -> códigos (cliente_id * len(TIPOS) + posición del tipo)
+        self._patrones = {}
+        # id -> secuencias del cliente
+        self._por_cliente = {}
+        self._secuencias = []
+        self._automata = None
+        self._pendientes = []
+        self._automata_pendientes = None
+        self._lock = threading.Lock()
+        for cliente in clientes:
+            self.agregar(*cliente)
+
+    def __len__(self):
+        return len(self._por_cliente)
+
+    def agregar(self, cliente_id, dni, cod_cliente, nombre, apellidos):
+        """
+        Agrega (o reemplaza) un cliente con sus datos de CLIENTE.
+        """
+        with self._lock:
+            self._quitar(cliente_id)
+            secuencias = []
+            for tipo, secuencia in patrones_cliente(dni, cod_cliente, nombre, apellidos):
+                codigos = self._patrones.get(secuencia)
+                if codigos is None:
+                    codigos = ()
+                    self._pendientes.append(secuencia)
+                    self._automata_pendientes = None
+                self._patrones[secuencia] = codigos + (cliente_id * len(TIPOS) + TIPOS.index(tipo),)
+                secuencias.append(secuencia)
+            self._por_cliente[cliente_id] = tuple(secuencias)
+
+    def quitar(self, cliente_id):
+        with self._lock:
+            self._quitar(cliente_id)
+
+    def _quitar(self, cliente_id):
+        # La secuencia queda en el autómata sin clientes hasta que se vuelva a armar
+        for secuencia in self._por_cliente.pop(cliente_id, ()):
+            self._patrones[secuencia] = tuple(
+                c for c in self._patrones[secuencia] if c // len(TIPOS) != cliente_id
+            )
+
+    def _compilar(self):
+        # Se llama con el lock tomado; de paso se descartan los patrones sin clientes
+        self._patrones = {secuencia: codigos for secuencia, codigos in self._patrones.items() if codigos}
+        self._secuencias = list(self._patrones)
+        self._automata = _Automata(self._secuencias)
+        self._pendientes = []
+        self._automata_pendientes = _Automata([])
+
+    def coincidencias(self, descripciones):
+        """
+        Coincidencia (cliente_id, tipo, confianza) con el cliente más probable
+        de cada descripción, o None si no aparece ninguno.
+
+        Un mismo cliente encontrado por dos patrones suma confianza; dos
+        clientes distintos con la misma confianza se consideran ambiguos
+        (FACTOR_AMBIGUO). Si en todo el texto no aparece ningún patrón se
+        prueba la regla anterior: los 8 dígitos del final como DNI.
+        """
+        # Con el lock: agregar y quitar no cambian los patrones a mitad de la búsqueda
+        with self._lock:
+            if self._automata is None or len(self._pendientes) > MAX_SECUENCIAS_PENDIENTES:
+                self._compilar()
+            elif self._automata_pendientes is None:
+                self._automata_pendientes = _Automata(self._pendientes)
+            # Las descripciones se repiten mucho (comisiones, ITF...): cada una se busca una vez
+            resultados = {}
+            return [
+                resultados[d] if d in resultados else resultados.setdefault(d, self._mejor(d))
+                for d in descripciones
+            ]
+
+    def coincidencia(self, descripcion):
+        return self.coincidencias([descripcion])[0]
+
+    def _clientes(self, secuencia):
+        # {tipo: [ids]} de los clientes con ese patrón
+        por_tipo = {}
+        for codigo in self._patrones.get(secuencia, ()):
+            cliente_id, tipo = divmod(codigo, len(TIPOS))
+            por_tipo.setdefault(TIPOS[tipo], []).append(cliente_id)
+        return por_tipo
+
+    def _mejor(self, descripcion):
+        texto = palabras(descripcion)
+        candidatos = {}
+        encontradas = [(self._secuencias[i], p) for i, p in self._automata.buscar(texto)]
+        if self._pendientes:
+            encontradas += [(self._pendientes[i], p) for i, p in self._automata_pendientes.buscar(texto)]
+        for secuencia, posicion in encontradas:
+            for tipo, ids in self._clientes(secuencia).items():
+                confianza = CONFIANZA[tipo]
+                if tipo == DNI:
+                    if posicion != len(texto) - 1:
+                        confianza = CONFIANZA_DNI_EN_MEDIO
+                    # DNI repetido en CLIENTE: el de menor id, como la búsqueda por DNI de siempre
+                    ids = [min(ids)]
+                elif len(ids) > 1:
+                    confianza *= FACTOR_AMBIGUO
+                for cliente_id in ids:
+                    self._sumar(candidatos, cliente_id, tipo, confianza, posicion)
+
+        if not candidatos:
+            dni = extraer_dni(descripcion)
+            ids = self._clientes((dni,)).get(DNI) if dni else None
+            if not ids:
+                return None
+            return Coincidencia(min(ids), DNI_PARCIAL, CONFIANZA[DNI_PARCIAL])
+
+        # Mayor confianza; a igual confianza, el que aparece más a la derecha
+        orden = sorted(candidatos.items(), key=lambda c: (c[1][0], c[1][2]), reverse=True)
+        cliente_id, (confianza, tipo, _) = orden[0]
+        if len(orden) > 1 and orden[1][1][0] == confianza:
+            confianza *= FACTOR_AMBIGUO
+        return Coincidencia(cliente_id, tipo, round(confianza, 3))
+
+    @staticmethod
+    def _sumar(candidatos, cliente_id, tipo, confianza, posicion):
+        anterior = candidatos.get(cliente_id)
+        if anterior is None:
+            candidatos[cliente_id] = (confianza, tipo, posicion)
+            return
+        # Dos pruebas del mismo cliente: 1 - (1 - a)(1 - b), con el tipo de la más fuerte
+        total = 1 - (1 - anterior[0]) * (1 - confianza)
+        if confianza > anterior[0]:
+            candidatos[cliente_id] = (total, tipo, posicion)
+        else:
+            candidatos[cliente_id] = (total, anterior[1], max(anterior[2], posicion))
+
+
+def _datos_clientes(queryset):
+    return queryset.values_list("id", "dni", "cod_cliente", "nombre", "apellidos").iterator(chunk_size=5000)
+
+
+class _IndiceCompartido:
+    """
+    El IndiceClientes del proceso. Se arma una vez leyendo CLIENTE y después
+    se mantiene con los cambios publicados en el cache de Django
+    (BANCO_TARIFAS_CACHE): cada cambio guarda los ids de los clientes
+    modificados bajo un número de versión, y cada worker relee solo esos
+    clientes. Si faltan cambios, pasó BANCO_INDICE_CLIENTES_TTL o se llamó a
+    invalidar, se vuelve a leer CLIENTE completo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indice = None
+        self._generacion = None
+        self._version = 0
+        self._cargado = 0.0
+
+    def _cache(self):
+        return caches[getattr(settings, "BANCO_TARIFAS_CACHE", "default")]
+
+    def _estado_compartido(self):
+        cache = self._cache()
+        generacion = cache.get(CLAVE_GENERACION)
+        if generacion is None:
+            cache.add(CLAVE_GENERACION, uuid.uuid4().hex, timeout=None)
+            generacion = cache.get(CLAVE_GENERACION)
+        return generacion, cache.get(CLAVE_VERSION, 0)
+
+    def obtener(self):
+        generacion, version = self._estado_compartido()
+        ttl = getattr(settings, "BANCO_INDICE_CLIENTES_TTL", TTL_INDICE)
+        with self._lock:
+            vigente = (
+                self._indice is not None
+                and self._generacion == generacion
+                and time.monotonic() - self._cargado < ttl
+            )
+            if vigente and version != self._version:
+                vigente = self._aplicar_cambios(version)
+            if not vigente:
+                self._indice = IndiceClientes(_datos_clientes(Cliente.objects.all()))
+                self._generacion = generacion
+                self._cargado = time.monotonic()
+            self._version = version
+            return self._indice
+
+    def _aplicar_cambios(self, version):
+        if not 0 < version - self._version <= MAX_CAMBIOS_INCREMENTALES:
+            return False
+        claves = [f"{CLAVE_CAMBIO}{n}" for n in range(self._version + 1, version + 1)]
+        cambios = self._cache().get_many(claves)
+        if len(cambios) != len(claves):
+            return False
+        ids = {cliente_id for cambio in cambios.values() for cliente_id in cambio}
+        encontrados = set()
+        for cliente in _datos_clientes(Cliente.objects.filter(id__in=ids)):
+            self._indice.agregar(*cliente)
+            encontrados.add(cliente[0])
+        for cliente_id in ids - encontrados:
+            self._indice.quitar(cliente_id)
+        return True
+
+    def registrar_cambios(self, ids):
+        cache = self._cache()
+        cache.add(CLAVE_VERSION, 0, timeout=None)
+        try:
+            version = cache.incr(CLAVE_VERSION)
+        except ValueError:
+            # El cache perdió la versión: que todos lean CLIENTE completo
+            self.invalidar()
+            return
+        cache.set(f"{CLAVE_CAMBIO}{version}", sorted(ids), timeout=getattr(
+            settings, "BANCO_INDICE_CLIENTES_TTL", TTL_INDICE
+        ))
+
+    def invalidar(self):
+        self._cache().set(CLAVE_GENERACION, uuid.uuid4().hex, timeout=None)
+        with self._lock:
+            self._indice = None
+
+
+_indice = _IndiceCompartido()
+
+
+def obtener_indice_clientes():
+    """
+    IndiceClientes con todos los clientes, al día con los cambios hechos
+    desde Django en cualquier worker.
+    """
+    return _indice.obtener()
+
+
+def clientes_modificados(ids):
+    """
+    Avisa a todos los workers que cambiaron (o se borraron) estos clientes:
+    cada uno actualiza solo esos en su índice.
+    """
+    _indice.registrar_cambios(ids)
+
+
+def invalidar_indice_clientes():
+    """
+    Hace que todos los workers vuelvan a leer CLIENTE completo (por ejemplo
+    después de una carga masiva que no pasa por save).
+    """
+    _indice.invalidar()
+
+
+def confianza_minima():
+    return getattr(settings, "BANCO_CONFIANZA_MINIMA_CLIENTE", CONFIANZA_MINIMA)
+
+
+@receiver(post_save, sender=Cliente)
+@receiver(post_delete, sender=Cliente)
+def _cliente_modificado(sender, instance, **kwargs):
+    # Después del commit, para que los demás workers lean el dato nuevo
+    cliente_id = instance.pk
+    transaction.on_commit(lambda: clientes_modificados([cliente_id]))
@@ -0,0 +1,168 @@
+import csv
+import io
+from decimal import Decimal
+from itertools import chain, islice
+
+from .models import BCP
+from .xlsx_streaming import MAX_FILAS_HOJA, SalidaEnPartes, anchos_por_muestra, empaquetar_xlsx, filas_xml
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: solo lo necesita la exportación Parquet
+    pa = pq = None
+
+
+# Columnas de la exportación: (campo de BCP, nombre en CSV/Parquet, encabezado en Excel, tipo)
+# cliente_id y tarifa_id ya son COD_CLIENTE y COD_TARIFA (to_field), no hace falta el join.
+COLUMNAS_EXPORTACION = [
+    ("cod_bcp", "cod_bcp", "Código BCP", "texto"),
+    ("fecha", "fecha", "Fecha", "fecha"),
+    ("fecha_valuta", "fecha_valuta", "Fecha Valuta", "fecha"),
+    ("descripcion", "descripcion", "Descripción", "texto"),
+    ("monto", "monto", "Monto", "dinero"),
+    ("sucursal_agencia", "sucursal_agencia", "Sucursal/Agencia", "texto"),
+    ("n_operacion", "n_operacion", "N° Operación", "texto"),
+    ("usuario", "usuario", "Usuario", "texto"),
+    ("saldo", "saldo", "Saldo", "dinero"),
+    ("comision", "comision", "Comisión", "dinero"),
+    ("lm_pagar", "lm_pagar", "LM Pagar", "dinero"),
+    ("codigo", "codigo", "Código", "texto"),
+    ("ganancia_referido", "ganancia_referido", "Ganancia Referido", "dinero"),
+    ("cliente_id", "cod_cliente", "Cliente", "texto"),
+    ("tarifa_id", "cod_tarifa", "Tarifa", "texto"),
+]
+
+CAMPOS_EXPORTACION = [c[0] for c in COLUMNAS_EXPORTACION]
+
+# Filas que se leen de la base de datos por consulta (cursor del iterator)
+TAMANO_BLOQUE_EXPORTACION = 2000
+
+# Filas que se miran para calcular el ancho de las columnas
+FILAS_MUESTRA_ANCHO = 1000
+
+# Filas por grupo (row group) del archivo Parquet
+FILAS_GRUPO_PARQUET = 20000
+
+_DINERO = [n for n, c in enumerate(COLUMNAS_EXPORTACION) if c[3] == "dinero"]
+
+
+def filas_exportacion(queryset=None):
+    """
+    Recorre los movimientos BCP como tuplas en el orden de COLUMNAS_EXPORTACION.
+
+    Es una sola consulta que trae solo las columnas exportadas (values_list)
+    y se lee por bloques con iterator, sin crear instancias del modelo ni
+    guardar el resultado en memoria. Los montos vienen como Decimal (0 si son nulos).
+    """
+    if queryset is None:
+        queryset = BCP.objects.all()
+    filas = queryset.values_list(*CAMPOS_EXPORTACION).iterator(chunk_size=TAMANO_BLOQUE_EXPORTACION)
+    for fila in filas:
+        fila = list(fila)
+        for n in _DINERO:
+            fila[n] = fila[n] or Decimal('0.00')
+        fila[-2] = fila[-2] or ""
+        fila[-1] = fila[-1] or ""
+        yield tuple(fila)
+
+
+def _bloques(filas, tamano):
+    filas = iter(filas)
+    while True:
+        bloque = list(islice(filas, tamano))
+        if not bloque:
+            return
+        yield bloque
+
+
+def anchos_xlsx(filas):
+    """
+    Anchos de columna del Excel calculados con las primeras FILAS_MUESTRA_ANCHO
+    filas. Devuelve (anchos, filas): las filas de la muestra siguen incluidas.
+    """
+    filas = iter(filas)
+    muestra = list(islice(filas, FILAS_MUESTRA_ANCHO))
+    return anchos_por_muestra([c[2] for c in COLUMNAS_EXPORTACION], muestra), chain(muestra, filas)
+
+
+def limitar_filas_xlsx(queryset):
+    """
+    Una hoja de Excel admite MAX_FILAS_HOJA filas contando el encabezado: si
+    ``queryset`` tiene más movimientos se exportan los primeros por id.
+    Devuelve (queryset, cantidad de movimientos que quedan afuera).
+    """
+    maximo = MAX_FILAS_HOJA - 1
+    total = queryset.count()
+    if total <= maximo:
+        return queryset, 0
+    corte = queryset.order_by("id").values_list("id", flat=True)[maximo - 1]
+    return queryset.filter(id__lte=corte), total - maximo
+
+
+def xml_filas_xlsx(filas, inicio=2):
+    """
+    XML de las filas de la hoja BCP (ver xlsx_streaming.filas_xml).
+    """
+    return filas_xml(filas, [c[3] for c in COLUMNAS_EXPORTACION], inicio=inicio)
+
+
+def empaquetar_xlsx_bcp(partes_xml, anchos):
+    """
+    Excel de BCP a partir del XML de las filas, generado por partes.
+    """
+    return empaquetar_xlsx([c[2] for c in COLUMNAS_EXPORTACION], partes_xml, anchos=anchos, titulo="BCP")
+
+
+def contenido_csv(filas, encabezado=True):
+    """
+    Genera el CSV de BCP por partes (texto UTF-8), un bloque de filas a la vez.
+    Fechas en formato ISO y montos con punto decimal, sin formato de miles.
+    Con encabezado=False solo salen las filas (para agregarlas a un CSV existente).
+    """
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    if encabezado:
+        escritor.writerow([c[1] for c in COLUMNAS_EXPORTACION])
+    for bloque in _bloques(filas, TAMANO_BLOQUE_EXPORTACION):
+        escritor.writerows(bloque)
+        yield salida.getvalue().encode("utf-8")
+        salida.seek(0)
+        salida.truncate()
+    datos = salida.getvalue()
+    if datos:
+        yield datos.encode("utf-8")
+
+
+def parquet_disponible():
+    return pq is not None
+
+
+def _esquema_arrow():
+    tipos = {
+        "texto": pa.string(),
+        "fecha": pa.date32(),
+        "dinero": pa.decimal128(18, 2),
+    }
+    return pa.schema([(c[1], tipos[c[3]]) for c in COLUMNAS_EXPORTACION])
+
+
+def contenido_parquet(filas):
+    """
+    Genera el archivo Parquet de BCP por partes: cada FILAS_GRUPO_PARQUET
+    filas se pasan a columnas y se escriben como un row group. Requiere pyarrow.
+    """
+    if not parquet_disponible():
+        raise RuntimeError("La exportación Parquet necesita pyarrow instalado.")
+
+    esquema = _esquema_arrow()
+    salida = SalidaEnPartes()
+    with pq.ParquetWriter(salida, esquema, compression="snappy") as escritor:
+        for bloque in _bloques(filas, FILAS_GRUPO_PARQUET):
+            columnas = [
+                pa.array(valores, type=campo.type)
+                for valores, campo in zip(zip(*bloque), esquema)
+            ]
+            escritor.write_table(pa.Table.from_arrays(columnas, schema=esquema))
+            yield salida.vaciar()
+    yield salida.vaciar()
@@ -1,12 +1,47 @@
 from django import forms
+from django.urls import reverse_lazy
+from .listado import CAMPOS_LISTADO, MAX_PAGINA_LISTADO, TAMANO_PAGINA_LISTADO, CursorInvalido, decodificar_cursor
 from .models import Cliente, TarifaOperacion
 
+class SelectAutocompletar(forms.Select):
+    """
+    <select> para un ModelChoiceField que solo trae de la base de datos la
+    opción elegida; las demás se buscan desde el navegador (select2) en
+    ``url``, que responde como autocompletar_clientes. Así la página no
+    crece con la tabla.
+    """
+
+    def __init__(self, url, attrs=None):
+        super().__init__(attrs)
+        self.url = url
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs["data-autocompletar"] = str(self.url)
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        campo = self.choices.field
+        opciones = [self.create_option(name, "", campo.empty_label or "", False, 0)]
+        elegidos = [v for v in value if v]
+        if elegidos:
+            filtro = {f"{campo.to_field_name or 'pk'}__in": elegidos}
+            for i, obj in enumerate(campo.queryset.filter(**filtro), start=1):
+                opciones.append(self.create_option(
+                    name, campo.prepare_value(obj), campo.label_from_instance(obj), True, i, attrs=attrs
+                ))
+        return [(None, opciones, 0)]
+
+
 class UploadExcelForm(forms.Form):
     archivo = forms.FileField(label="Archivo Excel (.xlsx)")
 
-    # Selección de cliente por defecto (aplicará a todas las filas si no cambian en la preview)
+    # Selección de cliente por defecto (aplicará a todas las filas si no cambian en la preview).
+    # Por COD_CLIENTE y con autocompletado: no se cargan todos los clientes en la página
     cliente = forms.ModelChoiceField(
         queryset=Cliente.objects.all(),
+        to_field_name="cod_cliente",
+        widget=SelectAutocompletar(reverse_lazy("banco:autocompletar_clientes")),
         required=False,
         label="Cliente (por defecto)"
     )
@@ -22,3 +57,117 @@ class UploadExcelForm(forms.Form):
         max_digits=18, decimal_places=2, required=False, initial=0,
         label="Saldo inicial (por defecto)"
     )
+
+
+class FiltroExportacionForm(forms.Form):
+    """
+    Filtros de la exportación de BCP (parámetros GET). Todos son opcionales;
+    sin filtros se exporta toda la tabla.
+    """
+    fecha_desde = forms.DateField(required=False, label="Fecha desde")
+    fecha_hasta = forms.DateField(required=False, label="Fecha hasta")
+    fecha_valuta_desde = forms.DateField(required=False, label="Fecha valuta desde")
+    fecha_valuta_hasta = forms.DateField(required=False, label="Fecha valuta hasta")
+    # Códigos, no ModelChoiceField: así no se cargan todos los clientes para validar
+    cliente = forms.CharField(max_length=100, required=False, label="Cliente (COD_CLIENTE)")
+    tarifa = forms.CharField(max_length=100, required=False, label="Tarifa (COD_TARIFA)")
+    codigo = forms.CharField(max_length=4, required=False, label="Código")
+    n_operacion = forms.CharField(max_length=50, required=False, label="N° Operación")
+
+    def clean(self):
+        datos = super().clean()
+        for campo in ("fecha", "fecha_valuta"):
+            desde = datos.get(f"{campo}_desde")
+            hasta = datos.get(f"{campo}_hasta")
+            if desde and hasta and desde > hasta:
+                self.add_error(f"{campo}_hasta", "Debe ser igual o posterior a la fecha desde.")
+        return datos
+
+    def filtrar(self, queryset):
+        """
+        Aplica los filtros al queryset de BCP. Cada filtro usa un índice de
+        BCP: fecha, (COD_CLIENTE, fecha), COD_TARIFA o n_operacion.
+        """
+        datos = self.cleaned_data
+        filtros = {
+            "fecha__gte": datos.get("fecha_desde"),
+            "fecha__lte": datos.get("fecha_hasta"),
+            "fecha_valuta__gte": datos.get("fecha_valuta_desde"),
+            "fecha_valuta__lte": datos.get("fecha_valuta_hasta"),
+            "cliente_id": datos.get("cliente"),
+            "tarifa_id": datos.get("tarifa"),
+            "codigo": datos.get("codigo"),
+            "n_operacion": datos.get("n_operacion"),
+        }
+        return queryset.filter(**{k: v for k, v in filtros.items() if v})
+
+
+class ListadoBCPForm(FiltroExportacionForm):
+    """
+    Parámetros GET del listado de BCP: los filtros de la exportación más
+    ``cursor`` (el ``siguiente`` de la página anterior), ``limite`` y
+    ``campos`` (nombres separados por coma, ver listado.CAMPOS_LISTADO).
+    """
+    cursor = forms.CharField(required=False)
+    limite = forms.IntegerField(required=False, min_value=1, max_value=MAX_PAGINA_LISTADO)
+    campos = forms.CharField(required=False)
+
+    def clean_cursor(self):
+        cursor = self.cleaned_data.get("cursor")
+        if cursor:
+            try:
+                decodificar_cursor(cursor)
+            except CursorInvalido as e:
+                raise forms.ValidationError(str(e))
+        return cursor
+
+    def clean_limite(self):
+        return self.cleaned_data.get("limite") or TAMANO_PAGINA_LISTADO
+
+    def clean_campos(self):
+        campos = [c.strip() for c in (self.cleaned_data.get("campos") or "").split(",") if c.strip()]
+        desconocidos = [c for c in campos if c not in CAMPOS_LISTADO]
+        if desconocidos:
+            raise forms.ValidationError(
+                f"Campos desconocidos: {', '.join(desconocidos)}. Disponibles: {', '.join(CAMPOS_LISTADO)}."
+            )
+        return list(dict.fromkeys(campos))
+
+
+class FiltroResumenForm(forms.Form):
+    """
+    Filtros del reporte de ResumenDiario (parámetros GET). ``agrupar`` indica
+    por qué columnas se suman los resúmenes; sin ``agrupar`` se devuelve uno
+    por cliente, tarifa y fecha.
+    """
+    AGRUPACIONES = {"fecha": "fecha", "cliente": "cod_cliente", "tarifa": "cod_tarifa"}
+
+    fecha_desde = forms.DateField(required=False, label="Fecha desde")
+    fecha_hasta = forms.DateField(required=False, label="Fecha hasta")
+    cliente = forms.CharField(max_length=100, required=False, label="Cliente (COD_CLIENTE)")
+    tarifa = forms.CharField(max_length=100, required=False, label="Tarifa (COD_TARIFA)")
+    agrupar = forms.MultipleChoiceField(
+        choices=[(a, a) for a in AGRUPACIONES], required=False, label="Agrupar por"
+    )
+
+    def clean(self):
+        datos = super().clean()
+        desde = datos.get("fecha_desde")
+        hasta = datos.get("fecha_hasta")
+        if desde and hasta and desde > hasta:
+            self.add_error("fecha_hasta", "Debe ser igual o posterior a la fecha desde.")
+        return datos
+
+    def columnas(self):
+        agrupar = self.cleaned_data.get("agrupar") or list(self.AGRUPACIONES)
+        return [self.AGRUPACIONES[a] for a in self.AGRUPACIONES if a in agrupar]
+
+    def filtrar(self, queryset):
+        datos = self.cleaned_data
+        filtros = {
+            "fecha__gte": datos.get("fecha_desde"),
+            "fecha__lte": datos.get("fecha_hasta"),
+            "cod_cliente": datos.get("cliente"),
+            "cod_tarifa": datos.get("tarifa"),
+        }
+        return queryset.filter(**{k: v for k, v in filtros.items() if v})
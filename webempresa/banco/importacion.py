@@ -0,0 +1,468 @@
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import openpyxl
+import pandas as pd
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .calculos import calcular_datos_lote, cod_tarifa_efectiva, centavos_a_decimal
+from .coincidencias import confianza_minima, extraer_dni, obtener_indice_clientes
+from .instrumentacion import etapa, iterar_en_etapa
+from .models import BCP, Cliente
+from .tarifas import obtener_tarifas
+from .resumenes import aplicar_movimientos
+from .staging import FilaPreview, iterar_filas
+
+
+logger = logging.getLogger(__name__)
+
+
+# SQL Server admite como máximo 2100 parámetros por consulta, por eso
+# los IN se parten en bloques
+TAMANO_BLOQUE_IN = 2000
+
+# Filas del Excel que se procesan juntas; la memoria depende de esto y no del archivo
+TAMANO_LOTE = 2000
+
+
+class ResolutorImportacion:
+    """
+    Resuelve clientes y tarifas de una importación desde diccionarios en memoria.
+
+    El cliente de cada descripción sale del índice de clientes (identificar),
+    que es lo que usan el Excel y los movimientos de la API sin cliente ni
+    DNI. precargar y cliente_para buscan por DNI en la base de datos: los
+    usan los movimientos de la API que traen el DNI explícito, e identificar
+    para las descripciones que el índice no resolvió. En los dos casos los clientes se cargan con unas
+    pocas consultas IN y las tarifas salen del cache de tarifas, así el
+    número de consultas no depende de la cantidad de filas.
+    """
+
+    def __init__(self):
+        self.clientes_por_dni = {}
+        self.clientes_por_id = {}
+        self.tarifas = obtener_tarifas()
+        self._dnis_consultados = set()
+        self._ids_consultados = set()
+        self._indice = None
+
+    def precargar(self, dnis):
+        # DNI explícitos (API); solo consultamos los DNI que aún no se han buscado
+        pendientes = sorted({d for d in dnis if d} - self._dnis_consultados)
+        self._dnis_consultados.update(pendientes)
+
+        for inicio in range(0, len(pendientes), TAMANO_BLOQUE_IN):
+            bloque = pendientes[inicio:inicio + TAMANO_BLOQUE_IN]
+            # Orden por pk para quedarnos con el mismo cliente que daría .first()
+            for cliente in Cliente.objects.filter(dni__in=bloque).order_by("pk"):
+                self.clientes_por_dni.setdefault(cliente.dni, cliente)
+
+    def identificar(self, descripciones):
+        """
+        Cliente (o None) de cada descripción según el índice de clientes
+        (coincidencias.IndiceClientes): DNI, COD_CLIENTE o nombre en
+        cualquier parte del texto. Las coincidencias con confianza menor a
+        confianza_minima() no se asignan.
+
+        El índice se cachea y puede no tener los clientes recién creados
+        (CLIENTE también se escribe fuera de Django): las descripciones sin
+        coincidencia que terminan en un DNI se buscan en la base de datos.
+        """
+        if self._indice is None:
+            self._indice = obtener_indice_clientes()
+        minima = confianza_minima()
+        ids = [
+            c.cliente_id if c and c.confianza >= minima else None
+            for c in self._indice.coincidencias(descripciones)
+        ]
+
+        pendientes = sorted({i for i in ids if i is not None} - self._ids_consultados)
+        self._ids_consultados.update(pendientes)
+        for inicio in range(0, len(pendientes), TAMANO_BLOQUE_IN):
+            bloque = pendientes[inicio:inicio + TAMANO_BLOQUE_IN]
+            for cliente in Cliente.objects.filter(id__in=bloque):
+                self.clientes_por_id[cliente.id] = cliente
+        # Un cliente borrado después de armar el índice queda como no encontrado
+        clientes = [self.clientes_por_id.get(i) if i is not None else None for i in ids]
+
+        dnis = [extraer_dni(d) if c is None else None for c, d in zip(clientes, descripciones)]
+        self.precargar(dnis)
+        return [c or self.cliente_para(dni) for c, dni in zip(clientes, dnis)]
+
+    def cliente_para(self, dni, cliente_default=None):
+        cliente_obj = self.clientes_por_dni.get(dni) if dni else None
+        return cliente_obj or cliente_default
+
+    def tarifa_para(self, cliente_obj, tarifa_default=None):
+        tarifa_obj = None
+        if cliente_obj and cliente_obj.cod_tarifa:
+            tarifa_obj = self.tarifas.get(cliente_obj.cod_tarifa)
+        return tarifa_obj or tarifa_default
+
+
+def normalizar_columna(nombre):
+    """
+    Normaliza el encabezado de una columna: " Fecha valuta" -> "FECHA_VALUTA".
+    """
+    return str(nombre).strip().upper().replace(" ", "_")
+
+
+def _valor_celda(valor):
+    # Igual que pandas con dtype=str: los números pasan a texto y las celdas
+    # vacías se quedan en None; las fechas se dejan tal cual para parsearlas luego
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, (datetime, date, time, str)):
+        return valor
+    return str(valor)
+
+
+def leer_lotes_excel(archivo, tamano_lote=TAMANO_LOTE):
+    """
+    Lee la primera hoja del Excel en modo read-only de openpyxl y devuelve
+    lotes (listas) de filas como diccionarios {COLUMNA_NORMALIZADA: valor}.
+
+    Solo se mantiene en memoria un lote a la vez, las filas vacías se omiten.
+    """
+    wb = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        filas = wb.worksheets[0].iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+
+        columnas = [
+            normalizar_columna(c) if c is not None else normalizar_columna(f"Unnamed: {n}")
+            for n, c in enumerate(encabezado)
+        ]
+
+        lote = []
+        for fila in filas:
+            valores = [_valor_celda(v) for v in fila]
+            if all(v is None for v in valores):
+                continue
+            lote.append(dict(zip(columnas, valores)))
+            if len(lote) >= tamano_lote:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+    finally:
+        wb.close()
+
+
+def _fechas(valores):
+    # Parseo por elemento (format="mixed") para aceptar formatos distintos en el mismo lote
+    fechas = pd.to_datetime(pd.Series(valores, dtype=object), format="mixed", errors="coerce")
+    return [None if pd.isna(f) else f.date() for f in fechas]
+
+
+def _monto(valor):
+    try:
+        return Decimal(str(valor or "0").replace(",", ""))
+    except Exception:
+        return Decimal('0.00')
+
+
+def preparar_lote(lote, resolutor, inicio=0, cliente_default=None, tarifa_default=None,
+                  saldo_inicial_default=Decimal('0.00')):
+    """
+    Convierte un lote de filas del Excel en FilaPreview: identifica el
+    cliente de cada descripción y su tarifa con el resolutor y calcula saldo,
+    comisión, lm_pagar y ganancia de referido de todo el lote con
+    calcular_datos_lote.
+    """
+    descripciones = [
+        fila.get("DESCRIPCIÓN_OPERACIÓN") or fila.get("DESCRIPCION_OPERACION") or ""
+        for fila in lote
+    ]
+    with etapa("resolucion"):
+        clientes = resolutor.identificar(descripciones)
+    # Sin cliente se conserva el DNI del final de la descripción, como referencia
+    dnis = [c.dni if c else extraer_dni(d) for c, d in zip(clientes, descripciones)]
+
+    fechas = _fechas([fila.get("FECHA") for fila in lote])
+    fechas_valuta = _fechas([fila.get("FECHA_VALUTA") or fila.get("FECHA_VAL") for fila in lote])
+    montos = [_monto(fila.get("MONTO") or fila.get("MTO")) for fila in lote]
+    # Cliente identificado (o el elegido por defecto) y su tarifa desde el cache de tarifas
+    clientes = [c or cliente_default for c in clientes]
+    tarifas = [resolutor.tarifa_para(c, tarifa_default) for c in clientes]
+
+    # Datos calculados automáticamente, todo el lote a la vez
+    with etapa("calculo"):
+        resultados = calcular_datos_lote(
+            pd.DataFrame(
+                {
+                    "monto": montos,
+                    "saldo_inicial": [saldo_inicial_default] * len(lote),
+                    "cod_tarifa": [cod_tarifa_efectiva(c) for c in clientes],
+                    "codigo_referido": [c.codigo_referido if c else None for c in clientes],
+                },
+                columns=["monto", "saldo_inicial", "cod_tarifa", "codigo_referido"],
+            ),
+            resolutor.tarifas,
+        )
+
+    return [
+        FilaPreview(
+            indice=inicio + n,
+            cod_bcp=str(fila.get("COD_BCP") or ""),
+            fecha=fechas[n],
+            fecha_valuta=fechas_valuta[n],
+            descripcion=descripciones[n],
+            monto=montos[n],
+            sucursal_agencia=fila.get("SUCURSAL_AGENCIA") or "",
+            n_operacion=fila.get("N_OPERACIÓN") or fila.get("N_OPERACION") or "",
+            usuario=fila.get("USUARIO") or "",
+            codigo=None,
+            saldo_inicial=saldo_inicial_default,
+            dni=dnis[n],
+            cliente=clientes[n],
+            tarifa=tarifas[n],
+            saldo=centavos_a_decimal(calc.saldo),
+            comision=centavos_a_decimal(calc.comision),
+            lm_pagar=centavos_a_decimal(calc.lm_pagar),
+            ganancia_referido=centavos_a_decimal(calc.ganancia_referido),
+        )
+        for n, (fila, calc) in enumerate(zip(lote, resultados.itertuples(index=False)))
+    ]
+
+
+def _parsear_fecha(valor):
+    try:
+        return pd.to_datetime(valor).date() if valor else None
+    except Exception:
+        return None
+
+
+def _fila_a_bcp(fila, edicion):
+    """
+    Arma el BCP de una fila de la importación temporal aplicando la edición
+    hecha en la preview. Devuelve (bcp, saldo_inicial, cod_cliente).
+    """
+    b = BCP(
+        cod_bcp=fila.cod_bcp or None,
+        fecha=fila.fecha,
+        fecha_valuta=fila.fecha_valuta,
+        descripcion=fila.descripcion,
+        monto=fila.monto,
+        sucursal_agencia=fila.sucursal_agencia,
+        n_operacion=fila.n_operacion,
+        usuario=fila.usuario,
+        codigo=fila.codigo,
+    )
+    saldo_inicial = fila.saldo_inicial
+    cod_cliente = fila.cod_cliente
+
+    if edicion:
+        b.fecha = _parsear_fecha(edicion.get("fecha", ""))
+        b.fecha_valuta = _parsear_fecha(edicion.get("fecha_valuta", ""))
+
+        monto_raw = edicion.get("monto", "")
+        b.monto = Decimal(monto_raw.replace(",", "")) if monto_raw else Decimal('0.00')
+        saldo_raw = edicion.get("saldo_inicial", "")
+        saldo_inicial = Decimal(saldo_raw.replace(",", "")) if saldo_raw else Decimal('0.00')
+
+        b.descripcion = edicion.get("descripcion", b.descripcion)
+        b.sucursal_agencia = edicion.get("sucursal_agencia", b.sucursal_agencia)
+        b.n_operacion = edicion.get("n_operacion", b.n_operacion)
+        b.usuario = edicion.get("usuario", b.usuario)
+        b.codigo = edicion.get("codigo", b.codigo)
+        cod_cliente = edicion.get("cliente", cod_cliente)
+
+    return b, saldo_inicial, cod_cliente
+
+
+def _codigos_existentes(codigos):
+    """
+    Devuelve cuáles de los cod_bcp ya están en BCP (consultas IN por bloques).
+    """
+    codigos = list(codigos)
+    existentes = set()
+    for inicio in range(0, len(codigos), TAMANO_BLOQUE_IN):
+        bloque = codigos[inicio:inicio + TAMANO_BLOQUE_IN]
+        existentes.update(BCP.objects.filter(cod_bcp__in=bloque).values_list("cod_bcp", flat=True))
+    return existentes
+
+
+def _guardar_pendientes(pendientes, tarifas, errors, batch_size=None):
+    """
+    Calcula en lote los datos de las filas pendientes (ya validadas: todas
+    tienen cliente y tarifa) y las inserta con bulk_create, sumándolas a
+    ResumenDiario en la misma transacción.
+    Devuelve las filas guardadas [(índice, bcp)]; los errores se agregan a
+    ``errors`` como (índice, mensaje).
+
+    Si el insert masivo falla por un error de la base de datos, se registra
+    en el log y el lote se guarda fila por fila para poder informar qué filas
+    tienen el error. Cualquier otro error se propaga.
+    """
+    with etapa("calculo"):
+        resultados = calcular_datos_lote(
+            pd.DataFrame(
+                [
+                    {
+                        "monto": b.monto,
+                        "saldo_inicial": b.saldo_inicial,
+                        "cod_tarifa": cod_tarifa_efectiva(cliente_obj),
+                        "codigo_referido": cliente_obj.codigo_referido,
+                    }
+                    for _, b, cliente_obj in pendientes
+                ],
+                columns=["monto", "saldo_inicial", "cod_tarifa", "codigo_referido"],
+            ),
+            tarifas,
+        )
+
+    validos = []
+    for (i, b, _), calc in zip(pendientes, resultados.itertuples(index=False)):
+        b.saldo = centavos_a_decimal(calc.saldo)
+        b.comision = centavos_a_decimal(calc.comision)
+        b.lm_pagar = centavos_a_decimal(calc.lm_pagar)
+        b.ganancia_referido = centavos_a_decimal(calc.ganancia_referido)
+        validos.append((i, b))
+
+    try:
+        with transaction.atomic():
+            BCP.objects.bulk_create([b for _, b in validos], batch_size=batch_size)
+            # bulk_create no pasa por save: el resumen diario se actualiza aquí
+            aplicar_movimientos([b for _, b in validos])
+        return validos
+    except DatabaseError:
+        # Incluye IntegrityError. Si se repite en cada lote es un problema del
+        # servidor o del esquema, no de los datos: queda en el log
+        logger.exception("Falló el insert masivo de %s movimientos; se guardan de a uno", len(validos))
+
+    guardados = []
+    for i, b in validos:
+        # bulk_create pudo asignar pk a parte del lote antes del rollback
+        b.pk = None
+        b._state.adding = True
+        try:
+            with transaction.atomic():
+                b.save(recalcular=False, force_insert=True)
+            guardados.append((i, b))
+        except DatabaseError as e:
+            errors.append((i, str(e)))
+    return guardados
+
+
+def guardar_lote(candidatas, tarifas, cod_bcp_vistos, batch_size=None, al_guardar=None):
+    """
+    Guarda en BCP un lote de movimientos ya armados: descarta los duplicados
+    y las filas sin cliente o sin tarifa, reserva los COD_BCP que falten, calcula
+    los datos en lote y los inserta con bulk_create en una transacción (ver
+    _guardar_pendientes).
+
+    ``candidatas`` es una lista de (índice, bcp, saldo_inicial, cliente) y
+    ``cod_bcp_vistos`` los códigos ya guardados antes (se actualiza con los
+    que se guarden). Solo las filas que se van a insertar reciben código, así
+    las rechazadas no dejan huecos en la secuencia. ``al_guardar`` se llama
+    dentro de la transacción del insert (se confirma o se descarta con él).
+    Devuelve (guardadas [(índice, bcp)], duplicadas [índice], errores [(índice, mensaje)]).
+    """
+    existentes = _codigos_existentes({b.cod_bcp for _, b, _, _ in candidatas if b.cod_bcp})
+
+    # Filas válidas pendientes de guardar: (índice, objeto BCP, cliente)
+    pendientes = []
+    duplicadas = []
+    errores = []
+    codigos_lote = set()
+    for i, b, saldo_inicial, cliente_obj in candidatas:
+        if b.cod_bcp and (b.cod_bcp in cod_bcp_vistos or b.cod_bcp in existentes or b.cod_bcp in codigos_lote):
+            duplicadas.append(i)
+            continue
+
+        # Errores que ya sabemos que el insert va a rechazar
+        if cliente_obj is None:
+            errores.append((i, "la fila no tiene un cliente válido."))
+            continue
+        # Igual que calcular_datos: se guarda la tarifa efectiva del cliente
+        cod_tarifa = cod_tarifa_efectiva(cliente_obj)
+        tarifa_obj = tarifas.get(cod_tarifa)
+        if tarifa_obj is None:
+            errores.append((i, f"no existe la tarifa {cod_tarifa}."))
+            continue
+
+        if b.cod_bcp:
+            codigos_lote.add(b.cod_bcp)
+        b.cliente = cliente_obj
+        b.tarifa = tarifa_obj
+        b.saldo_inicial = saldo_inicial
+        pendientes.append((i, b, cliente_obj))
+
+    # Las filas sin COD_BCP reciben códigos correlativos, un solo bloque por lote
+    # (se reserva fuera de la transacción del lote para no bloquear la secuencia)
+    sin_codigo = [b for _, b, _ in pendientes if not b.cod_bcp]
+    for b, cod_bcp in zip(sin_codigo, BCP.reservar_codigos(len(sin_codigo))):
+        b.cod_bcp = cod_bcp
+
+    with etapa("guardado"), transaction.atomic():
+        guardadas = _guardar_pendientes(pendientes, tarifas, errores, batch_size=batch_size)
+        if al_guardar:
+            al_guardar()
+    cod_bcp_vistos.update(b.cod_bcp for _, b in guardadas)
+    # En el orden de las filas: las del insert fila por fila van después de las validaciones
+    errores.sort()
+    return guardadas, duplicadas, errores
+
+
+def confirmar_filas(importacion, ediciones, al_avanzar=None, tamano_lote=None):
+    """
+    Guarda en BCP las filas de la importación temporal aplicando las ediciones
+    de la preview ({indice: {campo: valor}}).
+
+    Las filas se procesan en lotes de ``tamano_lote`` (por defecto
+    settings.BANCO_CONFIRMACION_LOTE): por lote hay una consulta de clientes,
+    una de duplicados, un bulk_create y la actualización de ResumenDiario,
+    en su propia transacción. En esa misma transacción se borran de la
+    importación temporal las filas del lote: si el trabajo falla a mitad de
+    camino, al volver a confirmar solo quedan las que no se procesaron y no se
+    guarda nada dos veces. Después de cada lote se llama
+    ``al_avanzar(procesadas, guardadas, errores_del_lote)``.
+    Las filas sin COD_BCP reciben un código BCPnnn de la secuencia.
+    Devuelve (guardadas, errores).
+    """
+    tamano_lote = tamano_lote or getattr(settings, "BANCO_CONFIRMACION_LOTE", TAMANO_LOTE)
+    tarifas = obtener_tarifas()
+
+    saved = 0
+    errors = []
+    # Códigos ya aceptados en esta importación
+    cod_bcp_vistos = set()
+
+    for bloque in iterar_en_etapa("lectura", iterar_filas(importacion, tamano_lote)):
+        errores_bloque = []
+
+        # Filas del lote con sus ediciones: (índice, objeto BCP, saldo inicial, cod_cliente)
+        candidatas = []
+        for fila in bloque:
+            try:
+                candidatas.append((fila.indice, *_fila_a_bcp(fila, ediciones.get(fila.indice))))
+            except Exception as e:
+                errores_bloque.append(f"Fila {fila.indice}: {str(e)}")
+
+        # Clientes del lote, una consulta
+        cod_clientes = {cod for _, _, _, cod in candidatas if cod}
+        with etapa("resolucion"):
+            clientes = {c.cod_cliente: c for c in Cliente.objects.filter(cod_cliente__in=cod_clientes)}
+
+        guardadas, _, errores = guardar_lote(
+            [(i, b, saldo_inicial, clientes.get(cod) if cod else None) for i, b, saldo_inicial, cod in candidatas],
+            tarifas, cod_bcp_vistos, batch_size=tamano_lote,
+            # El bloque viene ordenado por índice: se borra por rango, sin una lista de parámetros
+            al_guardar=lambda: importacion.filas.filter(
+                indice__range=(bloque[0].indice, bloque[-1].indice)
+            ).delete(),
+        )
+        errores_bloque.extend(f"Fila {i}: {mensaje}" for i, mensaje in errores)
+
+        saved += len(guardadas)
+        errors.extend(errores_bloque)
+        if al_avanzar:
+            al_avanzar(len(bloque), len(guardadas), errores_bloque)
+
+    return saved, errors
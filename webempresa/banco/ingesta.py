@@ -0,0 +1,194 @@
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+
+from .instrumentacion import etapa
+from .importacion import TAMANO_LOTE, ResolutorImportacion, guardar_lote
+from .models import BCP, Cliente
+
+
+# Campos de texto que se copian tal cual del movimiento recibido
+CAMPOS_TEXTO = ["descripcion", "sucursal_agencia", "n_operacion", "usuario", "codigo"]
+
+# Máximo de movimientos por petición; la respuesta trae un resultado por cada uno
+MAX_MOVIMIENTOS = 20000
+
+
+class MovimientoInvalido(ValueError):
+    pass
+
+
+def movimientos_json(datos):
+    """
+    Movimientos de un cuerpo JSON ya parseado: una lista, o un objeto con
+    la lista en "movimientos".
+    """
+    if isinstance(datos, dict):
+        datos = datos.get("movimientos")
+    if not isinstance(datos, list):
+        raise MovimientoInvalido('Se espera una lista de movimientos o {"movimientos": [...]}.')
+    return iter(datos)
+
+
+def movimientos_ndjson(lineas):
+    """
+    Movimientos de un cuerpo NDJSON (un objeto JSON por línea), leyendo de a
+    una línea. Las líneas que no son JSON válido se devuelven como
+    MovimientoInvalido para informarlas en su fila.
+    """
+    for linea in lineas:
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            yield json.loads(linea)
+        except ValueError as e:
+            yield MovimientoInvalido(f"JSON inválido: {e}")
+
+
+def _fecha(datos, campo):
+    valor = datos.get(campo)
+    if not valor:
+        return None
+    try:
+        return date.fromisoformat(str(valor))
+    except ValueError:
+        raise MovimientoInvalido(f"{campo} debe tener el formato AAAA-MM-DD.")
+
+
+def _decimal(datos, campo, requerido=False):
+    valor = datos.get(campo)
+    if valor is None or valor == "":
+        if requerido:
+            raise MovimientoInvalido(f"Falta {campo}.")
+        return Decimal('0.00')
+    try:
+        numero = Decimal(str(valor).replace(",", ""))
+    except InvalidOperation:
+        raise MovimientoInvalido(f"{campo} no es un número.")
+    if not numero.is_finite():
+        raise MovimientoInvalido(f"{campo} no es un número.")
+    return numero
+
+
+def movimiento_a_bcp(datos):
+    """
+    Arma el BCP de un movimiento recibido. Devuelve (bcp, saldo_inicial,
+    cod_cliente, dni); el cliente se resuelve después, por lote.
+    """
+    if isinstance(datos, MovimientoInvalido):
+        raise datos
+    if not isinstance(datos, dict):
+        raise MovimientoInvalido("El movimiento debe ser un objeto JSON.")
+
+    b = BCP(
+        cod_bcp=str(datos.get("cod_bcp") or "") or None,
+        fecha=_fecha(datos, "fecha"),
+        fecha_valuta=_fecha(datos, "fecha_valuta"),
+        monto=_decimal(datos, "monto", requerido=True),
+        **{campo: str(datos.get(campo) or "") for campo in CAMPOS_TEXTO},
+    )
+    b.codigo = b.codigo or None
+
+    # Sin cliente ni DNI se identifica por la descripción, igual que en el Excel
+    return (
+        b, _decimal(datos, "saldo_inicial"), str(datos.get("cliente") or "") or None,
+        str(datos.get("dni") or "") or None,
+    )
+
+
+def _resultado(i, b):
+    return {
+        "indice": i,
+        "estado": "guardado",
+        "cod_bcp": b.cod_bcp,
+        "cliente": b.cliente_id,
+        "tarifa": b.tarifa_id,
+        # Como texto, igual que en la preview, para no perder decimales en JSON
+        "saldo": f"{b.saldo:.2f}",
+        "comision": f"{b.comision:.2f}",
+        "lm_pagar": f"{b.lm_pagar:.2f}",
+        "ganancia_referido": f"{b.ganancia_referido:.2f}",
+    }
+
+
+def _procesar_lote(lote, resolutor, cod_bcp_vistos, resultados, tamano_lote):
+    """
+    Resuelve los clientes del lote (una consulta por COD_CLIENTE, las de DNI
+    del resolutor y, sin ninguno de los dos, la identificación por la
+    descripción) y lo guarda con guardar_lote.
+    """
+    cod_clientes = {cod for _, _, _, cod, _ in lote if cod}
+    sin_datos = [(i, b.descripcion) for i, b, _, cod, dni in lote if not cod and not dni]
+    with etapa("resolucion"):
+        clientes = {c.cod_cliente: c for c in Cliente.objects.filter(cod_cliente__in=cod_clientes)}
+        resolutor.precargar(dni for _, _, _, cod, dni in lote if not cod)
+        identificados = dict(zip(
+            [i for i, _ in sin_datos], resolutor.identificar([d for _, d in sin_datos])
+        ))
+
+    candidatas = []
+    for i, b, saldo_inicial, cod_cliente, dni in lote:
+        if cod_cliente and cod_cliente not in clientes:
+            resultados[i] = {"indice": i, "estado": "error", "error": f"no existe el cliente {cod_cliente}."}
+            continue
+        if cod_cliente:
+            cliente_obj = clientes[cod_cliente]
+        elif dni:
+            cliente_obj = resolutor.cliente_para(dni)
+        else:
+            cliente_obj = identificados[i]
+        candidatas.append((i, b, saldo_inicial, cliente_obj))
+
+    guardadas, duplicadas, errores = guardar_lote(
+        candidatas, resolutor.tarifas, cod_bcp_vistos, batch_size=tamano_lote
+    )
+    for i, b in guardadas:
+        resultados[i] = _resultado(i, b)
+    for i in duplicadas:
+        resultados[i] = {"indice": i, "estado": "duplicado"}
+    for i, mensaje in errores:
+        resultados[i] = {"indice": i, "estado": "error", "error": mensaje}
+
+
+def ingerir_movimientos(movimientos, tamano_lote=None, maximo=MAX_MOVIMIENTOS):
+    """
+    Guarda en BCP movimientos recibidos por la API (diccionarios con fecha,
+    fecha_valuta, descripcion, monto, sucursal_agencia, n_operacion, usuario,
+    codigo, cod_bcp, saldo_inicial y cliente o dni).
+
+    Usa la misma resolución de clientes y el mismo cálculo que la importación
+    de Excel, en lotes de ``tamano_lote`` (por defecto
+    settings.BANCO_CONFIRMACION_LOTE) con un bulk_create y una transacción por
+    lote: un movimiento con error no impide guardar los demás.
+
+    Devuelve (resultados, completo): un resultado por movimiento, en el
+    orden recibido ("guardado" con el COD_BCP y los datos calculados,
+    "duplicado" o "error"), y False si llegaron más de ``maximo``
+    movimientos; en ese caso solo se procesan los primeros ``maximo``.
+    """
+    tamano_lote = tamano_lote or getattr(settings, "BANCO_CONFIRMACION_LOTE", TAMANO_LOTE)
+    resolutor = ResolutorImportacion()
+    # Códigos ya aceptados en esta petición
+    cod_bcp_vistos = set()
+    resultados = {}
+
+    completo = True
+    lote = []
+    for i, datos in enumerate(movimientos):
+        if i >= maximo:
+            completo = False
+            break
+        try:
+            lote.append((i, *movimiento_a_bcp(datos)))
+        except MovimientoInvalido as e:
+            resultados[i] = {"indice": i, "estado": "error", "error": str(e)}
+        if len(lote) >= tamano_lote:
+            _procesar_lote(lote, resolutor, cod_bcp_vistos, resultados, tamano_lote)
+            lote = []
+    if lote:
+        _procesar_lote(lote, resolutor, cod_bcp_vistos, resultados, tamano_lote)
+
+    return [resultados[i] for i in sorted(resultados)], completo
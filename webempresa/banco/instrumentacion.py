@@ -0,0 +1,344 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+logger = logging.getLogger(__name__)
+
+# Latencias que se guardan por vista para calcular el p95 de /metricas/
+MUESTRAS_POR_VISTA = 500
+
+_actual = ContextVar("banco_medicion", default=None)
+
+_FIN = object()
+
+
+class PresupuestoExcedido(AssertionError):
+    pass
+
+
+class Presupuesto:
+    """
+    Máximo de consultas y de milisegundos que puede usar una petición a una vista.
+    """
+
+    def __init__(self, consultas=None, milisegundos=None):
+        self.consultas = consultas
+        self.milisegundos = milisegundos
+
+    def excesos(self, medicion):
+        excesos = []
+        if self.consultas is not None and medicion.consultas > self.consultas:
+            excesos.append(f"{medicion.consultas} consultas (máximo {self.consultas})")
+        if self.milisegundos is not None and medicion.milisegundos > self.milisegundos:
+            excesos.append(f"{medicion.milisegundos:.0f} ms (máximo {self.milisegundos})")
+        return excesos
+
+
+def presupuesto(consultas=None, milisegundos=None):
+    """
+    Declara el presupuesto de una vista; InstrumentacionMiddleware lo
+    controla en cada petición. Con settings.BANCO_PRESUPUESTOS_ESTRICTOS
+    (los tests) pasarse lanza PresupuestoExcedido, salvo en las respuestas en
+    streaming; si no, queda en el log, en el header X-Banco-Presupuesto y en
+    /metricas/.
+    """
+    def decorar(vista):
+        vista.presupuesto_banco = Presupuesto(consultas, milisegundos)
+        return vista
+    return decorar
+
+
+class Medicion:
+    """
+    Consultas, tiempo en la base de datos y tiempo por etapa de una petición
+    (o de un trabajo en segundo plano).
+
+    La misma medición la usan varios hilos (el de la vista y los de
+    sync_to_async, que heredan el contexto): los totales se suman con lock.
+    """
+
+    def __init__(self, nombre, presupuesto=None):
+        self.nombre = nombre
+        self.presupuesto = presupuesto
+        self.consultas = 0
+        self.segundos_db = 0.0
+        self.etapas = defaultdict(float)
+        self._lock = threading.Lock()
+        self._inicio = time.perf_counter()
+        self._fin = None
+
+    def sumar_consulta(self, segundos):
+        with self._lock:
+            self.consultas += 1
+            self.segundos_db += segundos
+
+    def sumar_etapa(self, nombre, segundos):
+        with self._lock:
+            self.etapas[nombre] += segundos
+
+    def terminar(self):
+        self._fin = time.perf_counter()
+
+    @property
+    def milisegundos(self):
+        return ((self._fin or time.perf_counter()) - self._inicio) * 1000
+
+    def excesos(self):
+        return self.presupuesto.excesos(self) if self.presupuesto else []
+
+    def server_timing(self):
+        # Header estándar Server-Timing: se ve en las herramientas de desarrollo del navegador
+        partes = [f"total;dur={self.milisegundos:.1f}", f"db;dur={self.segundos_db * 1000:.1f}"]
+        partes += [f"{nombre};dur={segundos * 1000:.1f}" for nombre, segundos in self.etapas.items()]
+        return ", ".join(partes)
+
+
+def _contar_consulta(execute, sql, params, many, context):
+    medicion = _actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion.sumar_consulta(time.perf_counter() - inicio)
+
+
+def instrumentar_conexion(conexion):
+    if _contar_consulta not in conexion.execute_wrappers:
+        conexion.execute_wrappers.insert(0, _contar_consulta)
+
+
+@receiver(connection_created)
+def _conexion_creada(sender, connection, **kwargs):
+    # Cada conexión (una por hilo) cuenta sus consultas en la medición activa
+    # del contexto, también en los hilos de sync_to_async de las vistas async
+    instrumentar_conexion(connection)
+
+
+class RegistroMetricas:
+    """
+    Totales por vista (o trabajo) en memoria del proceso, para /metricas/.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datos = {}
+
+    def registrar(self, medicion):
+        with self._lock:
+            datos = self._datos.setdefault(medicion.nombre, {
+                "peticiones": 0,
+                "consultas": 0,
+                "consultas_max": 0,
+                "segundos_db": 0.0,
+                "presupuesto_excedido": 0,
+                "etapas": defaultdict(float),
+                "latencias": deque(maxlen=MUESTRAS_POR_VISTA),
+            })
+            datos["peticiones"] += 1
+            datos["consultas"] += medicion.consultas
+            datos["consultas_max"] = max(datos["consultas_max"], medicion.consultas)
+            datos["segundos_db"] += medicion.segundos_db
+            datos["presupuesto_excedido"] += bool(medicion.excesos())
+            for nombre, segundos in medicion.etapas.items():
+                datos["etapas"][nombre] += segundos
+            datos["latencias"].append(medicion.milisegundos)
+
+    def resumen(self):
+        with self._lock:
+            resumen = {}
+            for nombre, datos in sorted(self._datos.items()):
+                n = datos["peticiones"]
+                latencias = sorted(datos["latencias"])
+                resumen[nombre] = {
+                    "peticiones": n,
+                    "consultas_promedio": round(datos["consultas"] / n, 1),
+                    "consultas_max": datos["consultas_max"],
+                    "db_ms_promedio": round(datos["segundos_db"] * 1000 / n, 1),
+                    "latencia_ms_promedio": round(sum(latencias) / len(latencias), 1),
+                    "latencia_ms_p95": round(latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))], 1),
+                    "latencia_ms_max": round(latencias[-1], 1),
+                    "presupuesto_excedido": datos["presupuesto_excedido"],
+                    "etapas_ms_promedio": {e: round(s * 1000 / n, 1) for e, s in datos["etapas"].items()},
+                }
+            return resumen
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+registro = RegistroMetricas()
+
+
+@contextmanager
+def medir(nombre, presupuesto=None):
+    """
+    Mide el bloque (consultas, tiempo de base de datos y etapas) como una
+    petición más de ``nombre`` en /metricas/. Lo usan los trabajos en segundo
+    plano; una medición dentro de otra no suma a la de afuera.
+    """
+    medicion = Medicion(nombre, presupuesto)
+    token = _actual.set(medicion)
+    try:
+        yield medicion
+    finally:
+        _actual.reset(token)
+        medicion.terminar()
+        registro.registrar(medicion)
+
+
+@contextmanager
+def etapa(nombre):
+    """
+    Suma el tiempo del bloque a la etapa ``nombre`` de la medición activa
+    (lectura, resolucion, calculo, render o guardado). Sin medición no hace nada.
+    """
+    medicion = _actual.get()
+    if medicion is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicion.sumar_etapa(nombre, time.perf_counter() - inicio)
+
+
+def iterar_en_etapa(nombre, iterable):
+    """
+    Recorre ``iterable`` sumando a la etapa ``nombre`` solo el tiempo de
+    obtener cada elemento (por ejemplo la lectura del Excel por lotes).
+    """
+    iterador = iter(iterable)
+    while True:
+        with etapa(nombre):
+            try:
+                elemento = next(iterador)
+            except StopIteration:
+                return
+        yield elemento
+
+
+class InstrumentacionMiddleware:
+    """
+    Mide cada petición: consultas SQL, tiempo en la base de datos y tiempo
+    por etapa. Agrega los headers X-Banco-Consultas y Server-Timing, guarda
+    los totales para /metricas/ y controla el presupuesto de la vista (ver
+    presupuesto()). La medición queda en ``response.medicion_banco``.
+
+    En las respuestas en streaming (exportaciones) los headers traen lo
+    medido hasta armar la respuesta; las métricas y el presupuesto incluyen
+    también el envío del contenido. Como al terminar el envío ya no se puede
+    cambiar la respuesta, ahí pasarse del presupuesto solo queda en el log y
+    en /metricas/, aun con BANCO_PRESUPUESTOS_ESTRICTOS.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        for conexion in connections.all(initialized_only=True):
+            instrumentar_conexion(conexion)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # El nombre y el presupuesto se completan en process_view, con la vista ya resuelta
+        medicion = Medicion("sin_vista")
+        token = _actual.set(medicion)
+        try:
+            response = self.get_response(request)
+        finally:
+            _actual.reset(token)
+        return self._responder(medicion, response)
+
+    async def __acall__(self, request):
+        medicion = Medicion("sin_vista")
+        token = _actual.set(medicion)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _actual.reset(token)
+        return self._responder(medicion, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        medicion = _actual.get()
+        if medicion is not None:
+            medicion.nombre = request.resolver_match.view_name or medicion.nombre
+            medicion.presupuesto = getattr(view_func, "presupuesto_banco", None)
+
+    def _responder(self, medicion, response):
+        response.medicion_banco = medicion
+        response["X-Banco-Consultas"] = str(medicion.consultas)
+        response["Server-Timing"] = medicion.server_timing()
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self._seguir_async(medicion, response.streaming_content)
+            else:
+                response.streaming_content = self._seguir(medicion, response.streaming_content)
+            return response
+
+        medicion.terminar()
+        excesos = medicion.excesos()
+        if excesos:
+            response["X-Banco-Presupuesto"] = "; ".join(excesos)
+        self._cerrar(medicion)
+        return response
+
+    def _seguir(self, medicion, partes):
+        # Sigue midiendo mientras se envía el contenido
+        try:
+            iterador = iter(partes)
+            while True:
+                token = _actual.set(medicion)
+                try:
+                    parte = next(iterador, _FIN)
+                finally:
+                    _actual.reset(token)
+                if parte is _FIN:
+                    break
+                yield parte
+        finally:
+            medicion.terminar()
+            self._cerrar(medicion, streaming=True)
+
+    async def _seguir_async(self, medicion, partes):
+        try:
+            iterador = aiter(partes)
+            while True:
+                token = _actual.set(medicion)
+                try:
+                    parte = await anext(iterador, _FIN)
+                finally:
+                    _actual.reset(token)
+                if parte is _FIN:
+                    break
+                yield parte
+        finally:
+            medicion.terminar()
+            self._cerrar(medicion, streaming=True)
+
+    def _cerrar(self, medicion, streaming=False):
+        registro.registrar(medicion)
+        excesos = medicion.excesos()
+        if not excesos:
+            return
+        mensaje = f"{medicion.nombre} pasó su presupuesto: {'; '.join(excesos)}"
+        # Una excepción dentro del generador del streaming cortaría el archivo a medio enviar
+        if getattr(settings, "BANCO_PRESUPUESTOS_ESTRICTOS", False) and not streaming:
+            raise PresupuestoExcedido(mensaje)
+        logger.warning(mensaje)
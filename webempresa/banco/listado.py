@@ -0,0 +1,89 @@
+import base64
+import json
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import Q
+
+from .exportacion import COLUMNAS_EXPORTACION
+
+
+# Campos que se pueden pedir en el listado: nombre -> campo de BCP (los mismos de la exportación)
+CAMPOS_LISTADO = {"id": "id", **{nombre: campo for campo, nombre, _, _ in COLUMNAS_EXPORTACION}}
+
+TAMANO_PAGINA_LISTADO = 100
+MAX_PAGINA_LISTADO = 1000
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(fecha, id_):
+    """
+    Cursor opaco (base64 de JSON) con la (fecha, id) de la última fila de una página.
+    """
+    datos = json.dumps([fecha.isoformat() if fecha else None, id_])
+    return base64.urlsafe_b64encode(datos.encode("utf-8")).decode("ascii")
+
+
+def decodificar_cursor(cursor):
+    try:
+        fecha, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return (date.fromisoformat(fecha) if fecha else None), int(id_)
+    except (ValueError, TypeError):
+        raise CursorInvalido("El cursor no es válido.")
+
+
+def _despues_de(fecha, id_):
+    """
+    Filas que van después de (fecha, id) en el orden -fecha, -id.
+
+    SQL Server (y SQLite) ordenan NULL como el valor más bajo, así que en orden
+    descendente los movimientos sin fecha quedan al final.
+    """
+    if fecha is None:
+        return Q(fecha__isnull=True, id__lt=id_)
+    return Q(fecha__lt=fecha) | Q(fecha=fecha, id__lt=id_) | Q(fecha__isnull=True)
+
+
+def _valor_json(valor):
+    if isinstance(valor, Decimal):
+        # Como texto para no perder decimales en JSON
+        return str(valor)
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return valor
+
+
+def pagina_bcp(queryset, campos=None, cursor=None, limite=TAMANO_PAGINA_LISTADO):
+    """
+    Una página de movimientos BCP, del más reciente al más antiguo, con
+    paginación por cursor sobre (fecha, id): la página siguiente se pide con
+    WHERE (fecha, id) < cursor en lugar de OFFSET, así que cuesta lo mismo la
+    primera página que la número mil (usa los índices de fecha de BCP).
+
+    ``campos`` son nombres de CAMPOS_LISTADO (por defecto todos); solo esos se
+    leen de la base de datos. Devuelve (filas, cursor_siguiente o None).
+    """
+    campos = campos or list(CAMPOS_LISTADO)
+    columnas = [CAMPOS_LISTADO[c] for c in campos]
+    # fecha e id siempre se leen: con ellos se arma el cursor
+    leidas = list(dict.fromkeys(columnas + ["fecha", "id"]))
+
+    if cursor:
+        queryset = queryset.filter(_despues_de(*decodificar_cursor(cursor)))
+    # Una fila de más para saber si hay página siguiente
+    filas = list(queryset.order_by("-fecha", "-id").values_list(*leidas)[:limite + 1])
+
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        ultima = dict(zip(leidas, filas[-1]))
+        siguiente = codificar_cursor(ultima["fecha"], ultima["id"])
+
+    posiciones = [leidas.index(c) for c in columnas]
+    return [
+        {nombre: _valor_json(fila[p]) for nombre, p in zip(campos, posiciones)}
+        for fila in filas
+    ], siguiente
@@ -0,0 +1,77 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from banco.benchmark import crear_tablas_externas, medir_pipeline, sembrar_datos
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide importar_excel, confirmar_import y exportar_excel con libros BCP sintéticos "
+        "(filas por segundo, pico de memoria y consultas). Cada tamaño corre sobre una "
+        "base de test nueva; usar con --settings=webempresa.settings_benchmark (SQLite)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--filas", type=int, nargs="+", default=[1000, 10000, 100000],
+            help="Tamaños del libro a medir (por defecto 1000 10000 100000).",
+        )
+        parser.add_argument("--clientes", type=int, default=2000, help="Clientes sintéticos (por defecto 2000).")
+        parser.add_argument("--semilla", type=int, default=1, help="Semilla de los datos sintéticos.")
+        parser.add_argument(
+            "--sin-memoria", action="store_true",
+            help="No medir el pico de memoria (tracemalloc hace más lentas las etapas).",
+        )
+        parser.add_argument("--json", dest="ruta_json", help="Guarda los resultados en este archivo JSON.")
+        parser.add_argument(
+            "--permitir-otra-base", action="store_true",
+            help="Correr aunque la base configurada no sea SQLite (crea una base de test en ese servidor).",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite" and not options["permitir_otra_base"]:
+            raise CommandError(
+                "El benchmark está pensado para SQLite: usar --settings=webempresa.settings_benchmark "
+                "o --permitir-otra-base."
+            )
+
+        resultados = []
+        setup_test_environment()
+        try:
+            for filas in options["filas"]:
+                self.stdout.write(f"Midiendo {filas} filas...")
+                resultados.extend(self._medir(filas, options))
+        finally:
+            teardown_test_environment()
+
+        self._mostrar(resultados)
+        if options["ruta_json"]:
+            with open(options["ruta_json"], "w", encoding="utf-8") as archivo:
+                json.dump(resultados, archivo, indent=2)
+
+    def _medir(self, filas, options):
+        # Una base nueva por tamaño, así cada medición empieza con las tablas vacías
+        nombre_original = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            crear_tablas_externas()
+            dnis = sembrar_datos(options["clientes"], options["semilla"])
+            return medir_pipeline(filas, dnis, options["semilla"], memoria=not options["sin_memoria"])
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+
+    def _mostrar(self, resultados):
+        columnas = [
+            ("etapa", "Etapa", 34), ("filas", "Filas", 8), ("segundos", "Segundos", 10),
+            ("filas_por_segundo", "Filas/s", 10), ("memoria_pico_mb", "Memoria MB", 11), ("consultas", "Consultas", 10),
+        ]
+        self.stdout.write("")
+        self.stdout.write("".join(titulo.ljust(ancho) for _, titulo, ancho in columnas))
+        for resultado in resultados:
+            self.stdout.write("".join(
+                ("-" if resultado[campo] is None else str(resultado[campo])).ljust(ancho)
+                for campo, _, ancho in columnas
+            ))
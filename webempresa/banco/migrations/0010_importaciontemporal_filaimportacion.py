@@ -0,0 +1,56 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:14
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0009_alter_bcp_cod_bcp_alter_bcp_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportacionTemporal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('total_filas', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'IMPORTACION_TEMPORAL',
+            },
+        ),
+        migrations.CreateModel(
+            name='FilaImportacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('indice', models.IntegerField()),
+                ('cod_bcp', models.CharField(blank=True, max_length=100, null=True)),
+                ('fecha', models.DateField(blank=True, null=True)),
+                ('fecha_valuta', models.DateField(blank=True, null=True)),
+                ('descripcion', models.TextField(blank=True, default='')),
+                ('monto', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('sucursal_agencia', models.CharField(blank=True, max_length=100, null=True)),
+                ('n_operacion', models.CharField(blank=True, max_length=50, null=True)),
+                ('usuario', models.CharField(blank=True, max_length=100, null=True)),
+                ('saldo_inicial', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('codigo', models.CharField(blank=True, max_length=4, null=True)),
+                ('dni', models.CharField(blank=True, max_length=8, null=True)),
+                ('cod_cliente', models.CharField(blank=True, max_length=100, null=True)),
+                ('cod_tarifa', models.CharField(blank=True, max_length=100, null=True)),
+                ('saldo', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('comision', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('lm_pagar', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('ganancia_referido', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('importacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='filas', to='banco.importaciontemporal')),
+            ],
+            options={
+                'db_table': 'FILA_IMPORTACION',
+                'constraints': [models.UniqueConstraint(fields=('importacion', 'indice'), name='fila_importacion_indice_unico')],
+            },
+        ),
+    ]
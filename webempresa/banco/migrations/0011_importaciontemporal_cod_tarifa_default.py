@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0010_importaciontemporal_filaimportacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importaciontemporal',
+            name='cod_tarifa_default',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:17
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0011_importaciontemporal_cod_tarifa_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoImportacion',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('preview', 'Preview'), ('confirmacion', 'Confirmación')], max_length=20)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('terminado', 'Terminado'), ('fallido', 'Fallido')], default='pendiente', max_length=20)),
+                ('token', models.UUIDField(blank=True, null=True)),
+                ('total_filas', models.IntegerField(blank=True, null=True)),
+                ('filas_procesadas', models.IntegerField(default=0)),
+                ('filas_guardadas', models.IntegerField(default=0)),
+                ('filas_fallidas', models.IntegerField(default=0)),
+                ('errores', models.JSONField(blank=True, default=list)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('inicio', models.DateTimeField(blank=True, null=True)),
+                ('fin', models.DateTimeField(blank=True, null=True)),
+                ('importacion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trabajos', to='banco.importaciontemporal')),
+            ],
+            options={
+                'db_table': 'TRABAJO_IMPORTACION',
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:23
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def crear_regla_inicial(apps, schema_editor):
+    # La regla que estaba fija en BCP.calcular_datos: código 6, 0.1% sobre 1500 o 1.50
+    ReglaReferido = apps.get_model("banco", "ReglaReferido")
+    ReglaReferido.objects.get_or_create(
+        codigo_referido=6,
+        defaults={
+            "descripcion": "Referido 6",
+            "umbral": Decimal("1500.00"),
+            "porcentaje": Decimal("0.0010"),
+            "fijo": Decimal("1.50"),
+        },
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0013_secuencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReglaReferido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codigo_referido', models.IntegerField(unique=True)),
+                ('descripcion', models.CharField(blank=True, max_length=200)),
+                ('umbral', models.DecimalField(decimal_places=2, default=Decimal('1500.00'), max_digits=18)),
+                ('porcentaje', models.DecimalField(decimal_places=4, default=Decimal('0.0000'), max_digits=18)),
+                ('fijo', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('activo', models.BooleanField(default=True)),
+            ],
+            options={
+                'db_table': 'REGLA_REFERIDO',
+            },
+        ),
+        migrations.RunPython(crear_regla_inicial, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0014_reglareferido'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bcp',
+            index=models.Index(fields=['fecha'], name='bcp_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bcp',
+            index=models.Index(fields=['cliente', 'fecha'], name='bcp_cliente_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bcp',
+            index=models.Index(fields=['n_operacion'], name='bcp_n_operacion_idx'),
+        ),
+    ]
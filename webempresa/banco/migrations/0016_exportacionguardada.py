@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0015_indices_bcp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportacionGuardada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64, unique=True)),
+                ('formato', models.CharField(max_length=10)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('ultimo_id', models.BigIntegerField(blank=True, null=True)),
+                ('total_filas', models.IntegerField(default=0)),
+                ('archivo', models.CharField(max_length=500)),
+                ('tamano', models.BigIntegerField(default=0)),
+                ('anchos', models.JSONField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'EXPORTACION_GUARDADA',
+            },
+        ),
+    ]
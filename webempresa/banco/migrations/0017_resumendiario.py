@@ -0,0 +1,60 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:33
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def llenar_resumenes(apps, schema_editor):
+    # Resúmenes de los movimientos que ya existen
+    BCP = apps.get_model("banco", "BCP")
+    ResumenDiario = apps.get_model("banco", "ResumenDiario")
+    campos = ["monto", "comision", "lm_pagar", "ganancia_referido"]
+    totales = (
+        BCP.objects.values("cliente_id", "tarifa_id", "fecha")
+        .annotate(**{f"total_{c}": Sum(c) for c in campos}, total_cantidad=Count("id"))
+        .order_by()
+    )
+    ResumenDiario.objects.bulk_create(
+        (
+            ResumenDiario(
+                cod_cliente=t["cliente_id"] or "",
+                cod_tarifa=t["tarifa_id"] or "",
+                fecha=t["fecha"],
+                cantidad=t["total_cantidad"],
+                **{c: t[f"total_{c}"] or Decimal("0.00") for c in campos},
+            )
+            for t in totales.iterator()
+        ),
+        batch_size=150,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0016_exportacionguardada'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cod_cliente', models.CharField(max_length=100)),
+                ('cod_tarifa', models.CharField(max_length=100)),
+                ('fecha', models.DateField(blank=True, null=True)),
+                ('cantidad', models.IntegerField(default=0)),
+                ('monto', models.DecimalField(decimal_places=2, default=0, max_digits=22)),
+                ('comision', models.DecimalField(decimal_places=2, default=0, max_digits=22)),
+                ('lm_pagar', models.DecimalField(decimal_places=2, default=0, max_digits=22)),
+                ('ganancia_referido', models.DecimalField(decimal_places=2, default=0, max_digits=22)),
+            ],
+            options={
+                'db_table': 'RESUMEN_DIARIO',
+                'indexes': [models.Index(fields=['fecha'], name='resumen_diario_fecha_idx')],
+                'constraints': [models.UniqueConstraint(fields=('cod_cliente', 'cod_tarifa', 'fecha'), name='resumen_diario_unico')],
+            },
+        ),
+        migrations.RunPython(llenar_resumenes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0017_resumendiario'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bcp',
+            index=models.Index(fields=['tarifa', 'fecha'], name='bcp_tarifa_fecha_idx'),
+        ),
+    ]
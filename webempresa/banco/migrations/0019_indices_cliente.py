@@ -0,0 +1,53 @@
+from django.db import migrations
+
+
+# CLIENTE es managed = False (Meta.indexes no se aplica): los índices del
+# autocompletado de clientes (banco/clientes.py) se crean aquí. COD_CLIENTE
+# ya tiene el índice de su restricción UNIQUE.
+INDICES_CLIENTE = [
+    ("cliente_dni_idx", "DNI"),
+    ("cliente_nombre_idx", "NOMBRE"),
+    ("cliente_apellidos_idx", "APELLIDOS"),
+]
+
+
+def _indices_existentes(schema_editor):
+    # None si la tabla no existe (por ejemplo en la base de datos de los tests)
+    conexion = schema_editor.connection
+    with conexion.cursor() as cursor:
+        if "CLIENTE" not in conexion.introspection.table_names(cursor):
+            return None
+        return set(conexion.introspection.get_constraints(cursor, "CLIENTE"))
+
+
+def crear_indices_cliente(apps, schema_editor):
+    existentes = _indices_existentes(schema_editor)
+    if existentes is None:
+        return
+    qn = schema_editor.quote_name
+    for nombre, columna in INDICES_CLIENTE:
+        if nombre not in existentes:
+            schema_editor.execute(f"CREATE INDEX {qn(nombre)} ON {qn('CLIENTE')} ({qn(columna)})")
+
+
+def borrar_indices_cliente(apps, schema_editor):
+    existentes = _indices_existentes(schema_editor)
+    if existentes is None:
+        return
+    for nombre, _ in INDICES_CLIENTE:
+        if nombre in existentes:
+            schema_editor.execute(schema_editor.sql_delete_index % {
+                "name": schema_editor.quote_name(nombre),
+                "table": schema_editor.quote_name("CLIENTE"),
+            })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0018_indice_bcp_tarifa_fecha'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices_cliente, borrar_indices_cliente),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0019_indices_cliente'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoimportacion',
+            name='latido',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
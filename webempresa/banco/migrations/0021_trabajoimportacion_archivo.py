@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0020_trabajoimportacion_latido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoimportacion',
+            name='archivo',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:02
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+SIN_FECHA = datetime.date(1900, 1, 1)
+CAMPOS = ["cantidad", "monto", "comision", "lm_pagar", "ganancia_referido"]
+
+
+def fecha_nula_a_sin_fecha(apps, schema_editor):
+    # Los resúmenes sin fecha pueden estar repetidos (NULL no choca en el
+    # índice único): se juntan en uno por cliente y tarifa con SIN_FECHA
+    ResumenDiario = apps.get_model("banco", "ResumenDiario")
+    sin_fecha = ResumenDiario.objects.filter(fecha__isnull=True)
+    grupos = defaultdict(lambda: {c: Decimal("0.00") for c in CAMPOS})
+    for r in sin_fecha:
+        grupo = grupos[(r.cod_cliente, r.cod_tarifa)]
+        for campo in CAMPOS:
+            grupo[campo] += getattr(r, campo)
+    sin_fecha.delete()
+    for (cod_cliente, cod_tarifa), valores in grupos.items():
+        valores["cantidad"] = int(valores["cantidad"])
+        resumen, creado = ResumenDiario.objects.get_or_create(
+            cod_cliente=cod_cliente, cod_tarifa=cod_tarifa, fecha=SIN_FECHA, defaults=valores
+        )
+        if not creado:
+            for campo in CAMPOS:
+                setattr(resumen, campo, getattr(resumen, campo) + valores[campo])
+            resumen.save()
+
+
+def sin_fecha_a_fecha_nula(apps, schema_editor):
+    ResumenDiario = apps.get_model("banco", "ResumenDiario")
+    ResumenDiario.objects.filter(fecha=SIN_FECHA).update(fecha=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banco', '0021_trabajoimportacion_archivo'),
+    ]
+
+    operations = [
+        migrations.RunPython(fecha_nula_a_sin_fecha, sin_fecha_a_fecha_nula),
+        migrations.AlterField(
+            model_name='resumendiario',
+            name='fecha',
+            field=models.DateField(),
+        ),
+    ]
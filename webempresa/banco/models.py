@@ -1,7 +1,12 @@
+import copy
+import uuid
+from datetime import date
 from django.db import models  # Importa el módulo de modelos de Django
 from decimal import Decimal
-from django.db.models import Max
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
 
 class Cliente(models.Model):
     id = models.IntegerField(primary_key=True, db_column="ID")  
@@ -25,6 +30,12 @@ class Cliente(models.Model):
     class Meta:
         managed = False   # ❌ muy importante: Django no intentará crear ni modificar esta tabla
         db_table = "CLIENTE"
+        # Índices del autocompletado de clientes; en la base real los crea la migración 0019
+        indexes = [
+            models.Index(fields=["dni"], name="cliente_dni_idx"),
+            models.Index(fields=["nombre"], name="cliente_nombre_idx"),
+            models.Index(fields=["apellidos"], name="cliente_apellidos_idx"),
+        ]
 
 
 
@@ -54,6 +65,84 @@ class TarifaOperacion(models.Model):
         db_table = "TARIFA_OPERACION"
 
 
+# Reglas de ganancia de referido, una por código de referido del cliente
+class ReglaReferido(models.Model):
+    # Código de referido (CLIENTE.CODIGO_REFERIDO interpretado como número)
+    codigo_referido = models.IntegerField(unique=True)
+    # Descripción del esquema
+    descripcion = models.CharField(max_length=200, blank=True)
+    # Por encima de este monto la ganancia es porcentual, si no es el monto fijo
+    umbral = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('1500.00'))
+    # Porcentaje sobre el monto (0.0010 = 0.1%)
+    porcentaje = models.DecimalField(max_digits=18, decimal_places=4, default=Decimal('0.0000'))
+    # Monto fijo
+    fijo = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    # Las reglas inactivas no pagan ganancia
+    activo = models.BooleanField(default=True)
+
+    class Meta:
+        db_table = "REGLA_REFERIDO"
+
+    def __str__(self):
+        return f"{self.codigo_referido} - {self.descripcion}"
+
+
+# Contadores para códigos correlativos (por ejemplo COD_BCP)
+class Secuencia(models.Model):
+    # Nombre de la secuencia
+    nombre = models.CharField(max_length=50, primary_key=True)
+    # Último número entregado
+    valor = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = "SECUENCIA"
+
+    def __str__(self):
+        return f"{self.nombre} = {self.valor}"
+
+    @classmethod
+    def reservar(cls, nombre, cantidad, inicial=0):
+        """
+        Reserva ``cantidad`` números consecutivos de la secuencia y devuelve el range.
+
+        El UPDATE valor = valor + cantidad bloquea la fila hasta el final de la
+        transacción, así dos procesos nunca reciben el mismo bloque. ``inicial``
+        (número o función) es el último número ya usado si la secuencia no existe.
+        """
+        if cantidad <= 0:
+            return range(0)
+
+        with transaction.atomic():
+            actualizadas = cls.objects.filter(nombre=nombre).update(valor=F("valor") + cantidad)
+            if not actualizadas:
+                valor_inicial = inicial() if callable(inicial) else inicial
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(nombre=nombre, valor=valor_inicial + cantidad)
+                except IntegrityError:
+                    # Otro proceso la creó al mismo tiempo
+                    cls.objects.filter(nombre=nombre).update(valor=F("valor") + cantidad)
+            valor = cls.objects.get(nombre=nombre).valor
+
+        return range(valor - cantidad + 1, valor + 1)
+
+
+class BCPQuerySet(models.QuerySet):
+
+    def delete(self):
+        """
+        Borra los movimientos y los descuenta de ResumenDiario juntos, con una
+        actualización por (cliente, tarifa, fecha) en lugar de una por movimiento.
+        """
+        from .resumenes import acumular_borrados, aplicar_movimientos  # evita import circular
+
+        with transaction.atomic(using=self.db):
+            with acumular_borrados() as borrados:
+                resultado = super().delete()
+            aplicar_movimientos(borrados, signo=-1)
+        return resultado
+
+
 # Modelo BCP (Banco de Crédito del Perú)
 class BCP(models.Model):
     # Código único de la operación
@@ -85,6 +174,13 @@ class BCP(models.Model):
     class Meta:
         managed =  True
         db_table = "BCP"
+        # Índices para los filtros de la exportación y el listado paginado por (fecha, id)
+        indexes = [
+            models.Index(fields=["fecha"], name="bcp_fecha_idx"),
+            models.Index(fields=["cliente", "fecha"], name="bcp_cliente_fecha_idx"),
+            models.Index(fields=["tarifa", "fecha"], name="bcp_tarifa_fecha_idx"),
+            models.Index(fields=["n_operacion"], name="bcp_n_operacion_idx"),
+        ]
 
     # Relación con cliente y tarifa
     cliente = models.ForeignKey(
@@ -100,22 +196,31 @@ class BCP(models.Model):
         db_column="COD_TARIFA"
     )
 
+    objects = BCPQuerySet.as_manager()
+
     # Campo temporal (no existe en la base de datos) para manejar saldo inicial
     _saldo_inicial = 0  
 
-    def save(self, *args, **kwargs):
-        if not self.cod_bcp:  # Solo si aún no tiene código
-            last_bcp = BCP.objects.order_by('-id').first()
-            if last_bcp and last_bcp.cod_bcp:
-                try:
-                    last_number = int(last_bcp.cod_bcp.replace("BCP", ""))
-                except ValueError:
-                    last_number = 0
-            else:
-                last_number = 0
-            self.cod_bcp = f"BCP{last_number + 1:03d}"
-
-        super().save(*args, **kwargs)  # Aquí recién guarda
+    @classmethod
+    def reservar_codigos(cls, cantidad):
+        """
+        Reserva ``cantidad`` códigos COD_BCP consecutivos (BCP001, BCP002, ...)
+        en una sola operación atómica sobre la secuencia "COD_BCP".
+        """
+        numeros = Secuencia.reservar("COD_BCP", cantidad, inicial=cls._ultimo_numero_codigo)
+        return [f"BCP{n:03d}" for n in numeros]
+
+    @classmethod
+    def _ultimo_numero_codigo(cls):
+        # Mayor número usado en COD_BCP; solo se usa la primera vez, para iniciar la secuencia
+        ultimo = 0
+        codigos = cls.objects.filter(cod_bcp__startswith="BCP").values_list("cod_bcp", flat=True)
+        for cod_bcp in codigos.iterator():
+            try:
+                ultimo = max(ultimo, int(cod_bcp.replace("BCP", "")))
+            except ValueError:
+                pass
+        return ultimo
 
     def __str__(self):
         return f"{self.cod_bcp} - {self.descripcion}"
@@ -129,7 +234,14 @@ class BCP(models.Model):
     def saldo_inicial(self, value):
         self._saldo_inicial  = value or Decimal('0.00')
 
-    def calcular_datos(self):
+    def calcular_datos(self, tarifas=None, reglas=None):
+        """
+        Calcula saldo, comisión, lm_pagar y ganancia de referido.
+
+        Si se pasa ``tarifas`` (diccionario cod_tarifa -> TarifaOperacion)
+        la tarifa se busca ahí; si no, en el cache de tarifas (ver tarifas.py).
+        Igual con ``reglas`` (TablaReferidos, ver referidos.py).
+        """
         monto = self.monto or Decimal('0.00')
         saldo_inicial = self._saldo_inicial or Decimal('0.00')
 
@@ -144,13 +256,15 @@ class BCP(models.Model):
             except ObjectDoesNotExist:
                 cliente_obj = None
 
-        # Buscar tarifa
-        tarifa_obj = None
-        if cliente_obj and cliente_obj.cod_tarifa:
-            tarifa_obj = TarifaOperacion.objects.filter(cod_tarifa=cliente_obj.cod_tarifa).first()
-        else:
-            # Tarifa por defecto si no tiene cliente o cod_tarifa
-            tarifa_obj = TarifaOperacion.objects.filter(cod_tarifa="TARIFA01").first()
+        # Buscar tarifa: la del cliente, o la tarifa por defecto si no tiene
+        # cliente o cod_tarifa (el mismo criterio que el cálculo por lote)
+        from .calculos import cod_tarifa_efectiva  # evita import circular
+        cod_tarifa = cod_tarifa_efectiva(cliente_obj)
+
+        if tarifas is None:
+            from .tarifas import obtener_tarifas  # evita import circular
+            tarifas = obtener_tarifas()
+        tarifa_obj = tarifas.get(cod_tarifa)
 
 
         # Comisión
@@ -170,26 +284,230 @@ class BCP(models.Model):
         # LM a pagar
         self.lm_pagar = self.saldo - self.comision
 
-        # 🔥 Ganancia de referido (nueva lógica)
-        self.ganancia_referido = Decimal('0.00')
-        if cliente_obj and cliente_obj.codigo_referido:
-            try:
-                cod_ref = int(cliente_obj.codigo_referido)
-            except:
-                cod_ref = None
-
-            if cod_ref == 6:
-                if monto > 1500:
-                    self.ganancia_referido = monto * Decimal('0.001')  # 0.1%
-                else:
-                    self.ganancia_referido = Decimal('1.5')
-            else:
-                self.ganancia_referido = Decimal('0.00')  # "FALSO"
+        # 🔥 Ganancia de referido (según la tabla REGLA_REFERIDO)
+        if reglas is None:
+            from .referidos import obtener_reglas  # evita import circular
+            reglas = obtener_reglas()
+        self.ganancia_referido = reglas.ganancia(
+            monto, cliente_obj.codigo_referido if cliente_obj else None
+        )
 
         # Guardamos el objeto tarifa temporalmente para usar luego
         self.tarifa = tarifa_obj
 
-    def save(self, *args, **kwargs):
-        self.calcular_datos()
-        super().save(*args, **kwargs)
+    def save(self, *args, recalcular=True, anterior=None, **kwargs):
+        # recalcular=False cuando los datos ya vienen de calcular_datos_lote.
+        # anterior: copia del movimiento tal como está en la base (por ejemplo
+        # la que se hizo al leerlo para editarlo); si se pasa, no se vuelve a
+        # leer para descontarlo del resumen
+        if recalcular:
+            self.calcular_datos()
+
+        if not self.cod_bcp:  # Solo si aún no tiene código
+            self.cod_bcp = BCP.reservar_codigos(1)[0]
+
+        from .resumenes import aplicar_movimientos  # evita import circular
+
+        # El movimiento y su resumen diario se guardan juntos
+        with transaction.atomic(using=kwargs.get("using")):
+            if anterior is None and self.pk and not kwargs.get("force_insert"):
+                anterior = BCP.objects.filter(pk=self.pk).first()
+
+            super().save(*args, **kwargs)  # Aquí recién guarda
+
+            if anterior:
+                aplicar_movimientos([anterior], signo=-1)
+            guardado = self
+            if kwargs.get("update_fields"):
+                # Con update_fields puede haber cambios sin guardar: se usa lo que quedó en la base
+                guardado = copy.copy(anterior) if anterior else BCP.objects.get(pk=self.pk)
+                for nombre in kwargs["update_fields"]:
+                    campo = self._meta.get_field(nombre)
+                    setattr(guardado, campo.attname, getattr(self, campo.attname))
+            aplicar_movimientos([guardado])
+
+
+
+# Importación en curso: las filas leídas del Excel se guardan aquí entre la
+# preview y la confirmación, así el formulario solo envía el token y las
+# filas que el usuario editó
+class ImportacionTemporal(models.Model):
+    # Identificador que viaja en el formulario de la preview
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    # Fecha de creación (para borrar importaciones abandonadas)
+    creado = models.DateTimeField(auto_now_add=True)
+    # Cantidad de filas leídas del Excel
+    total_filas = models.IntegerField(default=0)
+    # Tarifa elegida por defecto en el formulario de carga
+    cod_tarifa_default = models.CharField(max_length=100, blank=True, null=True)
+
+    class Meta:
+        db_table = "IMPORTACION_TEMPORAL"
+
+    def __str__(self):
+        return f"{self.token} ({self.total_filas} filas)"
+
 
+# Fila de una importación en curso, con los datos ya resueltos y calculados
+class FilaImportacion(models.Model):
+    importacion = models.ForeignKey(
+        ImportacionTemporal,
+        on_delete=models.CASCADE,
+        related_name="filas"
+    )
+    # Posición de la fila en el Excel
+    indice = models.IntegerField()
+
+    cod_bcp = models.CharField(max_length=100, blank=True, null=True)
+    fecha = models.DateField(blank=True, null=True)
+    fecha_valuta = models.DateField(blank=True, null=True)
+    descripcion = models.TextField(blank=True, default="")
+    monto = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    sucursal_agencia = models.CharField(max_length=100, blank=True, null=True)
+    n_operacion = models.CharField(max_length=50, blank=True, null=True)
+    usuario = models.CharField(max_length=100, blank=True, null=True)
+    saldo_inicial = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    codigo = models.CharField(max_length=4, blank=True, null=True)
+
+    # Cliente y tarifa resueltos en la preview (solo los códigos)
+    dni = models.CharField(max_length=8, blank=True, null=True)
+    cod_cliente = models.CharField(max_length=100, blank=True, null=True)
+    cod_tarifa = models.CharField(max_length=100, blank=True, null=True)
+
+    # Datos calculados
+    saldo = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    comision = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    lm_pagar = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    ganancia_referido = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = "FILA_IMPORTACION"
+        constraints = [
+            models.UniqueConstraint(fields=["importacion", "indice"], name="fila_importacion_indice_unico"),
+        ]
+
+    def __str__(self):
+        return f"{self.importacion_id} - fila {self.indice}"
+
+
+# Trabajo en segundo plano de una importación (lectura del Excel o confirmación)
+class TrabajoImportacion(models.Model):
+    PREVIEW = "preview"
+    CONFIRMACION = "confirmacion"
+    TIPOS = [(PREVIEW, "Preview"), (CONFIRMACION, "Confirmación")]
+
+    PENDIENTE = "pendiente"
+    EN_PROCESO = "en_proceso"
+    TERMINADO = "terminado"
+    FALLIDO = "fallido"
+    ESTADOS = [
+        (PENDIENTE, "Pendiente"),
+        (EN_PROCESO, "En proceso"),
+        (TERMINADO, "Terminado"),
+        (FALLIDO, "Fallido"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE)
+    # Importación temporal que genera (preview) o que guarda (confirmación)
+    importacion = models.ForeignKey(
+        ImportacionTemporal,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="trabajos"
+    )
+    # Token de la importación (se conserva aunque la importación ya se haya borrado)
+    token = models.UUIDField(blank=True, null=True)
+    # Excel subido que espera ser leído (preview); se borra al leerlo o si el trabajo se pierde
+    archivo = models.CharField(max_length=500, blank=True, default="")
+
+    # Progreso
+    total_filas = models.IntegerField(blank=True, null=True)
+    filas_procesadas = models.IntegerField(default=0)
+    filas_guardadas = models.IntegerField(default=0)
+    filas_fallidas = models.IntegerField(default=0)
+    errores = models.JSONField(default=list, blank=True)
+
+    creado = models.DateTimeField(auto_now_add=True)
+    inicio = models.DateTimeField(blank=True, null=True)
+    fin = models.DateTimeField(blank=True, null=True)
+    # Última señal de vida del hilo que lo corre (se actualiza en cada bloque)
+    latido = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = "TRABAJO_IMPORTACION"
+
+    def __str__(self):
+        return f"{self.tipo} {self.id} ({self.estado})"
+
+    @property
+    def segundos(self):
+        # Tiempo de proceso hasta ahora (o total si ya terminó)
+        if not self.inicio:
+            return 0
+        return ((self.fin or timezone.now()) - self.inicio).total_seconds()
+
+    @property
+    def filas_por_segundo(self):
+        segundos = self.segundos
+        return self.filas_procesadas / segundos if segundos else 0
+
+
+# Archivo de exportación guardado en disco, para no regenerarlo si los datos no cambiaron
+class ExportacionGuardada(models.Model):
+    # Hash del formato y los filtros de la exportación
+    clave = models.CharField(max_length=64, unique=True)
+    formato = models.CharField(max_length=10)
+    parametros = models.JSONField(default=dict, blank=True)
+
+    # Marca de agua de los datos del archivo: id más alto y cantidad de filas.
+    # ultimo_id nulo = hay que regenerarlo (se modificó algún movimiento)
+    ultimo_id = models.BigIntegerField(blank=True, null=True)
+    total_filas = models.IntegerField(default=0)
+
+    # Ruta y tamaño del archivo (para Excel, el XML de las filas; ver cache_exportaciones.py)
+    archivo = models.CharField(max_length=500)
+    tamano = models.BigIntegerField(default=0)
+    # Anchos de columna del Excel, calculados al generarlo
+    anchos = models.JSONField(blank=True, null=True)
+
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "EXPORTACION_GUARDADA"
+
+    def __str__(self):
+        return f"{self.formato} {self.parametros} ({self.total_filas} filas)"
+
+
+# Totales de BCP por cliente, tarifa y día. Se actualiza en cada guardado de
+# movimientos (ver resumenes.py), así los reportes no recorren la tabla BCP
+class ResumenDiario(models.Model):
+    # Fecha que reemplaza a NULL (movimientos sin fecha): en SQLite y
+    # PostgreSQL dos NULL no chocan en el índice único y se duplicaría el
+    # grupo. Igual que cliente y tarifa, que sin valor se guardan como ""
+    SIN_FECHA = date(1900, 1, 1)
+
+    cod_cliente = models.CharField(max_length=100)
+    cod_tarifa = models.CharField(max_length=100)
+    fecha = models.DateField()
+
+    cantidad = models.IntegerField(default=0)
+    monto = models.DecimalField(max_digits=22, decimal_places=2, default=0)
+    comision = models.DecimalField(max_digits=22, decimal_places=2, default=0)
+    lm_pagar = models.DecimalField(max_digits=22, decimal_places=2, default=0)
+    ganancia_referido = models.DecimalField(max_digits=22, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = "RESUMEN_DIARIO"
+        constraints = [
+            models.UniqueConstraint(fields=["cod_cliente", "cod_tarifa", "fecha"], name="resumen_diario_unico"),
+        ]
+        indexes = [
+            models.Index(fields=["fecha"], name="resumen_diario_fecha_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.fecha} {self.cod_cliente} {self.cod_tarifa}: {self.cantidad}"
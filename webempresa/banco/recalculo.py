@@ -0,0 +1,98 @@
+import copy
+
+import pandas as pd
+from django.db import transaction
+
+from .cache_exportaciones import invalidar_exportaciones
+from .calculos import calcular_datos_lote, centavos_a_decimal, cod_tarifa_efectiva
+from .models import BCP, Cliente
+from .referidos import obtener_reglas
+from .resumenes import aplicar_movimientos
+from .tarifas import obtener_tarifas
+
+
+# Movimientos que se leen y recalculan por vez
+TAMANO_LOTE_RECALCULO = 2000
+
+# Campos que cambia el recálculo (el saldo no: sale del monto y del saldo inicial)
+CAMPOS_RECALCULADOS = ["comision", "lm_pagar", "ganancia_referido", "tarifa"]
+_ATRIBUTOS_RECALCULADOS = ["comision", "lm_pagar", "ganancia_referido", "tarifa_id"]
+
+# bulk_update usa 1 + 2 parámetros por campo y fila; SQL Server admite 2100 por consulta
+TAMANO_BLOQUE_ACTUALIZACION = 2000 // (1 + 2 * len(CAMPOS_RECALCULADOS))
+
+
+def recalcular_movimientos(queryset, tamano_lote=TAMANO_LOTE_RECALCULO):
+    """
+    Vuelve a calcular comisión, lm_pagar, ganancia de referido y tarifa de los
+    movimientos de ``queryset`` con las tarifas, reglas de referido y datos de
+    cliente actuales (por ejemplo después de cambiar una tarifa).
+
+    Se recorre por id en lotes de ``tamano_lote``: por lote hay una consulta
+    de movimientos, una de clientes, el cálculo con calcular_datos_lote y un
+    bulk_update de las filas que cambiaron, junto con su ResumenDiario en la
+    misma transacción. El saldo inicial se deduce del saldo guardado.
+    Devuelve (actualizados, sin_tarifa); los movimientos cuya tarifa
+    efectiva no existe se dejan como están.
+    """
+    tarifas = obtener_tarifas()
+    reglas = obtener_reglas()
+    queryset = queryset.order_by("id")
+
+    actualizados = 0
+    sin_tarifa = 0
+    ultimo_id = 0
+    while True:
+        lote = list(queryset.filter(id__gt=ultimo_id)[:tamano_lote])
+        if not lote:
+            break
+        ultimo_id = lote[-1].id
+
+        clientes = {
+            c.cod_cliente: c for c in Cliente.objects.filter(cod_cliente__in={b.cliente_id for b in lote})
+        }
+        resultados = calcular_datos_lote(
+            pd.DataFrame(
+                [
+                    {
+                        "monto": b.monto,
+                        "saldo_inicial": b.saldo - b.monto,
+                        "cod_tarifa": cod_tarifa_efectiva(clientes.get(b.cliente_id)),
+                        "codigo_referido": getattr(clientes.get(b.cliente_id), "codigo_referido", None),
+                    }
+                    for b in lote
+                ],
+                columns=["monto", "saldo_inicial", "cod_tarifa", "codigo_referido"],
+            ),
+            tarifas,
+            reglas,
+        )
+
+        anteriores = []
+        cambiados = []
+        for b, calc in zip(lote, resultados.itertuples(index=False)):
+            tarifa_obj = tarifas.get(cod_tarifa_efectiva(clientes.get(b.cliente_id)))
+            if tarifa_obj is None:
+                sin_tarifa += 1
+                continue
+            anterior = copy.copy(b)
+            b.comision = centavos_a_decimal(calc.comision)
+            b.lm_pagar = centavos_a_decimal(calc.lm_pagar)
+            b.ganancia_referido = centavos_a_decimal(calc.ganancia_referido)
+            b.tarifa = tarifa_obj
+            if any(getattr(b, c) != getattr(anterior, c) for c in _ATRIBUTOS_RECALCULADOS):
+                anteriores.append(anterior)
+                cambiados.append(b)
+
+        if cambiados:
+            with transaction.atomic():
+                BCP.objects.bulk_update(cambiados, CAMPOS_RECALCULADOS, batch_size=TAMANO_BLOQUE_ACTUALIZACION)
+                # bulk_update no pasa por save: el resumen diario se corrige aquí
+                aplicar_movimientos(anteriores, signo=-1)
+                aplicar_movimientos(cambiados)
+            actualizados += len(cambiados)
+
+    if actualizados:
+        # Los valores cambiaron sin cambiar la marca de agua de las exportaciones
+        invalidar_exportaciones()
+    return actualizados, sin_tarifa
@@ -0,0 +1,92 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalogos import CatalogoEnCache
+from .models import ReglaReferido
+
+
+def codigo_referido_entero(valor):
+    """
+    Interpreta CLIENTE.CODIGO_REFERIDO como número (mismo criterio que el
+    cálculo original: int() o nada).
+    """
+    if not valor:
+        return None
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+class TablaReferidos:
+    """
+    Reglas de referido activas compiladas en listas paralelas (umbrales,
+    porcentajes, fijos) indexadas por posición.
+
+    La última posición (``sin_regla``) vale cero en todo y es la de los
+    códigos sin regla, así el cálculo por fila y el vectorizado no tienen
+    ramas por esquema: agregar reglas no agrega costo por fila.
+    """
+
+    def __init__(self, reglas):
+        activas = sorted((r for r in reglas if r.activo), key=lambda r: r.codigo_referido)
+        self.posiciones = {r.codigo_referido: n for n, r in enumerate(activas)}
+        self.sin_regla = len(activas)
+        self.umbrales = [r.umbral for r in activas] + [Decimal('0.00')]
+        self.porcentajes = [r.porcentaje for r in activas] + [Decimal('0.0000')]
+        self.fijos = [r.fijo for r in activas] + [Decimal('0.00')]
+        # Posición ya resuelta por cada valor de CODIGO_REFERIDO visto
+        self._por_valor = {}
+
+    def posicion(self, codigo_referido):
+        """
+        Posición de la regla del código de referido (sin_regla si no tiene).
+        """
+        try:
+            return self._por_valor[codigo_referido]
+        except KeyError:
+            pos = self.posiciones.get(codigo_referido_entero(codigo_referido), self.sin_regla)
+            self._por_valor[codigo_referido] = pos
+            return pos
+
+    def ganancia(self, monto, codigo_referido):
+        """
+        Ganancia de referido de un movimiento (la misma que calcula calcular_datos_lote).
+        """
+        pos = self.posicion(codigo_referido)
+        if pos == self.sin_regla:
+            return Decimal('0.00')
+        if monto > self.umbrales[pos]:
+            return monto * self.porcentajes[pos]
+        return self.fijos[pos]
+
+
+_reglas = CatalogoEnCache(
+    "banco:referidos:version",
+    lambda: TablaReferidos(ReglaReferido.objects.all()),
+)
+
+
+def obtener_reglas():
+    """
+    TablaReferidos con las reglas actuales, leída de la base de datos solo
+    cuando cambió la versión o pasó BANCO_TARIFAS_TTL.
+    """
+    return _reglas.obtener()
+
+
+def invalidar_reglas():
+    """
+    Hace que todos los workers vuelvan a leer las reglas de referido.
+    """
+    _reglas.invalidar()
+
+
+@receiver(post_save, sender=ReglaReferido)
+@receiver(post_delete, sender=ReglaReferido)
+def _regla_modificada(sender, **kwargs):
+    # Después del commit, para que nadie recargue los datos viejos con la versión nueva
+    transaction.on_commit(invalidar_reglas)
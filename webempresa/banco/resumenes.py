@@ -0,0 +1,178 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import BCP, ResumenDiario
+
+
+# Campos de BCP que se suman en ResumenDiario (además de la cantidad)
+CAMPOS_SUMADOS = ["monto", "comision", "lm_pagar", "ganancia_referido"]
+
+# Resúmenes por consulta (SQL Server admite hasta 2100 parámetros por consulta)
+TAMANO_BLOQUE_RESUMEN = 150
+
+# Movimientos borrados que se descuentan juntos al final (ver acumular_borrados)
+_borrados = ContextVar("banco_movimientos_borrados", default=None)
+
+
+def _clave(movimiento):
+    return (movimiento.cliente_id or "", movimiento.tarifa_id or "", movimiento.fecha or ResumenDiario.SIN_FECHA)
+
+
+def _diferencias(movimientos, signo):
+    """
+    Agrupa los movimientos por (cliente, tarifa, fecha) y suma sus valores
+    multiplicados por ``signo`` (1 al agregar, -1 al quitar).
+    """
+    grupos = defaultdict(lambda: {"cantidad": 0, **{c: Decimal('0.00') for c in CAMPOS_SUMADOS}})
+    for m in movimientos:
+        grupo = grupos[_clave(m)]
+        grupo["cantidad"] += signo
+        for campo in CAMPOS_SUMADOS:
+            grupo[campo] += signo * (getattr(m, campo) or Decimal('0.00'))
+    return grupos
+
+
+def _existentes(claves):
+    # Resúmenes que ya existen para las claves, en una sola consulta
+    clientes = {c for c, _, _ in claves}
+    tarifas = {t for _, t, _ in claves}
+    fechas = {f for _, _, f in claves}
+    resumenes = ResumenDiario.objects.filter(
+        fecha__in=fechas, cod_cliente__in=clientes, cod_tarifa__in=tarifas
+    )
+    return {(r.cod_cliente, r.cod_tarifa, r.fecha): r for r in resumenes}
+
+
+def _sumar_uno(clave, valores):
+    # Camino lento (uno por uno) si otro proceso creó el mismo resumen al mismo tiempo
+    cod_cliente, cod_tarifa, fecha = clave
+    cambios = {campo: F(campo) + valor for campo, valor in valores.items()}
+    filas = ResumenDiario.objects.filter(cod_cliente=cod_cliente, cod_tarifa=cod_tarifa, fecha=fecha)
+    if not filas.update(**cambios):
+        ResumenDiario.objects.create(cod_cliente=cod_cliente, cod_tarifa=cod_tarifa, fecha=fecha, **valores)
+
+
+def aplicar_movimientos(movimientos, signo=1):
+    """
+    Suma (signo=1) o resta (signo=-1) los movimientos BCP a ResumenDiario.
+
+    Se llama dentro de la misma transacción que guarda o borra los
+    movimientos, así el resumen siempre cuadra con BCP. Por cada bloque de
+    TAMANO_BLOQUE_RESUMEN resúmenes tocados cuesta una consulta, un
+    bulk_update y un bulk_create, sin importar cuántos movimientos sean.
+    """
+    grupos = _diferencias(movimientos, signo)
+    claves = list(grupos)
+    with transaction.atomic():
+        for inicio in range(0, len(claves), TAMANO_BLOQUE_RESUMEN):
+            _aplicar_bloque(claves[inicio:inicio + TAMANO_BLOQUE_RESUMEN], grupos)
+
+
+def _aplicar_bloque(claves, grupos):
+    existentes = _existentes(claves)
+    actualizar = []
+    nuevos = []
+    for clave in claves:
+        valores = grupos[clave]
+        resumen = existentes.get(clave)
+        if resumen is None:
+            cod_cliente, cod_tarifa, fecha = clave
+            nuevos.append((clave, ResumenDiario(
+                cod_cliente=cod_cliente, cod_tarifa=cod_tarifa, fecha=fecha, **valores
+            )))
+            continue
+        # F() para que dos guardados a la vez no se pisen
+        for campo, valor in valores.items():
+            setattr(resumen, campo, F(campo) + valor)
+        actualizar.append(resumen)
+
+    if actualizar:
+        ResumenDiario.objects.bulk_update(actualizar, ["cantidad"] + CAMPOS_SUMADOS)
+    if nuevos:
+        try:
+            with transaction.atomic():
+                ResumenDiario.objects.bulk_create([r for _, r in nuevos])
+        except IntegrityError:
+            for clave, _ in nuevos:
+                _sumar_uno(clave, grupos[clave])
+
+
+def totales_resumen(queryset, columnas):
+    """
+    Suma los resúmenes de ``queryset`` agrupados por ``columnas`` (campos de
+    ResumenDiario). Devuelve (grupos, total general); lee solo ResumenDiario,
+    nunca BCP. Los movimientos sin fecha salen con fecha None.
+    """
+    sumas = {"cantidad": Sum("cantidad"), **{c: Sum(c) for c in CAMPOS_SUMADOS}}
+    grupos = list(queryset.values(*columnas).annotate(**sumas).order_by(*columnas))
+    total = queryset.aggregate(**sumas)
+    for fila in grupos + [total]:
+        if fila.get("fecha") == ResumenDiario.SIN_FECHA:
+            fila["fecha"] = None
+        fila["cantidad"] = fila["cantidad"] or 0
+        for campo in CAMPOS_SUMADOS:
+            fila[campo] = fila[campo] or Decimal('0.00')
+    return grupos, total
+
+
+def reconstruir_resumenes():
+    """
+    Vuelve a calcular ResumenDiario completo desde BCP (por ejemplo después
+    de modificar movimientos con queryset.update, que no pasa por save).
+    """
+    totales = (
+        BCP.objects.values("cliente_id", "tarifa_id", "fecha")
+        .annotate(**{f"total_{c}": Sum(c) for c in CAMPOS_SUMADOS}, total_cantidad=Count("id"))
+        .order_by()
+    )
+    with transaction.atomic():
+        ResumenDiario.objects.all().delete()
+        ResumenDiario.objects.bulk_create(
+            (
+                ResumenDiario(
+                    cod_cliente=t["cliente_id"] or "",
+                    cod_tarifa=t["tarifa_id"] or "",
+                    fecha=t["fecha"] or ResumenDiario.SIN_FECHA,
+                    cantidad=t["total_cantidad"],
+                    **{c: t[f"total_{c}"] or Decimal('0.00') for c in CAMPOS_SUMADOS},
+                )
+                for t in totales.iterator()
+            ),
+            batch_size=TAMANO_BLOQUE_RESUMEN,
+        )
+
+
+@contextmanager
+def acumular_borrados():
+    """
+    Junta en la lista que devuelve los movimientos borrados dentro del
+    bloque, en lugar de descontarlos de ResumenDiario uno por uno; quien la
+    usa los descuenta después con aplicar_movimientos(borrados, signo=-1).
+    Lo usa BCP.objects...delete().
+    """
+    borrados = []
+    token = _borrados.set(borrados)
+    try:
+        yield borrados
+    finally:
+        _borrados.reset(token)
+
+
+@receiver(post_delete, sender=BCP)
+def _movimiento_borrado(sender, instance, **kwargs):
+    # Los borrados de un queryset se descuentan juntos (ver BCPQuerySet.delete).
+    # Los que caen en cascada al borrar un Cliente o una TarifaOperacion pasan
+    # de a uno: para muchos movimientos conviene borrarlos antes con
+    # BCP.objects.filter(...).delete(), o llamar después a reconstruir_resumenes
+    borrados = _borrados.get()
+    if borrados is not None:
+        borrados.append(instance)
+        return
+    aplicar_movimientos([instance], signo=-1)
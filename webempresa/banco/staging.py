@@ -0,0 +1,208 @@
+from collections import namedtuple
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .models import ImportacionTemporal, FilaImportacion, Cliente
+from .tarifas import obtener_tarifas
+
+
+# Las importaciones sin confirmar se borran pasado este tiempo
+CADUCIDAD = timedelta(hours=24)
+
+# Filas que se leen de la tabla temporal en cada consulta al confirmar
+TAMANO_BLOQUE_LECTURA = 2000
+
+# Campos de la preview que el usuario puede modificar en una fila
+CAMPOS_EDITABLES = [
+    "fecha", "fecha_valuta", "descripcion", "monto", "sucursal_agencia",
+    "n_operacion", "usuario", "saldo_inicial", "codigo", "cliente",
+]
+
+# Filas por página de la preview y máximo que se puede pedir de una vez
+TAMANO_PAGINA_PREVIEW = 100
+MAX_PAGINA_PREVIEW = 500
+
+# Fila de la preview: solo los datos del movimiento. cliente y tarifa son
+# referencias al Cliente del resolutor y a la TarifaOperacion del cache de
+# tarifas, compartidas por todas las filas del mismo cliente: sus datos
+# (nombre, correo, cuentas del referido...) no se copian en cada fila.
+FilaPreview = namedtuple("FilaPreview", [
+    "indice", "cod_bcp", "fecha", "fecha_valuta", "descripcion", "monto", "sucursal_agencia",
+    "n_operacion", "usuario", "codigo", "saldo_inicial", "dni", "cliente", "tarifa",
+    "saldo", "comision", "lm_pagar", "ganancia_referido",
+])
+
+
+def crear_importacion(tarifa_default=None):
+    """
+    Crea una importación temporal nueva y de paso borra las abandonadas.
+    """
+    ImportacionTemporal.objects.filter(creado__lt=timezone.now() - CADUCIDAD).delete()
+    return ImportacionTemporal.objects.create(
+        cod_tarifa_default=tarifa_default.cod_tarifa if tarifa_default else None
+    )
+
+
+def obtener_importacion(token):
+    """
+    Devuelve la importación temporal del token, o None si no existe o el token no es válido.
+    """
+    if not token:
+        return None
+    try:
+        return ImportacionTemporal.objects.filter(token=token).first()
+    except (ValidationError, ValueError):
+        return None
+
+
+def guardar_filas(importacion, filas):
+    """
+    Guarda en la tabla temporal un lote de FilaPreview (ver preparar_lote).
+    """
+    FilaImportacion.objects.bulk_create([
+        FilaImportacion(
+            importacion=importacion,
+            indice=f.indice,
+            cod_bcp=f.cod_bcp or None,
+            fecha=f.fecha,
+            fecha_valuta=f.fecha_valuta,
+            descripcion=f.descripcion,
+            monto=f.monto,
+            sucursal_agencia=f.sucursal_agencia,
+            n_operacion=f.n_operacion,
+            usuario=f.usuario,
+            codigo=f.codigo,
+            saldo_inicial=f.saldo_inicial,
+            dni=f.dni,
+            cod_cliente=f.cliente.cod_cliente if f.cliente else None,
+            cod_tarifa=f.cliente.cod_tarifa or None if f.cliente else None,
+            saldo=f.saldo,
+            comision=f.comision,
+            lm_pagar=f.lm_pagar,
+            ganancia_referido=f.ganancia_referido,
+        )
+        for f in filas
+    ])
+
+
+def iterar_filas(importacion, tamano=TAMANO_BLOQUE_LECTURA):
+    """
+    Recorre las filas de la importación en bloques ordenados por índice
+    (paginación por índice, sin OFFSET).
+    """
+    ultimo = -1
+    while True:
+        bloque = list(
+            importacion.filas.filter(indice__gt=ultimo).order_by("indice")[:tamano]
+        )
+        if not bloque:
+            return
+        yield bloque
+        ultimo = bloque[-1].indice
+
+
+def ediciones_desde_post(post):
+    """
+    Lee del POST solo las filas editadas en la preview.
+
+    Devuelve un diccionario {indice: {campo: valor}} con los CAMPOS_EDITABLES.
+    """
+    indices = post.getlist("indice")
+    valores = {campo: post.getlist(campo) for campo in CAMPOS_EDITABLES}
+
+    ediciones = {}
+    for n, indice in enumerate(indices):
+        try:
+            indice = int(indice)
+        except ValueError:
+            continue
+        ediciones[indice] = {
+            campo: lista[n] for campo, lista in valores.items() if n < len(lista)
+        }
+    return ediciones
+
+
+def _fila_json(f):
+    return {
+        "indice": f.indice,
+        "fecha": f.fecha.isoformat() if f.fecha else "",
+        "fecha_valuta": f.fecha_valuta.isoformat() if f.fecha_valuta else "",
+        "descripcion": f.descripcion,
+        "monto": f"{f.monto:.2f}",
+        "sucursal_agencia": f.sucursal_agencia or "",
+        "n_operacion": f.n_operacion or "",
+        "usuario": f.usuario or "",
+        "saldo_inicial": f"{f.saldo_inicial:.2f}",
+        "saldo": f"{f.saldo:.2f}",
+        "comision": f"{f.comision:.2f}",
+        "lm_pagar": f"{f.lm_pagar:.2f}",
+        "ganancia_referido": f"{f.ganancia_referido:.2f}",
+        "codigo": f.codigo or "",
+        "dni": f.dni or "",
+        # Claves de las tablas de clientes y tarifas
+        "cliente": f.cliente.cod_cliente if f.cliente else "",
+        "tarifa": f.tarifa.cod_tarifa if f.tarifa else "",
+    }
+
+
+def _cliente_json(c):
+    return {
+        "nombre": c.nombre,
+        "celular": c.celular or "",
+        "status": c.status or "",
+        "provincia": c.provincia or "",
+        "codigo_referido": c.codigo_referido or "",
+        "nombre_referido": c.nombre_referido or "",
+        "cuenta_banco_referido": c.cuenta_banco_referido or "",
+        "cuenta_interbancario_referido": c.cuenta_interbancario_referido or "",
+        "correo": c.correo or "",
+    }
+
+
+def _tarifa_json(t):
+    # Para recalcular en el navegador
+    return {"costo_por_porcentaje": str(t.costo_por_porcentaje), "costo_fijo": str(t.costo_fijo)}
+
+
+def filas_preview(importacion, offset=0, limite=TAMANO_PAGINA_PREVIEW):
+    """
+    Devuelve una ventana de filas de la importación lista para la preview,
+    serializable a JSON: {"filas": [...], "clientes": {cod_cliente: {...}},
+    "tarifas": {cod_tarifa: {...}}}. Cada fila lleva los datos del
+    movimiento y los códigos de su cliente y tarifa; los datos de cada
+    cliente y tarifa van una sola vez, en su tabla.
+
+    Cuesta lo mismo para cualquier offset: las filas se buscan por rango de
+    índice y los clientes de la ventana con una sola consulta.
+    """
+    registros = list(
+        importacion.filas.filter(indice__gte=offset, indice__lt=offset + limite).order_by("indice")
+    )
+    cod_clientes = {r.cod_cliente for r in registros if r.cod_cliente}
+    clientes = {c.cod_cliente: c for c in Cliente.objects.filter(cod_cliente__in=cod_clientes)}
+    tarifas = obtener_tarifas()
+    tarifa_default = tarifas.get(importacion.cod_tarifa_default)
+
+    filas = []
+    for r in registros:
+        cliente_obj = clientes.get(r.cod_cliente)
+        # Misma tarifa que se mostraba en la preview: la del cliente o la elegida por defecto
+        tarifa_obj = None
+        if cliente_obj and cliente_obj.cod_tarifa:
+            tarifa_obj = tarifas.get(cliente_obj.cod_tarifa)
+        filas.append(FilaPreview(
+            indice=r.indice, cod_bcp=r.cod_bcp, fecha=r.fecha, fecha_valuta=r.fecha_valuta,
+            descripcion=r.descripcion, monto=r.monto, sucursal_agencia=r.sucursal_agencia,
+            n_operacion=r.n_operacion, usuario=r.usuario, codigo=r.codigo,
+            saldo_inicial=r.saldo_inicial, dni=r.dni, cliente=cliente_obj,
+            tarifa=tarifa_obj or tarifa_default, saldo=r.saldo, comision=r.comision,
+            lm_pagar=r.lm_pagar, ganancia_referido=r.ganancia_referido,
+        ))
+
+    return {
+        "filas": [_fila_json(f) for f in filas],
+        "clientes": {cod: _cliente_json(c) for cod, c in clientes.items()},
+        "tarifas": {t.cod_tarifa: _tarifa_json(t) for t in {f.tarifa for f in filas if f.tarifa}},
+    }
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalogos import CatalogoEnCache
+from .models import TarifaOperacion
+
+
+def _cargar_tarifas():
+    return {t.cod_tarifa: t for t in TarifaOperacion.objects.all()}
+
+
+_tarifas = CatalogoEnCache("banco:tarifas:version", _cargar_tarifas)
+
+
+def obtener_tarifas():
+    """
+    Diccionario cod_tarifa -> TarifaOperacion, leído de la base de datos solo
+    cuando cambió la versión o pasó BANCO_TARIFAS_TTL.
+
+    Los objetos se comparten entre hilos: se pueden asignar a BCP.tarifa pero
+    no se deben modificar.
+    """
+    return _tarifas.obtener()
+
+
+def obtener_tarifa(cod_tarifa):
+    """
+    Tarifa del código dado (o None) sin consultar la base de datos.
+    """
+    if not cod_tarifa:
+        return None
+    return obtener_tarifas().get(cod_tarifa)
+
+
+def invalidar_tarifas():
+    """
+    Hace que todos los workers vuelvan a leer las tarifas.
+    """
+    _tarifas.invalidar()
+
+
+@receiver(post_save, sender=TarifaOperacion)
+@receiver(post_delete, sender=TarifaOperacion)
+def _tarifa_modificada(sender, **kwargs):
+    # Después del commit, para que nadie recargue los datos viejos con la versión nueva
+    transaction.on_commit(invalidar_tarifas)
@@ -1,3 +1,1583 @@
-from django.test import TestCase
+import base64
+import copy
+import csv
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import ROUND_HALF_EVEN, Decimal
+from functools import partial
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import openpyxl
+import pandas as pd
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import admin as banco_admin
+from . import importacion as importacion_mod
+from . import trabajos, views
+
+from .benchmark import generar_libro, medir_pipeline, sembrar_datos
+from .calculos import COLUMNAS_CALCULADAS, TARIFA_POR_DEFECTO, calcular_datos_lote, centavos_a_decimal
+from .catalogos import CatalogoEnCache
+from .coincidencias import IndiceClientes, invalidar_indice_clientes, obtener_indice_clientes
+from .exportacion import COLUMNAS_EXPORTACION, filas_exportacion, parquet_disponible
+from .forms import FiltroExportacionForm, UploadExcelForm
+from .importacion import ResolutorImportacion, confirmar_filas, guardar_lote, leer_lotes_excel, preparar_lote
+from .ingesta import ingerir_movimientos
+from .instrumentacion import Medicion, Presupuesto, PresupuestoExcedido, registro
+from .models import (
+    BCP, Cliente, ExportacionGuardada, FilaImportacion, ImportacionTemporal, ReglaReferido, ResumenDiario,
+    Secuencia, TarifaOperacion, TrabajoImportacion,
+)
+from .recalculo import recalcular_movimientos
+from .resumenes import CAMPOS_SUMADOS, aplicar_movimientos, reconstruir_resumenes
+from .referidos import TablaReferidos, invalidar_reglas, obtener_reglas
+from .staging import (
+    MAX_PAGINA_PREVIEW, TAMANO_PAGINA_PREVIEW, crear_importacion, guardar_filas, iterar_filas, obtener_importacion,
+)
+from .tarifas import invalidar_tarifas, obtener_tarifas
+
+
+class TablasExternasMixin:
+    """
+    CLIENTE y TARIFA_OPERACION son managed = False, así que la base de datos
+    de test no las tiene: se crean antes de los tests de la clase y se borran al final.
+
+    BCP también se vuelve a crear desde el modelo: en las migraciones su
+    COD_TARIFA apunta al id de la tarifa, no a cod_tarifa.
+    """
+
+    modelos_externos = [Cliente, TarifaOperacion]
+
+    @classmethod
+    def setUpClass(cls):
+        # Fuera de la transacción del TestCase (SQLite no permite cambios de esquema dentro)
+        with connection.schema_editor() as editor:
+            for modelo in cls.modelos_externos:
+                editor.create_model(modelo)
+            editor.delete_model(BCP)
+            editor.create_model(BCP)
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        # Toda vista con presupuesto (instrumentacion.presupuesto) que se pase hace fallar el test
+        self.enterContext(override_settings(BANCO_PRESUPUESTOS_ESTRICTOS=True))
+        # Los catálogos se invalidan con on_commit, que no corre dentro de un TestCase:
+        # sin esto quedarían las tarifas de otra clase de tests
+        invalidar_tarifas()
+        invalidar_reglas()
+        invalidar_indice_clientes()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            for modelo in cls.modelos_externos:
+                editor.delete_model(modelo)
+
+
+def crear_datos_base():
+    tarifas = [
+        TarifaOperacion.objects.create(
+            cod_tarifa="TARIFA01", descripcion="Tarifa 1",
+            costo_por_porcentaje=Decimal("0.0100"), costo_fijo=Decimal("5.00"),
+        ),
+        TarifaOperacion.objects.create(
+            cod_tarifa="TARIFA02", descripcion="Tarifa 2",
+            costo_por_porcentaje=Decimal("0.0125"), costo_fijo=Decimal("7.50"),
+        ),
+    ]
+    clientes = [
+        Cliente.objects.create(
+            id=n + 1, cod_cliente=f"CLI{n:04d}", dni=f"{40000000 + n}",
+            nombre=f"Cliente {n}", apellidos="Prueba", cod_tarifa=tarifas[n].cod_tarifa,
+        )
+        for n in range(2)
+    ]
+    return clientes, tarifas
+
+
+def crear_movimientos(clientes, tarifas, cantidad, inicio=0):
+    BCP.objects.bulk_create([
+        BCP(
+            cod_bcp=f"T{n:06d}",
+            fecha=date(2025, 1, 1 + n % 28),
+            descripcion=f"PAGO {n}",
+            monto=Decimal(n),
+            cliente=clientes[n % len(clientes)],
+            tarifa=tarifas[n % len(tarifas)],
+        )
+        for n in range(inicio, inicio + cantidad)
+    ])
+
+
+def leer_csv(response):
+    return list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode("utf-8"))))
+
+
+def leer_xlsx(response):
+    libro = openpyxl.load_workbook(io.BytesIO(b"".join(response.streaming_content)))
+    return list(libro.active.iter_rows(values_only=True))
+
+
+class CalculoLoteTests(SimpleTestCase):
+    """
+    calcular_datos_lote tiene que dar lo mismo que BCP.calcular_datos fila por
+    fila, redondeado como lo guarda el DecimalField (ROUND_HALF_EVEN).
+    """
+
+    tarifas = {
+        "TARIFA01": TarifaOperacion(
+            cod_tarifa="TARIFA01", costo_por_porcentaje=Decimal("0.0100"), costo_fijo=Decimal("5.00"),
+        ),
+        "TARIFA02": TarifaOperacion(
+            cod_tarifa="TARIFA02", costo_por_porcentaje=Decimal("0.0125"), costo_fijo=Decimal("7.50"),
+        ),
+    }
+    reglas = TablaReferidos([
+        # La regla migrada en 0014_reglareferido
+        ReglaReferido(codigo_referido=6, umbral=Decimal("1500.00"), porcentaje=Decimal("0.0010"), fijo=Decimal("1.50")),
+    ])
+
+    # (monto, saldo_inicial, cod_tarifa del cliente o None sin cliente, codigo_referido)
+    casos = [
+        ("-500.00", "0.00", "TARIFA01", None),
+        ("-1500.01", "100.00", "TARIFA02", "6"),
+        ("1500.00", "0.00", "TARIFA01", None),
+        ("1500.01", "0.00", "TARIFA01", None),
+        ("1500.00", "0.00", "TARIFA02", "6"),
+        ("1500.01", "0.00", "TARIFA02", "6"),
+        ("20000.00", "0.00", "TARIFA01", "06"),
+        ("1000.00", "0.00", "TARIFA01", "7"),
+        # Tarifa que no existe: sin comisión
+        ("2000.00", "0.00", "NOEXISTE", None),
+        ("100.00", "0.00", None, None),
+        # Mitades exactas en comisión (15.005, 15.015) y ganancia de referido (1.505, 1.515)
+        ("1500.50", "0.00", "TARIFA01", None),
+        ("1501.50", "0.00", "TARIFA01", None),
+        ("1505.00", "0.00", "TARIFA02", "6"),
+        ("1515.00", "0.00", "TARIFA02", "6"),
+        # saldo_inicial con 3 decimales: saldo 10.005 y 10.015
+        ("10.00", "0.005", "TARIFA01", None),
+        ("10.00", "0.015", "TARIFA01", None),
+        ("0.00", "-0.125", "TARIFA02", None),
+    ]
+
+    def por_fila(self, monto, saldo_inicial, cod_tarifa, codigo_referido):
+        b = BCP(monto=Decimal(monto))
+        b.saldo_inicial = Decimal(saldo_inicial)
+        if cod_tarifa:
+            b.cliente = Cliente(cod_cliente="CLI", cod_tarifa=cod_tarifa, codigo_referido=codigo_referido)
+        b.calcular_datos(tarifas=self.tarifas, reglas=self.reglas)
+        return tuple(
+            getattr(b, campo).quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN) for campo in COLUMNAS_CALCULADAS
+        )
+
+    def test_igual_que_calcular_datos(self):
+        df = pd.DataFrame(
+            [
+                {
+                    "monto": Decimal(monto),
+                    "saldo_inicial": Decimal(saldo_inicial),
+                    "cod_tarifa": cod_tarifa or TARIFA_POR_DEFECTO,
+                    "codigo_referido": codigo_referido if cod_tarifa else None,
+                }
+                for monto, saldo_inicial, cod_tarifa, codigo_referido in self.casos
+            ],
+            columns=["monto", "saldo_inicial", "cod_tarifa", "codigo_referido"],
+        )
+        resultados = calcular_datos_lote(df, self.tarifas, self.reglas)
+        for caso, calc in zip(self.casos, resultados.itertuples(index=False)):
+            with self.subTest(caso=caso):
+                self.assertEqual(
+                    tuple(centavos_a_decimal(getattr(calc, campo)) for campo in COLUMNAS_CALCULADAS),
+                    self.por_fila(*caso),
+                )
+
+    def test_valores_esperados(self):
+        esperados = {
+            ("1500.00", "0.00", "TARIFA02", "6"): ("1500.00", "7.50", "1492.50", "1.50"),
+            ("1500.01", "0.00", "TARIFA02", "6"): ("1500.01", "18.75", "1481.26", "1.50"),
+            ("1500.50", "0.00", "TARIFA01", None): ("1500.50", "15.00", "1485.50", "0.00"),
+            ("1501.50", "0.00", "TARIFA01", None): ("1501.50", "15.02", "1486.48", "0.00"),
+            ("1505.00", "0.00", "TARIFA02", "6"): ("1505.00", "18.81", "1486.19", "1.50"),
+            ("1515.00", "0.00", "TARIFA02", "6"): ("1515.00", "18.94", "1496.06", "1.52"),
+            ("10.00", "0.005", "TARIFA01", None): ("10.00", "5.00", "5.00", "0.00"),
+            ("2000.00", "0.00", "NOEXISTE", None): ("2000.00", "0.00", "2000.00", "0.00"),
+        }
+        for caso, valores in esperados.items():
+            with self.subTest(caso=caso):
+                self.assertEqual(self.por_fila(*caso), tuple(Decimal(v) for v in valores))
+
+
+class LecturaExcelTests(SimpleTestCase):
+
+    def libro(self, filas):
+        libro = openpyxl.Workbook()
+        for fila in filas:
+            libro.active.append(fila)
+        archivo = io.BytesIO()
+        libro.save(archivo)
+        archivo.seek(0)
+        return archivo
+
+    def test_encabezados_normalizados_y_filas_vacias(self):
+        archivo = self.libro([
+            [" Fecha valuta", "Descripción operación", None, "Monto"],
+            [date(2025, 1, 2), "PAGO 40000000", "x", 1500.5],
+            [None, None, None, None],
+            [None, "", None, None],
+            ["02/01/2025", "PAGO 40000001", None, 10],
+        ])
+        lotes = list(leer_lotes_excel(archivo))
+        self.assertEqual(len(lotes), 1)
+        self.assertEqual(lotes[0], [
+            {"FECHA_VALUTA": datetime(2025, 1, 2), "DESCRIPCIÓN_OPERACIÓN": "PAGO 40000000",
+             "UNNAMED:_2": "x", "MONTO": "1500.5"},
+            {"FECHA_VALUTA": "02/01/2025", "DESCRIPCIÓN_OPERACIÓN": "PAGO 40000001",
+             "UNNAMED:_2": None, "MONTO": "10"},
+        ])
+
+    def test_lotes_del_tamano_pedido(self):
+        filas = [["Monto"]] + [[n] for n in range(5)]
+        lotes = list(leer_lotes_excel(self.libro(filas), tamano_lote=2))
+        self.assertEqual([[f["MONTO"] for f in lote] for lote in lotes], [["0", "1"], ["2", "3"], ["4"]])
+
+        # Sin lote vacío al final cuando las filas son múltiplo del tamaño
+        lotes = list(leer_lotes_excel(self.libro(filas[:5]), tamano_lote=2))
+        self.assertEqual([len(lote) for lote in lotes], [2, 2])
+
+        # Las filas vacías no cuentan para el tamaño del lote
+        lotes = list(leer_lotes_excel(self.libro([["Monto"], [1], [None], [2], [3]]), tamano_lote=2))
+        self.assertEqual([len(lote) for lote in lotes], [2, 1])
+
+    def test_hoja_vacia(self):
+        self.assertEqual(list(leer_lotes_excel(self.libro([]))), [])
+        self.assertEqual(list(leer_lotes_excel(self.libro([["Fecha", "Monto"]]))), [])
+
+
+@override_settings(BANCO_EXPORTACIONES_DIR=tempfile.mkdtemp(prefix="banco_test_"))
+class ExportacionTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+
+    def test_filas_exportacion_cantidad_fija_de_consultas(self):
+        crear_movimientos(self.clientes, self.tarifas, 10)
+        with self.assertNumQueries(1):
+            filas = list(filas_exportacion())
+        self.assertEqual(len(filas), 10)
+
+        crear_movimientos(self.clientes, self.tarifas, 300, inicio=10)
+        with self.assertNumQueries(1):
+            filas = list(filas_exportacion())
+        self.assertEqual(len(filas), 310)
+
+    def test_filas_exportacion_trae_cliente_y_tarifa(self):
+        crear_movimientos(self.clientes, self.tarifas, 2)
+        filas = sorted(filas_exportacion())
+        self.assertEqual(filas[0][0], "T000000")
+        self.assertEqual(filas[0][4], 0.0)
+        self.assertEqual(filas[1][-2:], ("CLI0001", "TARIFA02"))
+
+    def test_exportar_excel_cantidad_fija_de_consultas(self):
+        consultas = []
+        for cantidad in (10, 250):
+            crear_movimientos(self.clientes, self.tarifas, cantidad, inicio=len(consultas) * 10)
+            ExportacionGuardada.objects.all().delete()
+            with CaptureQueriesContext(connection) as capturadas:
+                response = self.client.get(reverse("banco:exportar_excel"))
+                contenido = b"".join(response.streaming_content)
+            consultas.append(len(capturadas))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(contenido.startswith(b"PK"))
+        self.assertEqual(consultas[0], consultas[1])
+
+    def test_exportar_excel_filtrado(self):
+        crear_movimientos(self.clientes, self.tarifas, 40)
+        filtro = FiltroExportacionForm({"cliente": "CLI0001", "fecha_desde": "2025-01-05", "fecha_hasta": "2025-01-20"})
+        self.assertTrue(filtro.is_valid())
+        filas = list(filas_exportacion(filtro.filtrar(BCP.objects.all())))
+        self.assertEqual(len(filas), 12)
+        self.assertTrue(all(f[-2] == "CLI0001" and date(2025, 1, 5) <= f[1] <= date(2025, 1, 20) for f in filas))
+
+    def test_exportar_excel_filtro_invalido(self):
+        response = self.client.get(
+            reverse("banco:exportar_excel"), {"fecha_desde": "2025-02-01", "fecha_hasta": "2025-01-01"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("fecha_hasta", response.json()["errores"])
+
+    def test_excel_se_abre_con_openpyxl(self):
+        crear_movimientos(self.clientes, self.tarifas, 3, inicio=5)
+        hoja = openpyxl.load_workbook(
+            io.BytesIO(b"".join(self.client.get(reverse("banco:exportar_excel")).streaming_content))
+        ).active
+        self.assertEqual(hoja.title, "BCP")
+        self.assertEqual([c.value for c in hoja[1]], [c[2] for c in COLUMNAS_EXPORTACION])
+        self.assertEqual(hoja.max_row, 4)
+
+        tipos = [c[3] for c in COLUMNAS_EXPORTACION]
+        fecha = hoja.cell(row=2, column=tipos.index("fecha") + 1)
+        self.assertEqual(fecha.value.date(), date(2025, 1, 6))
+        self.assertEqual(fecha.number_format, "yyyy-mm-dd")
+        dinero = hoja.cell(row=3, column=tipos.index("dinero") + 1)
+        self.assertEqual(dinero.value, 6)
+        self.assertEqual(dinero.number_format, "#,##0.00")
+        # Zebra en las filas pares
+        self.assertEqual(hoja.cell(row=2, column=1).fill.fgColor.rgb, "00D9E1F2")
+        self.assertEqual(hoja.cell(row=3, column=1).fill.fill_type, None)
+        self.assertEqual(hoja.cell(row=4, column=1).fill.fgColor.rgb, "00D9E1F2")
+
+    def test_excel_recortado_al_maximo_de_filas(self):
+        crear_movimientos(self.clientes, self.tarifas, 10)
+        with mock.patch("banco.exportacion.MAX_FILAS_HOJA", 4):
+            response = self.client.get(reverse("banco:exportar_excel"))
+            filas = leer_xlsx(response)
+        self.assertEqual(response["X-Filas-Omitidas"], "7")
+        self.assertEqual([f[0] for f in filas[1:]], ["T000000", "T000001", "T000002"])
+        # CSV no tiene límite
+        self.assertNotIn("X-Filas-Omitidas", self.client.get(reverse("banco:exportar_csv")))
+
+    def test_exportar_csv(self):
+        crear_movimientos(self.clientes, self.tarifas, 30)
+        response = self.client.get(reverse("banco:exportar_csv"), {"tarifa": "TARIFA02"})
+        filas = leer_csv(response)
+        self.assertEqual(filas[0], [c[1] for c in COLUMNAS_EXPORTACION])
+        self.assertEqual(len(filas), 16)
+        self.assertEqual(filas[1][-1], "TARIFA02")
+        self.assertEqual(sorted(Decimal(f[4]) for f in filas[1:])[0], Decimal("1.00"))
+
+    @skipUnless(parquet_disponible(), "pyarrow no está instalado")
+    def test_exportar_parquet(self):
+        import pyarrow.parquet as pq
+
+        crear_movimientos(self.clientes, self.tarifas, 30)
+        response = self.client.get(reverse("banco:exportar_parquet"), {"cliente": "CLI0000"})
+        tabla = pq.read_table(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(tabla.num_rows, 15)
+        self.assertEqual(tabla.column_names, [c[1] for c in COLUMNAS_EXPORTACION])
+        self.assertEqual(sorted(tabla.column("monto").to_pylist())[:2], [Decimal("0.00"), Decimal("2.00")])
+
+    def test_exportacion_sin_cambios_usa_el_archivo_guardado(self):
+        crear_movimientos(self.clientes, self.tarifas, 20)
+        primera = leer_csv(self.client.get(reverse("banco:exportar_csv")))
+
+        with CaptureQueriesContext(connection) as capturadas:
+            segunda = leer_csv(self.client.get(reverse("banco:exportar_csv")))
+        self.assertEqual(primera, segunda)
+        self.assertFalse(any('"COD_BCP"' in q["sql"] for q in capturadas))
+
+    def test_exportacion_con_filas_nuevas_se_extiende(self):
+        crear_movimientos(self.clientes, self.tarifas, 20)
+        for formato in ("exportar_csv", "exportar_excel"):
+            self.client.get(reverse(f"banco:{formato}")).getvalue()
+        crear_movimientos(self.clientes, self.tarifas, 15, inicio=20)
+
+        with CaptureQueriesContext(connection) as capturadas:
+            extendido_csv = leer_csv(self.client.get(reverse("banco:exportar_csv")))
+            extendido_xlsx = leer_xlsx(self.client.get(reverse("banco:exportar_excel")))
+        # Solo se leyeron las filas nuevas
+        self.assertTrue(all('"BCP"."id" > 20' in q["sql"] for q in capturadas if '"COD_BCP"' in q["sql"]))
+
+        ExportacionGuardada.objects.all().delete()
+        self.assertEqual(extendido_csv, leer_csv(self.client.get(reverse("banco:exportar_csv"))))
+        self.assertEqual(extendido_xlsx, leer_xlsx(self.client.get(reverse("banco:exportar_excel"))))
+        self.assertEqual(len(extendido_xlsx), 36)
+
+    def test_exportacion_se_regenera_si_se_edita_un_movimiento(self):
+        crear_movimientos(self.clientes, self.tarifas, 5)
+        self.client.get(reverse("banco:exportar_csv")).getvalue()
+
+        bcp = BCP.objects.get(cod_bcp="T000003")
+        bcp.descripcion = "EDITADO"
+        bcp.save(recalcular=False)
+
+        filas = leer_csv(self.client.get(reverse("banco:exportar_csv")))
+        self.assertIn("EDITADO", [f[3] for f in filas])
+
+
+def resumenes_actuales():
+    campos = ["cod_cliente", "cod_tarifa", "fecha", "cantidad"] + CAMPOS_SUMADOS
+    # Los resúmenes que quedaron en cero (todos sus movimientos se borraron) no cuentan
+    return sorted(ResumenDiario.objects.exclude(cantidad=0).values_list(*campos))
+
+
+class ResumenDiarioTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+
+    def assertResumenCuadra(self):
+        actual = resumenes_actuales()
+        reconstruir_resumenes()
+        self.assertEqual(actual, resumenes_actuales())
+
+    def test_save_actualiza_el_resumen(self):
+        bcp = BCP.objects.create(
+            fecha=date(2025, 1, 2), descripcion="PAGO", monto=Decimal("100.00"), cliente=self.clientes[0],
+        )
+        BCP.objects.create(
+            fecha=date(2025, 1, 2), descripcion="PAGO", monto=Decimal("50.00"), cliente=self.clientes[0],
+        )
+        resumen = ResumenDiario.objects.get(cod_cliente="CLI0000", fecha=date(2025, 1, 2))
+        self.assertEqual((resumen.cantidad, resumen.monto), (2, Decimal("150.00")))
+        self.assertResumenCuadra()
+
+        # Cambiar de fecha mueve el movimiento de un resumen a otro
+        bcp.fecha = date(2025, 1, 3)
+        bcp.monto = Decimal("80.00")
+        bcp.save()
+        self.assertResumenCuadra()
+        resumen = ResumenDiario.objects.get(cod_cliente="CLI0000", fecha=date(2025, 1, 3))
+        self.assertEqual((resumen.cantidad, resumen.monto), (1, Decimal("80.00")))
+
+        bcp.delete()
+        self.assertResumenCuadra()
+        self.assertFalse(ResumenDiario.objects.filter(fecha=date(2025, 1, 3)).exclude(cantidad=0).exists())
+
+    def test_save_con_el_anterior_no_relee_el_movimiento(self):
+        def lecturas_bcp(consultas):
+            return [c for c in consultas.captured_queries if c["sql"].startswith("SELECT") and '"BCP"' in c["sql"]]
+
+        bcp = BCP.objects.create(
+            fecha=date(2025, 1, 2), descripcion="PAGO", monto=Decimal("100.00"), cliente=self.clientes[0],
+        )
+        bcp = BCP.objects.get(pk=bcp.pk)
+        anterior = copy.copy(bcp)
+        bcp.fecha = date(2025, 1, 4)
+        with CaptureQueriesContext(connection) as consultas:
+            bcp.save(anterior=anterior)
+        self.assertEqual(lecturas_bcp(consultas), [])
+        self.assertResumenCuadra()
+
+        # Con update_fields solo cuenta lo que se guardó
+        anterior = copy.copy(bcp)
+        bcp.monto = Decimal("70.00")
+        bcp.descripcion = "OTRO"
+        with CaptureQueriesContext(connection) as consultas:
+            bcp.save(update_fields=["descripcion", "cliente"], anterior=anterior)
+        self.assertEqual(lecturas_bcp(consultas), [])
+        self.assertResumenCuadra()
+        resumen = ResumenDiario.objects.get(cod_cliente="CLI0000", fecha=date(2025, 1, 4))
+        self.assertEqual((resumen.cantidad, resumen.monto), (1, Decimal("100.00")))
+
+    def test_borrado_masivo_actualiza_el_resumen_por_grupo(self):
+        for n in range(30):
+            BCP.objects.create(
+                fecha=date(2025, 1, 1 + n % 3), descripcion=f"PAGO {n}", monto=Decimal(100 + n),
+                cliente=self.clientes[n % 2],
+            )
+        with CaptureQueriesContext(connection) as consultas:
+            borrados, _ = BCP.objects.filter(fecha__lt=date(2025, 1, 3)).delete()
+        self.assertEqual(borrados, 20)
+        # Una lectura y un bulk_update de los 4 resúmenes, no uno por movimiento
+        consultas_resumen = [c for c in consultas.captured_queries if '"RESUMEN_DIARIO"' in c["sql"]]
+        self.assertEqual(len(consultas_resumen), 2)
+        self.assertResumenCuadra()
+        self.assertEqual(sum(r[3] for r in resumenes_actuales()), 10)
+
+        # Si el borrado falla no queda nada a medio descontar
+        with mock.patch("django.db.models.deletion.Collector.delete", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                BCP.objects.all().delete()
+        self.assertEqual(BCP.objects.count(), 10)
+        BCP.objects.first().delete()
+        self.assertResumenCuadra()
+
+    def test_confirmar_filas_actualiza_el_resumen(self):
+        importacion = crear_importacion()
+        FilaImportacion.objects.bulk_create([
+            FilaImportacion(
+                importacion=importacion, indice=n, fecha=date(2025, 1, 1 + n % 3),
+                descripcion=f"PAGO {n}", monto=Decimal(100 + n), cod_cliente=f"CLI{n % 2:04d}",
+            )
+            for n in range(30)
+        ])
+        guardadas, errores = confirmar_filas(importacion, {}, tamano_lote=7)
+        self.assertEqual((guardadas, errores), (30, []))
+        self.assertEqual(sum(r[3] for r in resumenes_actuales()), 30)
+        self.assertResumenCuadra()
+
+    def test_movimientos_sin_fecha_en_un_solo_resumen(self):
+        for monto in ("10.00", "20.00"):
+            BCP.objects.create(descripcion="PAGO", monto=Decimal(monto), cliente=self.clientes[0])
+        BCP.objects.bulk_create([BCP(
+            cod_bcp="SF1", descripcion="PAGO", monto=Decimal("5.00"), cliente=self.clientes[0], tarifa=self.tarifas[0],
+        )])
+        aplicar_movimientos(BCP.objects.filter(cod_bcp="SF1"))
+        resumen = ResumenDiario.objects.get(cod_cliente="CLI0000")
+        self.assertEqual(
+            (resumen.fecha, resumen.cantidad, resumen.monto), (ResumenDiario.SIN_FECHA, 3, Decimal("35.00"))
+        )
+        self.assertResumenCuadra()
+
+        grupos = self.client.get(reverse("banco:resumen_diario"), {"agrupar": "fecha"}).json()["grupos"]
+        self.assertEqual([(g["fecha"], g["cantidad"]) for g in grupos], [(None, 3)])
+
+    def test_volver_a_confirmar_despues_de_un_fallo(self):
+        importacion = crear_importacion()
+        FilaImportacion.objects.bulk_create([
+            FilaImportacion(
+                importacion=importacion, indice=n, fecha=date(2025, 1, 2),
+                descripcion=f"PAGO {n}", monto=Decimal(100 + n), cod_cliente=f"CLI{n % 2:04d}",
+            )
+            for n in range(12)
+        ])
+        guardar = importacion_mod._guardar_pendientes
+        llamadas = []
+
+        def falla_el_segundo_lote(*args, **kwargs):
+            llamadas.append(1)
+            if len(llamadas) == 2:
+                raise RuntimeError("se cayó el worker")
+            return guardar(*args, **kwargs)
+
+        with mock.patch.object(importacion_mod, "_guardar_pendientes", side_effect=falla_el_segundo_lote):
+            with self.assertRaises(RuntimeError):
+                confirmar_filas(importacion, {}, tamano_lote=5)
+        # El primer lote quedó guardado y fuera de la importación; el segundo no
+        self.assertEqual(BCP.objects.count(), 5)
+        self.assertEqual(sorted(importacion.filas.values_list("indice", flat=True)), list(range(5, 12)))
+
+        guardadas, errores = confirmar_filas(importacion, {}, tamano_lote=5)
+        self.assertEqual((guardadas, errores), (7, []))
+        self.assertEqual(BCP.objects.count(), 12)
+        self.assertEqual(sorted(BCP.objects.values_list("descripcion", flat=True)), sorted(f"PAGO {n}" for n in range(12)))
+        self.assertFalse(importacion.filas.exists())
+        self.assertResumenCuadra()
+
+    def test_endpoint_resumen(self):
+        crear_movimientos(self.clientes, self.tarifas, 40)
+        reconstruir_resumenes()
+        response = self.client.get(
+            reverse("banco:resumen_diario"),
+            {"agrupar": "cliente", "fecha_desde": "2025-01-01", "fecha_hasta": "2025-01-10"},
+        )
+        datos = response.json()
+        self.assertEqual([g["cod_cliente"] for g in datos["grupos"]], ["CLI0000", "CLI0001"])
+        # Días 1 a 10: n = 0..9 y 28..37
+        self.assertEqual(datos["total"]["cantidad"], 20)
+        self.assertEqual(Decimal(datos["total"]["monto"]), Decimal(sum(range(10)) + sum(range(28, 38))))
+        self.assertEqual(sum(g["cantidad"] for g in datos["grupos"]), 20)
+
+    def test_endpoint_resumen_filtro_invalido(self):
+        response = self.client.get(reverse("banco:resumen_diario"), {"agrupar": "otra"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("agrupar", response.json()["errores"])
+
+
+class IngestaTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+        cls.usuario = User.objects.create_user("sistema", password="clave")
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+
+    def enviar(self, cuerpo, content_type="application/json"):
+        return self.client.post(reverse("banco:ingerir_movimientos"), cuerpo, content_type=content_type)
+
+    def test_ingesta_json_resultados_por_fila(self):
+        movimientos = [
+            {"fecha": "2025-01-02", "descripcion": "PAGO 40000001", "monto": "2000.00"},
+            {"fecha": "2025-01-02", "descripcion": "PAGO", "monto": "10", "cliente": "CLI0000"},
+            {"fecha": "2025-01-02", "descripcion": "PAGO", "monto": "10", "cliente": "NOEXISTE"},
+            {"fecha": "02/01/2025", "descripcion": "PAGO 40000000", "monto": "10"},
+            {"descripcion": "SIN CLIENTE", "monto": "10"},
+            {"cod_bcp": "X1", "descripcion": "PAGO 40000000", "monto": "10"},
+            {"cod_bcp": "X1", "descripcion": "PAGO 40000000", "monto": "10"},
+        ]
+        response = self.enviar(json.dumps({"movimientos": movimientos}))
+        self.assertEqual(response.status_code, 200)
+        datos = response.json()
+        self.assertEqual(
+            [r["estado"] for r in datos["resultados"]],
+            ["guardado", "guardado", "error", "error", "error", "guardado", "duplicado"],
+        )
+        self.assertEqual((datos["guardados"], datos["duplicados"], datos["con_error"]), (3, 1, 3))
+
+        # Mismo cálculo que BCP.calcular_datos
+        primero = datos["resultados"][0]
+        bcp = BCP.objects.get(cod_bcp=primero["cod_bcp"])
+        self.assertEqual((bcp.cliente_id, bcp.tarifa_id), ("CLI0001", "TARIFA02"))
+        comision = bcp.comision
+        bcp.calcular_datos()
+        self.assertEqual(comision, bcp.comision)
+        self.assertEqual(primero["comision"], f"{comision:.2f}")
+        self.assertEqual(ResumenDiario.objects.get(cod_cliente="CLI0001").cantidad, 1)
+
+    def test_ingesta_ndjson_por_lotes(self):
+        lineas = [
+            json.dumps({"fecha": "2025-01-03", "descripcion": f"PAGO {40000000 + n % 2}", "monto": n})
+            for n in range(25)
+        ]
+        lineas.insert(5, "{no es json")
+        with self.settings(BANCO_CONFIRMACION_LOTE=10):
+            with CaptureQueriesContext(connection) as capturadas:
+                response = self.enviar("\n".join(lineas) + "\n", content_type="application/x-ndjson")
+        datos = response.json()
+        self.assertEqual((datos["recibidos"], datos["guardados"], datos["con_error"]), (26, 25, 1))
+        self.assertEqual(datos["resultados"][5]["estado"], "error")
+        self.assertEqual(BCP.objects.count(), 25)
+        # Un bulk_create por lote, no un INSERT por movimiento
+        inserts = [q for q in capturadas if q["sql"].startswith('INSERT INTO "BCP"')]
+        self.assertEqual(len(inserts), 3)
+
+    def test_ingesta_cuerpo_invalido(self):
+        response = self.enviar(json.dumps({"otra": 1}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_ingesta_requiere_usuario(self):
+        self.client.logout()
+        response = self.enviar(json.dumps([{"descripcion": "PAGO 40000000", "monto": "10"}]))
+        self.assertIn(response.status_code, (401, 403))
+        self.assertFalse(BCP.objects.exists())
+
+        # Basic, para otros sistemas
+        credenciales = base64.b64encode(b"sistema:clave").decode()
+        response = self.client.post(
+            reverse("banco:ingerir_movimientos"), json.dumps([{"descripcion": "PAGO 40000000", "monto": "10"}]),
+            content_type="application/json", HTTP_AUTHORIZATION=f"Basic {credenciales}",
+        )
+        self.assertEqual(response.json()["guardados"], 1)
+
+    def test_ndjson_sin_content_length(self):
+        request = APIRequestFactory().post(
+            reverse("banco:ingerir_movimientos"), b'{"descripcion": "PAGO 40000000", "monto": 1}\n',
+            content_type="application/x-ndjson",
+        )
+        # Como un envío chunked
+        del request.META["CONTENT_LENGTH"]
+        force_authenticate(request, self.usuario)
+        response = views.ingerir_movimientos_api(request)
+        self.assertEqual(response.status_code, 411)
+
+        response = self.enviar("", content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(BCP.objects.exists())
+
+    def test_ingesta_truncada(self):
+        movimientos = [{"descripcion": f"PAGO {40000000 + n % 2}", "monto": n} for n in range(5)]
+        with mock.patch.object(views, "ingerir_movimientos", partial(ingerir_movimientos, maximo=3)):
+            response = self.enviar(json.dumps(movimientos))
+        # 200: lo recibido quedó guardado, y la respuesta dice hasta dónde
+        self.assertEqual(response.status_code, 200)
+        datos = response.json()
+        self.assertEqual((datos["truncado"], datos["recibidos"], datos["guardados"]), (True, 3, 3))
+        self.assertEqual(BCP.objects.count(), 3)
+        self.assertFalse(self.enviar(json.dumps(movimientos[3:])).json()["truncado"])
+        self.assertEqual(BCP.objects.count(), 5)
+
+
+class SecuenciaTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+
+    def crear_bcp(self, cod_bcp):
+        BCP.objects.bulk_create([BCP(
+            cod_bcp=cod_bcp, descripcion="PAGO", monto=Decimal("1.00"),
+            cliente=self.clientes[0], tarifa=self.tarifas[0],
+        )])
+
+    def test_se_inicia_con_los_codigos_existentes(self):
+        for cod_bcp in ["BCP007", "BCP1200", "BCPX", "T000001"]:
+            self.crear_bcp(cod_bcp)
+        self.assertEqual(BCP.reservar_codigos(2), ["BCP1201", "BCP1202"])
+        self.assertEqual(Secuencia.objects.get(nombre="COD_BCP").valor, 1202)
+
+    def test_bloques_consecutivos_no_se_superponen(self):
+        primero = BCP.reservar_codigos(3)
+        segundo = BCP.reservar_codigos(2)
+        self.assertEqual(primero + segundo, ["BCP001", "BCP002", "BCP003", "BCP004", "BCP005"])
+        self.assertEqual(list(Secuencia.reservar("OTRA", 2, inicial=lambda: 10)), [11, 12])
+
+    def test_reservar_cero_no_hace_nada(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(BCP.reservar_codigos(0), [])
+        self.assertFalse(Secuencia.objects.exists())
+
+    def test_save_sin_codigo_usa_uno(self):
+        b = BCP(descripcion="PAGO", monto=Decimal("10.00"), cliente=self.clientes[0])
+        b.save()
+        self.assertEqual(b.cod_bcp, "BCP001")
+        self.assertEqual(Secuencia.objects.get(nombre="COD_BCP").valor, 1)
+        # Con código no se toca la secuencia
+        BCP(cod_bcp="MANUAL", descripcion="PAGO", monto=Decimal("10.00"), cliente=self.clientes[0]).save()
+        self.assertEqual(BCP.reservar_codigos(1), ["BCP002"])
+
+
+class GuardarLoteTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+        # Cliente con una tarifa que no existe
+        cls.sin_tarifa = Cliente.objects.create(
+            id=10, cod_cliente="CLI0010", dni="40000010", nombre="Sin", apellidos="Tarifa", cod_tarifa="NOEXISTE",
+        )
+
+    def candidata(self, i, cliente, cod_bcp=None):
+        b = BCP(cod_bcp=cod_bcp, fecha=date(2025, 2, 1), descripcion=f"PAGO {i}", monto=Decimal("10.00"))
+        return (i, b, Decimal("0.00"), cliente)
+
+    def test_error_de_una_fila_no_impide_guardar_el_resto(self):
+        crear_movimientos(self.clientes, self.tarifas, 1)
+        candidatas = [
+            self.candidata(0, self.clientes[0], "A1"),
+            # Ya existe: otro proceso la guardó después de la consulta de duplicados
+            self.candidata(1, self.clientes[0], "T000000"),
+            self.candidata(2, self.clientes[1], "A2"),
+        ]
+        with mock.patch("banco.importacion._codigos_existentes", return_value=set()):
+            with self.assertLogs("banco.importacion", "ERROR") as log:
+                guardadas, duplicadas, errores = guardar_lote(candidatas, obtener_tarifas(), set())
+        self.assertIn("3 movimientos", log.output[0])
+        self.assertEqual([i for i, _ in guardadas], [0, 2])
+        self.assertEqual(duplicadas, [])
+        self.assertEqual([i for i, _ in errores], [1])
+        self.assertEqual(set(BCP.objects.values_list("cod_bcp", flat=True)), {"T000000", "A1", "A2"})
+        # Solo las dos guardadas (crear_movimientos no pasa por el resumen)
+        self.assertEqual(ResumenDiario.objects.aggregate(Sum("cantidad"))["cantidad__sum"], 2)
+
+    def test_error_que_no_es_de_la_base_se_propaga(self):
+        with mock.patch.object(BCP.objects, "bulk_create", side_effect=ValueError("fallo")):
+            with self.assertRaises(ValueError):
+                guardar_lote([self.candidata(0, self.clientes[0])], obtener_tarifas(), set())
+        self.assertEqual(BCP.objects.count(), 0)
+
+    def test_filas_rechazadas_no_usan_codigo_ni_lo_marcan_como_visto(self):
+        vistos = set()
+        guardadas, duplicadas, errores = guardar_lote([
+            self.candidata(0, None, "X1"),
+            self.candidata(1, self.sin_tarifa),
+            self.candidata(2, self.clientes[0]),
+            # X1 no se guardó en la fila 0: no es un duplicado
+            self.candidata(3, self.clientes[1], "X1"),
+            self.candidata(4, self.clientes[1], "X1"),
+        ], obtener_tarifas(), vistos)
+        self.assertEqual([(i, b.cod_bcp) for i, b in guardadas], [(2, "BCP001"), (3, "X1")])
+        self.assertEqual(duplicadas, [4])
+        self.assertEqual(errores, [
+            (0, "la fila no tiene un cliente válido."), (1, "no existe la tarifa NOEXISTE."),
+        ])
+        self.assertEqual(vistos, {"BCP001", "X1"})
+
+        # El siguiente lote sigue la secuencia sin huecos
+        guardadas, _, _ = guardar_lote([self.candidata(0, self.clientes[0])], obtener_tarifas(), vistos)
+        self.assertEqual(guardadas[0][1].cod_bcp, "BCP002")
+
+
+class ListadoBCPTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+        crear_movimientos(cls.clientes, cls.tarifas, 60)
+        BCP.objects.filter(cod_bcp__in=["T000001", "T000002"]).update(fecha=None)
+
+    def listar(self, **parametros):
+        response = self.client.get(reverse("banco:listar_bcp"), parametros)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_recorre_todas_las_paginas_sin_repetir(self):
+        vistas = []
+        cursor = ""
+        while True:
+            pagina = self.listar(limite=7, campos="id,fecha", cursor=cursor)
+            vistas.extend(pagina["resultados"])
+            cursor = pagina["siguiente"]
+            if not cursor:
+                break
+        self.assertEqual(len(vistas), 60)
+        self.assertEqual(len({f["id"] for f in vistas}), 60)
+        # Más reciente primero; los que no tienen fecha al final
+        fechas = [f["fecha"] for f in vistas]
+        self.assertEqual(fechas[-2:], [None, None])
+        self.assertEqual(fechas[:-2], sorted(fechas[:-2], reverse=True))
+
+    def test_pagina_profunda_sin_offset(self):
+        pagina = self.listar(limite=10, cliente="CLI0001")
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as capturadas:
+                pagina = self.listar(limite=10, cliente="CLI0001", cursor=pagina["siguiente"])
+        self.assertEqual(len(capturadas), 1)
+        self.assertNotIn("OFFSET", capturadas[0]["sql"])
+        self.assertTrue(all(f["cod_cliente"] == "CLI0001" for f in pagina["resultados"]))
+
+    def test_proyeccion_de_campos(self):
+        pagina = self.listar(limite=3, tarifa="TARIFA02", campos="cod_bcp,monto")
+        self.assertEqual(list(pagina["resultados"][0]), ["cod_bcp", "monto"])
+        # El más reciente: día 28, el de id más alto (n = 55)
+        self.assertEqual(pagina["resultados"][0]["monto"], "55.00")
+
+    def test_con_usuario_dentro_del_presupuesto(self):
+        # Con BANCO_PRESUPUESTOS_ESTRICTOS pasarse del presupuesto es una excepción
+        self.client.force_login(User.objects.create_user("listado"))
+        response = self.client.get(reverse("banco:listar_bcp"), {"limite": 5})
+        self.assertEqual(response["X-Banco-Consultas"], "3")
+
+    def test_parametros_invalidos(self):
+        response = self.client.get(reverse("banco:listar_bcp"), {"campos": "monto,clave", "cursor": "xx"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()["errores"]), {"campos", "cursor"})
+
+
+@override_settings(BANCO_EXPORTACIONES_DIR=tempfile.mkdtemp(prefix="banco_test_"))
+class VistasAsyncTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+        crear_movimientos(cls.clientes, cls.tarifas, 50)
+
+    async def leer_async(self, response):
+        if not response.is_async:
+            return await sync_to_async(b"".join)(response.streaming_content)
+        return b"".join([parte async for parte in response.streaming_content])
+
+    async def test_exportaciones_async_iguales_a_las_sincronas(self):
+        for nombre in ("exportar_csv", "exportar_excel"):
+            response = await self.async_client.get(reverse(f"banco:{nombre}_async"), {"cliente": "CLI0001"})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            contenido = await self.leer_async(response)
+
+            # La síncrona sirve el archivo que guardó la async
+            sincrona = await self.async_client.get(reverse(f"banco:{nombre}"), {"cliente": "CLI0001"})
+            self.assertEqual(contenido, await self.leer_async(sincrona))
+        self.assertEqual(len(openpyxl.load_workbook(io.BytesIO(contenido)).active["A"]), 26)
+
+    async def test_exportacion_async_filtro_invalido(self):
+        response = await self.async_client.get(
+            reverse("banco:exportar_csv_async"), {"fecha_desde": "2025-02-01", "fecha_hasta": "2025-01-01"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(BANCO_TRABAJOS_SINCRONOS=True)
+    async def test_importar_async(self):
+        libro = openpyxl.Workbook()
+        libro.active.append(["Fecha", "Fecha valuta", "Descripción operación", "Monto"])
+        for n in range(5):
+            libro.active.append([date(2025, 1, 2), date(2025, 1, 2), f"PAGO {40000000 + n % 2}", 100 + n])
+        archivo = io.BytesIO()
+        libro.save(archivo)
+        archivo.seek(0)
+        archivo.name = "movimientos.xlsx"
+
+        response = await self.async_client.post(reverse("banco:importar_excel_async"), {"archivo": archivo})
+        self.assertEqual(response.status_code, 302)
+        trabajo_id = response.url.rstrip("/").split("/")[-1]
+        estado = (await self.async_client.get(reverse("banco:estado_trabajo_async", args=[trabajo_id]))).json()
+        self.assertEqual((estado["estado"], estado["filas_procesadas"]), ("terminado", 5))
+
+
+class TrabajosTests(TablasExternasMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # El pool corre el trabajo en el momento; el hilo no cierra la conexión del test
+        pool = mock.Mock()
+        pool.submit.side_effect = lambda funcion, *args: funcion(*args)
+        self.enterContext(mock.patch.object(trabajos, "_obtener_pool", return_value=pool))
+        self.enterContext(mock.patch.object(trabajos, "close_old_connections"))
+        self.conexion = self.enterContext(mock.patch.object(trabajos, "connection"))
+
+    def test_encolar_corre_el_trabajo_al_terminar_la_transaccion(self):
+        estados = []
+
+        def funcion(trabajo, valor):
+            estados.append((TrabajoImportacion.objects.get(pk=trabajo.pk).estado, valor))
+
+        trabajo = TrabajoImportacion.objects.create(tipo=TrabajoImportacion.PREVIEW)
+        with self.captureOnCommitCallbacks(execute=True):
+            trabajos.encolar(funcion, trabajo, 7)
+            self.assertEqual(estados, [])
+
+        self.assertEqual(estados, [(TrabajoImportacion.EN_PROCESO, 7)])
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, TrabajoImportacion.TERMINADO)
+        self.assertTrue(trabajo.inicio and trabajo.latido and trabajo.fin)
+        self.conexion.close.assert_called_once()
+
+    def test_trabajo_que_falla(self):
+        def funcion(trabajo):
+            trabajos._avanzar(trabajo, 10, errores=["Fila 3: sin cliente"])
+            raise ValueError("archivo dañado")
+
+        trabajo = TrabajoImportacion.objects.create(tipo=TrabajoImportacion.CONFIRMACION)
+        with self.captureOnCommitCallbacks(execute=True):
+            trabajos.encolar(funcion, trabajo)
+
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, TrabajoImportacion.FALLIDO)
+        self.assertEqual(trabajo.errores, ["Fila 3: sin cliente", "archivo dañado"])
+        self.assertEqual((trabajo.filas_procesadas, trabajo.filas_fallidas), (10, 1))
+        self.assertIsNotNone(trabajo.fin)
+        # La conexión del hilo se cierra aunque el trabajo falle
+        self.conexion.close.assert_called_once()
+
+    def test_trabajo_perdido_se_marca_fallido_al_consultarlo(self):
+        hace_rato = timezone.now() - timedelta(hours=1)
+        perdido = TrabajoImportacion.objects.create(
+            tipo=TrabajoImportacion.PREVIEW, estado=TrabajoImportacion.EN_PROCESO,
+            inicio=hace_rato, latido=hace_rato,
+        )
+        vivo = TrabajoImportacion.objects.create(
+            tipo=TrabajoImportacion.PREVIEW, estado=TrabajoImportacion.EN_PROCESO,
+            inicio=hace_rato, latido=timezone.now(),
+        )
+
+        estado = self.client.get(reverse("banco:estado_trabajo", args=[vivo.pk])).json()
+        self.assertEqual(estado["estado"], TrabajoImportacion.EN_PROCESO)
+
+        estado = self.client.get(reverse("banco:estado_trabajo", args=[perdido.pk])).json()
+        self.assertEqual(estado["estado"], TrabajoImportacion.FALLIDO)
+        self.assertEqual(estado["errores"], [trabajos.MENSAJE_PERDIDO])
+
+        # La página deja de consultar el estado y muestra el resultado
+        response = self.client.get(reverse("banco:ver_trabajo", args=[perdido.pk]))
+        self.assertTemplateUsed(response, "banco/result.html")
+
+    def test_trabajo_perdido_en_la_vista_async(self):
+        perdido = TrabajoImportacion.objects.create(
+            tipo=TrabajoImportacion.PREVIEW, estado=TrabajoImportacion.EN_PROCESO,
+            latido=timezone.now() - timedelta(hours=1),
+        )
+        response = async_to_sync(self.async_client.get)(reverse("banco:estado_trabajo_async", args=[perdido.pk]))
+        self.assertEqual(response.json()["estado"], TrabajoImportacion.FALLIDO)
+
+    @override_settings(BANCO_TRABAJOS_TIMEOUT=60)
+    def test_pendiente_perdido_no_se_corre(self):
+        funcion = mock.Mock()
+        trabajo = TrabajoImportacion.objects.create(tipo=TrabajoImportacion.PREVIEW)
+        reciente = TrabajoImportacion.objects.create(tipo=TrabajoImportacion.PREVIEW)
+        TrabajoImportacion.objects.filter(pk=trabajo.pk).update(creado=timezone.now() - timedelta(minutes=5))
+
+        self.assertEqual(trabajos.marcar_trabajos_perdidos(), 1)
+        trabajos._ejecutar(funcion, trabajo.pk)
+        funcion.assert_not_called()
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.inicio), (TrabajoImportacion.FALLIDO, None))
+        reciente.refresh_from_db()
+        self.assertEqual(reciente.estado, TrabajoImportacion.PENDIENTE)
+
+    @override_settings(BANCO_TRABAJOS_DIR=tempfile.mkdtemp(prefix="banco_test_"))
+    def test_archivo_de_trabajo_perdido_se_borra(self):
+        # Sin ejecutar el on_commit: el trabajo queda en la cola con el Excel en disco
+        trabajo = trabajos.iniciar_lectura(SimpleUploadedFile("movimientos.xlsx", b"contenido"))
+        self.assertTrue(os.path.exists(trabajo.archivo))
+        TrabajoImportacion.objects.filter(pk=trabajo.pk).update(creado=timezone.now() - timedelta(hours=1))
+        self.assertEqual(trabajos.marcar_trabajos_perdidos(), 1)
+        self.assertFalse(os.path.exists(trabajo.archivo))
+
+        # El pool lo toma después de que se dio por perdido: no lo lee pero borra el archivo
+        otro = trabajos.iniciar_lectura(SimpleUploadedFile("movimientos.xlsx", b"contenido"))
+        TrabajoImportacion.objects.filter(pk=otro.pk).update(estado=TrabajoImportacion.FALLIDO)
+        funcion = mock.Mock()
+        trabajos._ejecutar(funcion, otro.pk, otro.archivo)
+        funcion.assert_not_called()
+        self.assertFalse(os.path.exists(otro.archivo))
+
+
+@override_settings(BANCO_EXPORTACIONES_DIR=tempfile.mkdtemp(prefix="banco_test_"))
+class BenchmarkTests(TablasExternasMixin, TestCase):
+
+    def test_libro_sintetico(self):
+        dnis = ["40000000", "40000007"]
+        filas = list(openpyxl.load_workbook(generar_libro(200, dnis)).active.iter_rows(values_only=True))
+        self.assertEqual(len(filas), 201)
+        con_dni = [f for f in filas[1:] if f[2][-8:] in dnis]
+        self.assertGreater(len(con_dni), 150)
+        # Mismos datos con la misma semilla
+        self.assertEqual(filas, list(openpyxl.load_workbook(generar_libro(200, dnis)).active.iter_rows(values_only=True)))
+
+        # Los encabezados son los que reconoce la importación
+        lote = next(leer_lotes_excel(generar_libro(5, dnis)))
+        filas = preparar_lote(lote, ResolutorImportacion())
+        self.assertTrue(all(f.sucursal_agencia.startswith("AG ") for f in filas))
+        self.assertEqual([f.n_operacion for f in filas[:2]], ["00000001", "00000002"])
+        self.assertTrue(all(f.fecha and f.fecha_valuta and f.descripcion and f.usuario for f in filas))
+
+    def test_medir_pipeline(self):
+        dnis = sembrar_datos(30)
+        resultados = medir_pipeline(80, dnis, memoria=False)
+        self.assertEqual(
+            [r["etapa"] for r in resultados],
+            ["importar_excel", "confirmar_import", "exportar_excel", "exportar_excel (archivo guardado)"],
+        )
+        self.assertEqual(resultados[2]["filas"], BCP.objects.count())
+        self.assertTrue(all(r["consultas"] > 0 and r["filas_por_segundo"] for r in resultados))
+
+
+@override_settings(BANCO_EXPORTACIONES_DIR=tempfile.mkdtemp(prefix="banco_test_"))
+class InstrumentacionTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+        crear_movimientos(cls.clientes, cls.tarifas, 30)
+
+    def setUp(self):
+        super().setUp()
+        registro.limpiar()
+
+    def test_headers_con_consultas_y_tiempos(self):
+        response = self.client.get(reverse("banco:resumen_diario"))
+        self.assertEqual(response["X-Banco-Consultas"], "2")
+        self.assertEqual(response.medicion_banco.nombre, "banco:resumen_diario")
+        self.assertIn("db;dur=", response["Server-Timing"])
+
+    def test_etapas_de_la_ingesta(self):
+        movimientos = [{"fecha": "2025-01-02", "descripcion": "PAGO 40000000", "monto": "10"}]
+        self.client.force_login(User.objects.create_user("sistema"))
+        response = self.client.post(
+            reverse("banco:ingerir_movimientos"), json.dumps(movimientos), content_type="application/json"
+        )
+        for nombre in ("resolucion", "calculo", "guardado"):
+            self.assertIn(f"{nombre};dur=", response["Server-Timing"])
+
+    def test_presupuesto_excedido(self):
+        original = views.resumen_diario.presupuesto_banco
+        views.resumen_diario.presupuesto_banco = Presupuesto(consultas=1)
+        try:
+            with self.assertRaises(PresupuestoExcedido):
+                self.client.get(reverse("banco:resumen_diario"))
+            with self.settings(BANCO_PRESUPUESTOS_ESTRICTOS=False):
+                with self.assertLogs("banco.instrumentacion", "WARNING") as logs:
+                    response = self.client.get(reverse("banco:resumen_diario"))
+            self.assertIn("2 consultas (máximo 1)", response["X-Banco-Presupuesto"])
+            self.assertIn("2 consultas (máximo 1)", logs.output[0])
+        finally:
+            views.resumen_diario.presupuesto_banco = original
+
+    def test_streaming_se_mide_hasta_el_final(self):
+        response = self.client.get(reverse("banco:exportar_csv"))
+        antes_de_enviar = int(response["X-Banco-Consultas"])
+        b"".join(response.streaming_content)
+        # Las filas se leen mientras se envía el contenido
+        self.assertGreater(registro.resumen()["banco:exportar_csv"]["consultas_max"], antes_de_enviar)
+
+    def test_streaming_excedido_no_corta_el_envio(self):
+        original = views.exportar_csv.presupuesto_banco
+        views.exportar_csv.presupuesto_banco = Presupuesto(consultas=1)
+        try:
+            response = self.client.get(reverse("banco:exportar_csv"))
+            with self.assertLogs("banco.instrumentacion", "WARNING") as logs:
+                self.assertEqual(len(leer_csv(response)), 31)
+        finally:
+            views.exportar_csv.presupuesto_banco = original
+        self.assertIn("banco:exportar_csv pasó su presupuesto", logs.output[0])
+        self.assertEqual(registro.resumen()["banco:exportar_csv"]["presupuesto_excedido"], 1)
+
+    def test_medicion_compartida_entre_hilos(self):
+        medicion = Medicion("hilos")
+
+        def sumar(_):
+            for _ in range(2000):
+                medicion.sumar_consulta(0.001)
+                medicion.sumar_etapa("calculo", 0.001)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(sumar, range(8)))
+        self.assertEqual(medicion.consultas, 16000)
+        self.assertAlmostEqual(medicion.segundos_db, 16.0)
+        self.assertAlmostEqual(medicion.etapas["calculo"], 16.0)
+
+    async def test_vista_async_cuenta_consultas_de_sync_to_async(self):
+        response = await self.async_client.get(reverse("banco:exportar_csv_async"))
+        self.assertGreater(int(response["X-Banco-Consultas"]), 0)
+
+    def test_endpoint_metricas(self):
+        self.client.get(reverse("banco:resumen_diario"))
+        self.client.get(reverse("banco:listar_bcp"), {"limite": 5})
+        metricas = self.client.get(reverse("banco:metricas")).json()["vistas"]
+        self.assertEqual(metricas["banco:resumen_diario"]["peticiones"], 1)
+        self.assertEqual(metricas["banco:listar_bcp"]["consultas_max"], 1)
+
+        response = self.client.get(reverse("banco:metricas"), REMOTE_ADDR="10.1.2.3")
+        self.assertEqual(response.status_code, 404)
+
+
+class AdminTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+        cls.usuario = User.objects.create_superuser("admin", "admin@example.com", "clave")
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+
+    def test_changelist_cantidad_fija_de_consultas(self):
+        consultas = []
+        for cantidad in (10, 90):
+            crear_movimientos(self.clientes, self.tarifas, cantidad, inicio=len(consultas) * 10)
+            with CaptureQueriesContext(connection) as capturadas:
+                response = self.client.get(reverse("admin:banco_bcp_changelist"))
+            self.assertEqual(response.status_code, 200)
+            consultas.append(len(capturadas))
+        self.assertEqual(consultas[0], consultas[1])
+
+    def test_busqueda_por_prefijo(self):
+        crear_movimientos(self.clientes, self.tarifas, 30)
+        response = self.client.get(reverse("admin:banco_bcp_changelist"), {"q": "40000001"})
+        self.assertEqual(response.context["cl"].result_count, 15)
+        # Solo prefijos: un pedazo del medio del código no encuentra nada
+        response = self.client.get(reverse("admin:banco_bcp_changelist"), {"q": "00001"})
+        self.assertEqual(response.context["cl"].result_count, 0)
+
+    def test_conteo_estimado_sin_filtros(self):
+        crear_movimientos(self.clientes, self.tarifas, 5)
+        with mock.patch.object(banco_admin, "conteo_estimado", return_value=2500000):
+            response = self.client.get(reverse("admin:banco_bcp_changelist"))
+            self.assertEqual(response.context["cl"].result_count, 2500000)
+            # Con búsqueda se cuenta de verdad
+            response = self.client.get(reverse("admin:banco_bcp_changelist"), {"q": "T00000"})
+            self.assertEqual(response.context["cl"].result_count, 5)
+
+    def test_accion_recalcular_comisiones(self):
+        crear_movimientos(self.clientes, self.tarifas, 40)
+        reconstruir_resumenes()
+        ExportacionGuardada.objects.create(
+            clave="x", formato="csv", archivo="x.csv", ultimo_id=1, total_filas=1
+        )
+        ids = list(BCP.objects.order_by("id").values_list("id", flat=True))
+        with CaptureQueriesContext(connection) as capturadas:
+            self.client.post(reverse("admin:banco_bcp_changelist"), {
+                "action": "recalcular_comisiones", "_selected_action": ids,
+            })
+        # En lotes: no depende de la cantidad de movimientos seleccionados
+        self.assertLess(len(capturadas), 30)
+
+        for b in BCP.objects.select_related("cliente"):
+            esperado = BCP(monto=b.monto, cliente=b.cliente)
+            esperado.saldo_inicial = b.saldo - b.monto
+            esperado.calcular_datos()
+            self.assertEqual(
+                (b.comision, b.lm_pagar, b.ganancia_referido),
+                (esperado.comision.quantize(Decimal("0.01")), esperado.lm_pagar.quantize(Decimal("0.01")),
+                 esperado.ganancia_referido),
+            )
+        self.assertTrue(BCP.objects.filter(comision__gt=0).exists())
+
+        resumen = ResumenDiario.objects.aggregate(**{c: Sum(c) for c in CAMPOS_SUMADOS})
+        self.assertEqual(resumen, BCP.objects.aggregate(**{c: Sum(c) for c in CAMPOS_SUMADOS}))
+        self.assertIsNone(ExportacionGuardada.objects.get(clave="x").ultimo_id)
+
+    def test_recalcular_en_lotes_chicos(self):
+        crear_movimientos(self.clientes, self.tarifas, 25)
+        actualizados, sin_tarifa = recalcular_movimientos(BCP.objects.all(), tamano_lote=7)
+        self.assertEqual((actualizados, sin_tarifa), (25, 0))
+        # Una segunda vez no hay nada que cambiar
+        self.assertEqual(recalcular_movimientos(BCP.objects.all(), tamano_lote=7), (0, 0))
+
+
+class AutocompletarClientesTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+        Cliente.objects.bulk_create([
+            Cliente(
+                id=n + 10, cod_cliente=f"ZZ{n:04d}", dni=f"{50000000 + n}",
+                nombre="Ana" if n % 2 else "Luis", apellidos=f"Quispe {n}", cod_tarifa=f"TX{n}",
+            )
+            for n in range(60)
+        ])
+
+    def buscar(self, q, **params):
+        return self.client.get(reverse("banco:autocompletar_clientes"), {"q": q, **params}).json()["results"]
+
+    def test_prefijo_de_codigo_dni_y_nombre(self):
+        self.assertEqual([c["id"] for c in self.buscar("CLI")], ["CLI0000", "CLI0001"])
+        self.assertEqual([c["id"] for c in self.buscar("40000001")], ["CLI0001"])
+        self.assertEqual(self.buscar("5000001")[0]["cod_cliente"], "ZZ0010")
+        self.assertEqual({c["nombre"] for c in self.buscar("ana")}, {"Ana"})
+        self.assertEqual(
+            [c["id"] for c in self.buscar("Luis Quispe 4")],
+            ["ZZ0004", "ZZ0040", "ZZ0042", "ZZ0044", "ZZ0046", "ZZ0048"],
+        )
+        self.assertIn("DNI 40000000", self.buscar("CLI0000")[0]["text"])
+        # Solo prefijos
+        self.assertEqual(self.buscar("uispe"), [])
+        self.assertEqual(self.buscar("  "), [])
+
+    def test_resultados_acotados(self):
+        self.assertEqual(len(self.buscar("ZZ")), 20)
+        self.assertEqual(len(self.buscar("ZZ", limite=500)), 50)
+        with self.assertNumQueries(3):
+            self.buscar("Quispe")
+
+    def test_formulario_no_carga_todos_los_clientes(self):
+        with self.assertNumQueries(0):
+            html = str(UploadExcelForm()["cliente"])
+        self.assertIn('data-autocompletar="/', html)
+        self.assertNotIn("CLI0000", html)
+
+        # Con un cliente elegido solo se trae esa opción
+        form = UploadExcelForm({"cliente": "CLI0001"})
+        form.is_valid()
+        with self.assertNumQueries(1):
+            html = str(form["cliente"])
+        self.assertIn('value="CLI0001" selected', html)
+        self.assertNotIn("CLI0000", html)
+        self.assertEqual(form.cleaned_data["cliente"], self.clientes[1])
+
+
+class CoincidenciasClientesTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+        TarifaOperacion.objects.create(
+            cod_tarifa="TARIFA03", descripcion="Tarifa 3",
+            costo_por_porcentaje=Decimal("0.0100"), costo_fijo=Decimal("5.00"),
+        )
+        cls.clientes.append(Cliente.objects.create(
+            id=3, cod_cliente="ZZ0003", dni="41234567", nombre="José Luis", apellidos="Quispe Mamani",
+            cod_tarifa="TARIFA03",
+        ))
+
+    def test_tipos_de_coincidencia(self):
+        indice = IndiceClientes([
+            (1, "40000000", "CLI0000", "Ana", "Pérez"),
+            (2, "40000001", "CLI0001", "Ana", "Pérez"),
+            (3, "41234567", "ZZ0003", "José Luis", "Quispe Mamani"),
+        ])
+        coincidencias = indice.coincidencias([
+            "TRANSF 40000001",
+            "DEP 41234567 VENTANILLA",
+            "ABONO CLI-0001",
+            "PAGO JOSE LUIS QUISPE MAMANI",
+            "PAGO QUISPE MAMANI, JOSÉ LUIS",
+            "CTA 1240000001",
+            "PAGO ANA PEREZ",
+            "COMISION MANTENIMIENTO",
+        ])
+        self.assertEqual(
+            [(c.cliente_id, c.tipo, c.confianza) if c else None for c in coincidencias],
+            [
+                (2, "dni", 1.0),
+                (3, "dni", 0.9),
+                (2, "cod_cliente", 0.95),
+                (3, "nombre", 0.85),
+                (3, "apellidos_nombre", 0.8),
+                (2, "dni_parcial", 0.7),
+                # Homónimos: no alcanza la confianza mínima
+                (1, "nombre", 0.212),
+                None,
+            ],
+        )
+        # DNI y nombre del mismo cliente se refuerzan
+        self.assertGreater(indice.coincidencia("JOSE LUIS QUISPE MAMANI 41234567").confianza, 0.99)
+
+    def test_cambios_incrementales(self):
+        indice = IndiceClientes([(1, "40000000", "CLI0000", "Ana", "Pérez")])
+        self.assertEqual(indice.coincidencia("PAGO 40000000").cliente_id, 1)
+
+        indice.agregar(5, "45555555", "NUEVO01", "Rosa", "Flores")
+        indice.agregar(1, "40000009", "CLI0000", "Ana", "Pérez")
+        self.assertEqual(indice.coincidencia("PAGO ROSA FLORES").cliente_id, 5)
+        self.assertEqual(indice.coincidencia("PAGO 40000009").cliente_id, 1)
+        self.assertIsNone(indice.coincidencia("PAGO 40000000"))
+
+        indice.quitar(5)
+        self.assertIsNone(indice.coincidencia("PAGO ROSA FLORES"))
+        self.assertEqual(len(indice), 1)
+
+    def test_preparar_lote_identifica_el_cliente(self):
+        lote = [
+            {"DESCRIPCIÓN_OPERACIÓN": "DEP JOSE LUIS QUISPE MAMANI", "MONTO": "100"},
+            {"DESCRIPCIÓN_OPERACIÓN": "TRANSF 40000001 AGENCIA", "MONTO": "100"},
+            {"DESCRIPCIÓN_OPERACIÓN": "PAGO 49999999", "MONTO": "100"},
+        ]
+        resolutor = ResolutorImportacion()
+        # Índice de clientes, los clientes encontrados, el DNI que el índice no
+        # conoce (49999999) y las reglas de referido
+        with self.assertNumQueries(4):
+            rows = preparar_lote(lote, resolutor, cliente_default=self.clientes[0])
+        self.assertEqual([r.cliente.cod_cliente for r in rows], ["ZZ0003", "CLI0001", "CLI0000"])
+        self.assertEqual([r.dni for r in rows], ["41234567", "40000001", "49999999"])
+
+        # El índice se arma una vez por proceso y cada cliente se lee una vez
+        with self.assertNumQueries(0):
+            preparar_lote(lote, resolutor)
+
+    def test_cliente_nuevo_fuera_del_indice(self):
+        obtener_indice_clientes()
+        # Alta sin señales (como las que se hacen fuera de Django): el índice no la ve
+        Cliente.objects.bulk_create([
+            Cliente(id=50, cod_cliente="NUEVO", dni="45555555", nombre="Ana", apellidos="Nueva"),
+        ])
+        self.assertIsNone(obtener_indice_clientes().coincidencia("PAGO 45555555"))
+
+        rows = preparar_lote(
+            [{"DESCRIPCIÓN_OPERACIÓN": "PAGO 45555555", "MONTO": "100"}], ResolutorImportacion()
+        )
+        self.assertEqual((rows[0].cliente.cod_cliente, rows[0].dni), ("NUEVO", "45555555"))
+
+    def test_cambio_de_cliente_actualiza_el_indice(self):
+        self.assertEqual(obtener_indice_clientes().coincidencia("PAGO ROSA FLORES"), None)
+        with self.captureOnCommitCallbacks(execute=True):
+            cliente = Cliente.objects.get(id=3)
+            cliente.nombre, cliente.apellidos = "Rosa", "Flores"
+            cliente.save()
+        self.assertEqual(obtener_indice_clientes().coincidencia("PAGO ROSA FLORES").cliente_id, 3)
+        self.assertIsNone(obtener_indice_clientes().coincidencia("PAGO JOSE LUIS QUISPE MAMANI"))
+
+        # Movimientos de la API sin cliente ni DNI
+        resultados, _ = ingerir_movimientos([
+            {"descripcion": "ABONO ROSA FLORES", "monto": "10", "fecha": "2025-01-02"},
+        ])
+        self.assertEqual(resultados[0]["cliente"], "ZZ0003")
+
+
+class CacheTarifasTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+
+    def test_calculo_sin_consultas(self):
+        obtener_tarifas()
+        obtener_reglas()
+        bcp = BCP(monto=Decimal("2000.00"))
+        with self.assertNumQueries(0):
+            bcp.calcular_datos()
+            self.assertIs(obtener_tarifas(), obtener_tarifas())
+        # Sin cliente se usa TARIFA01
+        self.assertEqual(bcp.comision, Decimal("20.0000"))
+
+    def test_se_invalida_al_confirmar_la_transaccion(self):
+        self.assertEqual(obtener_tarifas()["TARIFA01"].costo_fijo, Decimal("5.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            TarifaOperacion.objects.filter(pk="TARIFA01").update(costo_fijo=Decimal("6.00"))
+            tarifa = TarifaOperacion.objects.get(pk="TARIFA01")
+            tarifa.save()
+            # Hasta el commit se siguen viendo los datos anteriores
+            with self.assertNumQueries(0):
+                self.assertEqual(obtener_tarifas()["TARIFA01"].costo_fijo, Decimal("5.00"))
+        self.assertEqual(obtener_tarifas()["TARIFA01"].costo_fijo, Decimal("6.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TarifaOperacion.objects.get(pk="TARIFA02").delete()
+        self.assertEqual(set(obtener_tarifas()), {"TARIFA01"})
+
+    def test_version_compartida_entre_workers(self):
+        cargas = []
+
+        def cargar():
+            cargas.append(1)
+            return len(cargas)
+
+        # Dos procesos con el mismo catálogo, que comparten la versión por el cache de Django
+        clave = "banco:tests:version"
+        uno, otro = CatalogoEnCache(clave, cargar), CatalogoEnCache(clave, cargar)
+        self.assertEqual((uno.obtener(), otro.obtener(), uno.obtener()), (1, 2, 1))
+        otro.invalidar()
+        self.assertEqual((uno.obtener(), otro.obtener(), uno.obtener()), (3, 4, 3))
+
+        with override_settings(BANCO_TARIFAS_TTL=0):
+            self.assertEqual((uno.obtener(), uno.obtener()), (5, 6))
+
+
+class ReglasReferidoTests(TablasExternasMixin, TestCase):
+
+    def test_regla_migrada(self):
+        reglas = obtener_reglas()
+        self.assertEqual(list(reglas.posiciones), [6])
+        casos = [
+            ("1500.00", "6", "1.50"),
+            ("1500.01", "6", "1.50001"),
+            ("20000.00", "06", "20.000"),
+            ("20000.00", " 6 ", "20.000"),
+            ("20000.00", "6.0", "0.00"),
+            ("20000.00", "7", "0.00"),
+            ("20000.00", "abc", "0.00"),
+            ("20000.00", None, "0.00"),
+            ("20000.00", "", "0.00"),
+        ]
+        for monto, codigo, esperado in casos:
+            with self.subTest(monto=monto, codigo=codigo):
+                self.assertEqual(reglas.ganancia(Decimal(monto), codigo), Decimal(esperado))
+        # Cada valor de CODIGO_REFERIDO se interpreta una sola vez
+        self.assertEqual(reglas._por_valor["06"], reglas.posiciones[6])
+        self.assertEqual(reglas._por_valor["abc"], reglas.sin_regla)
+
+    def test_reglas_nuevas_e_inactivas(self):
+        clientes, _ = crear_datos_base()
+        Cliente.objects.filter(pk=clientes[0].pk).update(codigo_referido="7")
+        bcp = BCP(monto=Decimal("100.00"), cliente=Cliente.objects.get(pk=clientes[0].pk))
+        bcp.calcular_datos()
+        self.assertEqual(bcp.ganancia_referido, Decimal("0.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ReglaReferido.objects.create(
+                codigo_referido=7, umbral=Decimal("50.00"), porcentaje=Decimal("0.0200"), fijo=Decimal("3.00"),
+            )
+            ReglaReferido.objects.filter(codigo_referido=6).update(activo=False)
+            ReglaReferido.objects.get(codigo_referido=6).save()
+        reglas = obtener_reglas()
+        self.assertEqual(list(reglas.posiciones), [7])
+        self.assertEqual(reglas.ganancia(Decimal("2000.00"), "6"), Decimal("0.00"))
+
+        bcp.calcular_datos()
+        self.assertEqual(bcp.ganancia_referido, Decimal("2.0000"))
+        # El cálculo por lote usa la misma tabla
+        df = pd.DataFrame({
+            "monto": [Decimal("100.00"), Decimal("40.00")], "saldo_inicial": [Decimal("0.00")] * 2,
+            "cod_tarifa": [None] * 2, "codigo_referido": ["7", "7"],
+        })
+        # En céntimos
+        self.assertEqual(list(calcular_datos_lote(df, {}, reglas)["ganancia_referido"]), [200, 300])
+
+
+class StagingTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+
+    def test_guardar_y_recorrer_por_indice(self):
+        lote = [{"DESCRIPCIÓN_OPERACIÓN": f"PAGO {40000000 + n % 2}", "MONTO": str(100 + n)} for n in range(7)]
+        importacion = crear_importacion(self.tarifas[1])
+        guardar_filas(importacion, preparar_lote(lote, ResolutorImportacion()))
+        # Filas de otra importación que no se tienen que mezclar
+        otra = crear_importacion()
+        guardar_filas(otra, preparar_lote(lote[:3], ResolutorImportacion()))
+        self.assertEqual(importacion.cod_tarifa_default, "TARIFA02")
+
+        with CaptureQueriesContext(connection) as consultas:
+            bloques = list(iterar_filas(importacion, tamano=3))
+        self.assertEqual([[f.indice for f in b] for b in bloques], [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(bloques[2][0].monto, Decimal("106.00"))
+        self.assertEqual((bloques[0][1].cod_cliente, bloques[0][1].dni), ("CLI0001", "40000001"))
+        # Un bloque por consulta, más la que confirma que no quedan filas; sin OFFSET
+        self.assertEqual(len(consultas), 4)
+        self.assertFalse(any("OFFSET" in c["sql"].upper() for c in consultas.captured_queries))
+
+    def test_recorrer_con_indices_salteados(self):
+        importacion = crear_importacion()
+        FilaImportacion.objects.bulk_create([
+            FilaImportacion(importacion=importacion, indice=n, descripcion=f"PAGO {n}", monto=Decimal(n))
+            for n in (9, 0, 4, 5, 20)
+        ])
+        bloques = list(iterar_filas(importacion, tamano=2))
+        self.assertEqual([[f.indice for f in b] for b in bloques], [[0, 4], [5, 9], [20]])
+        self.assertEqual(list(iterar_filas(crear_importacion())), [])
+
+    def test_importaciones_caducadas_y_tokens(self):
+        vieja = crear_importacion()
+        ImportacionTemporal.objects.filter(pk=vieja.pk).update(creado=timezone.now() - timedelta(days=2))
+        nueva = crear_importacion()
+        self.assertFalse(ImportacionTemporal.objects.filter(pk=vieja.pk).exists())
+
+        self.assertEqual(obtener_importacion(str(nueva.token)), nueva)
+        for token in (None, "", "no-es-un-uuid", str(vieja.token)):
+            with self.subTest(token=token):
+                self.assertIsNone(obtener_importacion(token))
+
+
+class PreviewTests(TablasExternasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes, cls.tarifas = crear_datos_base()
+
+    def test_filas_comparten_cliente_y_tarifa(self):
+        lote = [{"DESCRIPCIÓN_OPERACIÓN": f"PAGO {40000000 + n % 2}", "MONTO": "100"} for n in range(6)]
+        filas = preparar_lote(lote, ResolutorImportacion())
+        self.assertIs(filas[0].cliente, filas[2].cliente)
+        self.assertIs(filas[1].tarifa, filas[5].tarifa)
+        self.assertFalse(hasattr(filas[0], "__dict__"))
+
+        importacion = crear_importacion(self.tarifas[0])
+        guardar_filas(importacion, filas)
+        importacion.total_filas = len(filas)
+        importacion.save()
+        fila = importacion.filas.get(indice=1)
+        self.assertEqual((fila.cod_cliente, fila.cod_tarifa, fila.dni), ("CLI0001", "TARIFA02", "40000001"))
+
+        datos = self.client.get(
+            reverse("banco:preview_filas", args=[importacion.token]), {"offset": 0, "limit": 4}
+        ).json()
+        self.assertEqual([f["cliente"] for f in datos["filas"]], ["CLI0000", "CLI0001"] * 2)
+        self.assertEqual(datos["filas"][1]["saldo"], "100.00")
+        self.assertNotIn("correo", datos["filas"][0])
+        # Los datos de cada cliente y tarifa van una vez
+        self.assertEqual(set(datos["clientes"]), {"CLI0000", "CLI0001"})
+        self.assertEqual(datos["clientes"]["CLI0001"]["nombre"], "Cliente 1")
+        self.assertEqual(datos["tarifas"]["TARIFA02"], {"costo_por_porcentaje": "0.0125", "costo_fijo": "7.50"})
+
+    def test_paginas_de_la_preview(self):
+        importacion = crear_importacion(self.tarifas[0])
+        FilaImportacion.objects.bulk_create([
+            FilaImportacion(
+                importacion=importacion, indice=n, descripcion=f"PAGO {n:04d}", monto=Decimal(n),
+                cod_cliente=self.clientes[n % 2].cod_cliente,
+            )
+            for n in range(MAX_PAGINA_PREVIEW + 50)
+        ])
+        importacion.total_filas = MAX_PAGINA_PREVIEW + 50
+        importacion.save()
+        url = reverse("banco:preview_filas", args=[importacion.token])
+
+        def indices(datos):
+            return [f["indice"] for f in datos["filas"]]
+
+        datos = self.client.get(url, {"offset": 10, "limit": 5}).json()
+        self.assertEqual((datos["total"], datos["offset"], datos["limit"]), (MAX_PAGINA_PREVIEW + 50, 10, 5))
+        self.assertEqual(indices(datos), list(range(10, 15)))
+
+        datos = self.client.get(url, {"page": 3, "limit": 5}).json()
+        self.assertEqual((datos["offset"], indices(datos)), (10, list(range(10, 15))))
+
+        # Sin parámetros, o con valores inválidos, primera página del tamaño por defecto
+        for parametros in ({}, {"offset": "x", "limit": "0"}, {"page": "0"}, {"offset": "-5"}):
+            with self.subTest(parametros=parametros):
+                datos = self.client.get(url, parametros).json()
+                self.assertEqual(indices(datos), list(range(TAMANO_PAGINA_PREVIEW)))
+
+        # El límite se recorta y la última página trae solo lo que queda
+        datos = self.client.get(url, {"limit": 10 ** 6}).json()
+        self.assertEqual(len(datos["filas"]), MAX_PAGINA_PREVIEW)
+        datos = self.client.get(url, {"offset": MAX_PAGINA_PREVIEW + 40, "limit": 50}).json()
+        self.assertEqual(indices(datos), list(range(MAX_PAGINA_PREVIEW + 40, MAX_PAGINA_PREVIEW + 50)))
+        datos = self.client.get(url, {"offset": 10 ** 6}).json()
+        self.assertEqual((datos["filas"], datos["clientes"]), ([], {}))
+
+        # La página solo lleva el token y el total, no las filas
+        response = self.client.get(reverse("banco:ver_preview", args=[importacion.token]))
+        self.assertEqual(response.context["total"], MAX_PAGINA_PREVIEW + 50)
+        self.assertNotContains(response, "PAGO 0001")
+
+    def test_preview_de_importacion_inexistente(self):
+        token = "00000000-0000-0000-0000-000000000000"
+        response = self.client.get(reverse("banco:preview_filas", args=[token]))
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("error", response.json())
+        response = self.client.get(reverse("banco:ver_preview", args=[token]))
+        self.assertRedirects(response, reverse("banco:importar_excel"), fetch_redirect_response=False)
@@ -0,0 +1,270 @@
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .importacion import ResolutorImportacion, leer_lotes_excel, preparar_lote, confirmar_filas
+from .instrumentacion import etapa, iterar_en_etapa, medir
+from .models import Cliente, TrabajoImportacion
+from .staging import crear_importacion, guardar_filas
+from .tarifas import obtener_tarifa
+
+
+# Cantidad de errores que se guardan en el trabajo (el resto solo se cuenta)
+MAX_ERRORES_GUARDADOS = 500
+
+ACTIVOS = (TrabajoImportacion.PENDIENTE, TrabajoImportacion.EN_PROCESO)
+MENSAJE_PERDIDO = "El trabajo se interrumpió (reinicio del servidor o caída del proceso). Vuelva a intentarlo."
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _obtener_pool():
+    # El pool se crea la primera vez que se usa, uno por proceso
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Al arrancar el proceso se cierran los trabajos que quedaron perdidos
+            # por un reinicio anterior
+            marcar_trabajos_perdidos()
+            _pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, "BANCO_TRABAJOS_WORKERS", 2),
+                thread_name_prefix="banco-trabajo",
+            )
+    return _pool
+
+
+def _correr(funcion, trabajo_id, *args):
+    """
+    Corre un trabajo marcando su estado, inicio y fin. Si mientras esperaba en
+    la cola ya se lo dio por perdido, no se corre.
+    """
+    ahora = timezone.now()
+    arrancado = TrabajoImportacion.objects.filter(
+        pk=trabajo_id, estado=TrabajoImportacion.PENDIENTE
+    ).update(estado=TrabajoImportacion.EN_PROCESO, inicio=ahora, latido=ahora)
+    if not arrancado:
+        # Ya se dio por perdido: nadie va a leer su archivo
+        ruta = TrabajoImportacion.objects.filter(pk=trabajo_id).values_list("archivo", flat=True).first()
+        _borrar_archivo(ruta)
+        return
+    trabajo = TrabajoImportacion.objects.get(pk=trabajo_id)
+    cambios = {"estado": TrabajoImportacion.TERMINADO}
+    try:
+        # Cada trabajo aparece en /metricas/ como trabajo_preview o trabajo_confirmacion
+        with medir(f"trabajo_{trabajo.tipo}"):
+            funcion(trabajo, *args)
+    except Exception as e:
+        errores = TrabajoImportacion.objects.get(pk=trabajo_id).errores
+        cambios = {"estado": TrabajoImportacion.FALLIDO, "errores": errores + [str(e)]}
+    TrabajoImportacion.objects.filter(pk=trabajo_id).update(fin=timezone.now(), **cambios)
+
+
+def _ejecutar(funcion, trabajo_id, *args):
+    # Se ejecuta en un hilo del pool, que usa su propia conexión a la base de datos
+    close_old_connections()
+    try:
+        _correr(funcion, trabajo_id, *args)
+    finally:
+        connection.close()
+
+
+def encolar(funcion, trabajo, *args):
+    """
+    Manda el trabajo al pool cuando la transacción actual termine (así el
+    hilo ya ve el registro del trabajo). Con BANCO_TRABAJOS_SINCRONOS = True
+    se ejecuta en el momento, útil en tests.
+    """
+    if getattr(settings, "BANCO_TRABAJOS_SINCRONOS", False):
+        _correr(funcion, trabajo.pk, *args)
+        return
+    transaction.on_commit(lambda: _obtener_pool().submit(_ejecutar, funcion, trabajo.pk, *args))
+
+
+def _avanzar(trabajo, procesadas, guardadas=0, errores=()):
+    """
+    Suma el progreso de un bloque al trabajo con un solo UPDATE, que también
+    sirve de latido.
+    """
+    cambios = {
+        "latido": timezone.now(),
+        "filas_procesadas": F("filas_procesadas") + procesadas,
+        "filas_guardadas": F("filas_guardadas") + guardadas,
+        "filas_fallidas": F("filas_fallidas") + len(errores),
+    }
+    if errores and len(trabajo.errores) < MAX_ERRORES_GUARDADOS:
+        trabajo.errores = (trabajo.errores + list(errores))[:MAX_ERRORES_GUARDADOS]
+        cambios["errores"] = trabajo.errores
+    TrabajoImportacion.objects.filter(pk=trabajo.pk).update(**cambios)
+
+
+def _limite_latido():
+    return timezone.now() - timedelta(seconds=getattr(settings, "BANCO_TRABAJOS_TIMEOUT", 600))
+
+
+def _marcar_perdido(trabajo):
+    # El filtro por latido evita pisar un trabajo que volvió a dar señales
+    cambios = {
+        "estado": TrabajoImportacion.FALLIDO,
+        "fin": timezone.now(),
+        "errores": trabajo.errores + [MENSAJE_PERDIDO],
+    }
+    perdido = TrabajoImportacion.objects.filter(
+        pk=trabajo.pk, estado=trabajo.estado, latido=trabajo.latido
+    ).update(**cambios)
+    if perdido:
+        for campo, valor in cambios.items():
+            setattr(trabajo, campo, valor)
+        _borrar_archivo(trabajo.archivo)
+    return trabajo
+
+
+def revisar_trabajo(trabajo):
+    """
+    Marca como fallido el trabajo si sigue pendiente o en proceso pero hace
+    más de BANCO_TRABAJOS_TIMEOUT segundos que no da señales (se perdió con
+    un reinicio o una caída del hilo). Devuelve el trabajo actualizado.
+    """
+    if trabajo.estado in ACTIVOS and (trabajo.latido or trabajo.creado) < _limite_latido():
+        _marcar_perdido(trabajo)
+    return trabajo
+
+
+def marcar_trabajos_perdidos():
+    """
+    Marca como fallidos todos los trabajos perdidos. Devuelve cuántos marcó.
+    """
+    perdidos = TrabajoImportacion.objects.annotate(
+        ultima_senal=Coalesce("latido", "creado")
+    ).filter(estado__in=ACTIVOS, ultima_senal__lt=_limite_latido())
+    return sum(1 for trabajo in perdidos if _marcar_perdido(trabajo).estado == TrabajoImportacion.FALLIDO)
+
+
+def _borrar_archivo(ruta):
+    if not ruta:
+        return
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+def guardar_archivo_temporal(archivo):
+    """
+    Copia el archivo subido a disco para que el trabajo lo lea después de la petición.
+    """
+    directorio = getattr(settings, "BANCO_TRABAJOS_DIR", None)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx", dir=directorio) as destino:
+        for chunk in archivo.chunks():
+            destino.write(chunk)
+    return destino.name
+
+
+# --- Trabajos ---
+
+def _leer_excel(trabajo, ruta, cliente_id, cod_tarifa_default, saldo_inicial_default):
+    """
+    Lee el Excel por lotes, resuelve, calcula y guarda las filas en la importación temporal.
+    """
+    try:
+        cliente_default = Cliente.objects.filter(pk=cliente_id).first() if cliente_id else None
+        tarifa_default = obtener_tarifa(cod_tarifa_default)
+
+        importacion = crear_importacion(tarifa_default)
+        TrabajoImportacion.objects.filter(pk=trabajo.pk).update(
+            importacion=importacion, token=importacion.token
+        )
+
+        resolutor = ResolutorImportacion()
+        total = 0
+        for lote in iterar_en_etapa("lectura", leer_lotes_excel(ruta)):
+            filas = preparar_lote(
+                lote,
+                resolutor,
+                inicio=total,
+                cliente_default=cliente_default,
+                tarifa_default=tarifa_default,
+                saldo_inicial_default=saldo_inicial_default,
+            )
+            with etapa("guardado"):
+                guardar_filas(importacion, filas)
+            total += len(filas)
+            _avanzar(trabajo, len(filas))
+
+        importacion.total_filas = total
+        importacion.save(update_fields=["total_filas"])
+        TrabajoImportacion.objects.filter(pk=trabajo.pk).update(total_filas=total)
+    finally:
+        _borrar_archivo(ruta)
+
+
+def _confirmar(trabajo, ediciones):
+    """
+    Guarda en BCP las filas de la importación temporal y luego la borra.
+    """
+    importacion = trabajo.importacion
+    confirmar_filas(
+        importacion,
+        ediciones,
+        al_avanzar=lambda procesadas, guardadas, errores: _avanzar(trabajo, procesadas, guardadas, errores),
+    )
+    importacion.delete()
+
+
+def iniciar_lectura(archivo, cliente_default=None, tarifa_default=None, saldo_inicial_default=Decimal('0.00')):
+    """
+    Crea el trabajo que lee el Excel subido y lo encola. Devuelve el trabajo.
+    """
+    ruta = guardar_archivo_temporal(archivo)
+    trabajo = TrabajoImportacion.objects.create(tipo=TrabajoImportacion.PREVIEW, archivo=ruta)
+    encolar(
+        _leer_excel,
+        trabajo,
+        ruta,
+        cliente_default.pk if cliente_default else None,
+        tarifa_default.cod_tarifa if tarifa_default else None,
+        saldo_inicial_default,
+    )
+    return trabajo
+
+
+def iniciar_confirmacion(importacion, ediciones):
+    """
+    Crea el trabajo que guarda la importación en BCP y lo encola. Devuelve el trabajo.
+    """
+    trabajo = TrabajoImportacion.objects.create(
+        tipo=TrabajoImportacion.CONFIRMACION,
+        importacion=importacion,
+        token=importacion.token,
+        total_filas=importacion.total_filas,
+    )
+    encolar(_confirmar, trabajo, ediciones)
+    return trabajo
+
+
+def estado_trabajo(trabajo):
+    """
+    Resumen del trabajo para el endpoint de estado (serializable a JSON).
+    """
+    return {
+        "id": str(trabajo.id),
+        "tipo": trabajo.tipo,
+        "estado": trabajo.estado,
+        "token": str(trabajo.token) if trabajo.token else None,
+        "total_filas": trabajo.total_filas,
+        "filas_procesadas": trabajo.filas_procesadas,
+        "filas_guardadas": trabajo.filas_guardadas,
+        "filas_fallidas": trabajo.filas_fallidas,
+        "segundos": round(trabajo.segundos, 2),
+        "filas_por_segundo": round(trabajo.filas_por_segundo, 1),
+        "errores": trabajo.errores[:20],
+    }
@@ -6,6 +6,23 @@ app_name = "banco"
 urlpatterns = [
     path('importar/', views.importar_excel, name='importar_excel'),
     path('confirmar/', views.confirmar_import, name='confirmar_import'),
+    path('preview/<uuid:token>/', views.ver_preview, name='ver_preview'),
+    path('preview/<uuid:token>/filas/', views.preview_filas, name='preview_filas'),
+    path('trabajo/<uuid:trabajo_id>/', views.ver_trabajo, name='ver_trabajo'),
+    path('trabajo/<uuid:trabajo_id>/estado/', views.estado_trabajo_json, name='estado_trabajo'),
     path("exportar_excel/", views.exportar_excel, name="exportar_excel"),
+    path("exportar_csv/", views.exportar_csv, name="exportar_csv"),
+    path("exportar_parquet/", views.exportar_parquet, name="exportar_parquet"),
+    path("resumen/", views.resumen_diario, name="resumen_diario"),
+    path("clientes/autocompletar/", views.autocompletar_clientes, name="autocompletar_clientes"),
+    path("api/movimientos/", views.ingerir_movimientos_api, name="ingerir_movimientos"),
+    path("api/bcp/", views.listar_bcp_api, name="listar_bcp"),
+    path("metricas/", views.metricas, name="metricas"),
+    # Versiones async, para servir con ASGI (webempresa/asgi.py)
+    path("async/importar/", views.importar_excel_async, name="importar_excel_async"),
+    path("async/trabajo/<uuid:trabajo_id>/estado/", views.estado_trabajo_json_async, name="estado_trabajo_async"),
+    path("async/exportar_excel/", views.exportar_excel_async, name="exportar_excel_async"),
+    path("async/exportar_csv/", views.exportar_csv_async, name="exportar_csv_async"),
+    path("async/exportar_parquet/", views.exportar_parquet_async, name="exportar_parquet_async"),
     
 ]
@@ -1,25 +1,35 @@
-import os
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from decimal import Decimal
-import pandas as pd
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.views.decorators.csrf import csrf_exempt
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.conf import settings
-from django.db import transaction
-from .forms import UploadExcelForm
-from .models import BCP, TarifaOperacion, Cliente
+from .forms import UploadExcelForm, FiltroExportacionForm, FiltroResumenForm, ListadoBCPForm
+from .models import BCP, TrabajoImportacion, ResumenDiario
+from .staging import (
+    obtener_importacion, ediciones_desde_post, filas_preview, TAMANO_PAGINA_PREVIEW, MAX_PAGINA_PREVIEW,
+)
+from .trabajos import iniciar_lectura, iniciar_confirmacion, estado_trabajo, revisar_trabajo
+from .exportacion import limitar_filas_xlsx, parquet_disponible
+from .cache_exportaciones import exportacion_en_cache
+from .asincrono import iterar_async
+from .instrumentacion import etapa, presupuesto, registro
+from .resumenes import totales_resumen
+from .listado import pagina_bcp
+from .clientes import LIMITE_AUTOCOMPLETAR, buscar_clientes, texto_cliente
+from .ingesta import MAX_MOVIMIENTOS, MovimientoInvalido, ingerir_movimientos, movimientos_json, movimientos_ndjson
 from django.urls import reverse
-import re
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from decimal import Decimal
-import pandas as pd
-from .models import Cliente, TarifaOperacion
 
 
+def _render(request, plantilla, contexto):
+    # render() midiendo la etapa "render" (ver instrumentacion.py)
+    with etapa("render"):
+        return render(request, plantilla, contexto)
+
 
+@presupuesto(consultas=5, milisegundos=2000)
 def importar_excel(request):
     """
     Función que permite subir un archivo Excel y mostrar una PREVIEW editable
@@ -33,288 +43,401 @@ def importar_excel(request):
             tarifa_default = form.cleaned_data.get('tarifa')
             saldo_inicial_default = form.cleaned_data.get('saldo_inicial') or Decimal('0.00')
 
-            df = pd.read_excel(archivo, sheet_name=0, dtype=str)
-            df.columns = [c.strip().upper().replace(" ", "_") for c in df.columns]
+            # La lectura, resolución y cálculo corren en segundo plano; la
+            # página del trabajo muestra el avance y luego lleva a la preview
+            trabajo = iniciar_lectura(
+                archivo,
+                cliente_default=cliente_default,
+                tarifa_default=tarifa_default,
+                saldo_inicial_default=saldo_inicial_default,
+            )
+            return redirect(reverse("banco:ver_trabajo", args=[trabajo.id]))
 
-            rows = []
+    else:
+        form = UploadExcelForm()
 
-            for i, r in df.iterrows():
-                cod_bcp = str(r.get("COD_BCP") or r.get("COD_BCP ") or "")
+    return _render(request, "banco/importar_excel.html", {"form": form})
 
-                # --- Fechas manejando valores nulos ---
-                fecha_raw = r.get("FECHA")
-                fecha_valuta_raw = r.get("FECHA_VALUTA") or r.get("FECHA_VAL") or None
 
-                def safe_fecha(f):
-                    try:
-                        if pd.isna(f):
-                            return None
-                        return pd.to_datetime(f)
-                    except:
-                        return None
+@presupuesto(consultas=2, milisegundos=500)
+def ver_preview(request, token):
+    """
+    Página de preview de una importación temporal; las filas se cargan desde preview_filas.
+    """
+    importacion = obtener_importacion(token)
+    if importacion is None:
+        return redirect(reverse("banco:importar_excel"))
 
-                fecha = safe_fecha(fecha_raw)
-                fecha_valuta = safe_fecha(fecha_valuta_raw)
+    context = {
+        "token": importacion.token,
+        "total": importacion.total_filas,
+        "tamano_pagina": TAMANO_PAGINA_PREVIEW,
+    }
+    return _render(request, "banco/preview.html", context)
 
-                # Otros campos
-                descripcion = r.get("DESCRIPCIÓN_OPERACIÓN") or r.get("DESCRIPCION_OPERACION") or ""
-                sucursal_agencia = r.get("SUCURSAL_AGENCIA") or ""
-                n_operacion = r.get("N_OPERACIÓN") or r.get("N_OPERACION") or ""
 
-                # Monto
-                monto_raw = r.get("MONTO") or r.get("MTO") or "0"
-                try:
-                    monto = Decimal(str(monto_raw).replace(",", ""))
-                except:
-                    monto = Decimal('0.00')
+# Importación, filas y clientes de la ventana, más las tarifas si el cache está frío
+@presupuesto(consultas=4, milisegundos=500)
+def preview_filas(request, token):
+    """
+    Devuelve en JSON una ventana de filas de la importación temporal, con
+    las tablas de sus clientes y tarifas.
 
-                # Extraer DNI de los últimos 8 dígitos de la descripción
-                match = re.search(r'(\d{8})$', descripcion)
-                dni_encontrado = match.group(1) if match else None
+    Parámetros GET: ``offset`` y ``limit``, o ``page`` (desde 1) y ``limit``.
+    """
+    importacion = obtener_importacion(token)
+    if importacion is None:
+        return JsonResponse({"error": "La importación no existe o expiró."}, status=404)
 
-                # Inicializamos datos del cliente
-                cliente_obj = None
-                if dni_encontrado:
-                    cliente_obj = Cliente.objects.filter(dni=dni_encontrado).first()
+    def _entero(nombre, default):
+        try:
+            return max(0, int(request.GET.get(nombre, default)))
+        except (TypeError, ValueError):
+            return default
 
-                if not cliente_obj and cliente_default:
-                    cliente_obj = cliente_default
+    limite = min(_entero("limit", TAMANO_PAGINA_PREVIEW) or TAMANO_PAGINA_PREVIEW, MAX_PAGINA_PREVIEW)
+    if "page" in request.GET:
+        offset = (max(_entero("page", 1), 1) - 1) * limite
+    else:
+        offset = _entero("offset", 0)
 
-                # Inicializamos datos de tarifa
-                # Inicializamos datos de tarifa
-                tarifa_obj = None
-                if cliente_obj and cliente_obj.cod_tarifa:
-                    tarifa_obj = TarifaOperacion.objects.filter(cod_tarifa=cliente_obj.cod_tarifa).first()
+    return JsonResponse({
+        "total": importacion.total_filas,
+        "offset": offset,
+        "limit": limite,
+        # filas, y los clientes y tarifas a los que apuntan (ver filas_preview)
+        **filas_preview(importacion, offset, limite),
+    })
 
-                if not tarifa_obj and tarifa_default:
-                    tarifa_obj = tarifa_default
 
+def _partes_exportacion(request, formato):
+    """
+    Valida los filtros GET (FiltroExportacionForm) y devuelve (errores,
+    partes, omitidas) de la exportación de BCP en ``formato``. Si los datos no
+    cambiaron desde la última descarga con los mismos filtros se reutiliza el
+    archivo guardado (ver cache_exportaciones.py).
 
-                # Crear objeto temporal BCP para cálculos
-                bcp_temp = BCP(
-                monto=monto,
-                cliente=cliente_obj,
-                tarifa=tarifa_obj,
-            )
+    En Excel se exportan como máximo las filas que caben en una hoja;
+    ``omitidas`` es la cantidad de movimientos que quedaron afuera.
+    """
+    filtro = FiltroExportacionForm(request.GET)
+    if not filtro.is_valid():
+        return filtro.errors, None, 0
+
+    parametros = {k: str(v) for k, v in filtro.cleaned_data.items() if v}
+    movimientos = filtro.filtrar(BCP.objects.all())
+    omitidas = 0
+    if formato == "xlsx":
+        movimientos, omitidas = limitar_filas_xlsx(movimientos)
+    return None, exportacion_en_cache(formato, parametros, movimientos), omitidas
+
+
+def _respuesta_exportacion(partes, content_type, nombre, omitidas=0):
+    response = StreamingHttpResponse(partes, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{nombre}"'
+    if omitidas:
+        # El archivo está recortado: el resto se puede bajar en CSV o filtrando por fechas
+        response["X-Filas-Omitidas"] = str(omitidas)
+    return response
 
 
-                # Asignar saldo inicial al atributo temporal
-                bcp_temp._saldo_inicial = saldo_inicial_default
-
-                # Calcular saldo, comisión y lm_pagar
-                bcp_temp.calcular_datos()
-
-                # Diccionario de fila para preview
-                row = {
-                    "index": i,
-                    "cod_bcp": cod_bcp,
-                    "fecha": '' if fecha is None else fecha.strftime('%Y-%m-%d'),
-                    "fecha_valuta": '' if fecha_valuta is None else fecha_valuta.strftime('%Y-%m-%d'),
-                    "descripcion": descripcion,
-                    "monto": monto,
-                    "sucursal_agencia": sucursal_agencia,
-                    "n_operacion": n_operacion,
-                    "usuario": r.get("USUARIO") or "",
-                    # Datos automáticos del cliente
-                    "dni_cliente": dni_encontrado,
-                    "cliente_default": cliente_obj.cod_cliente if cliente_obj else "",
-                    "cliente_nombre": cliente_obj.nombre if cliente_obj else "",
-                    "cliente_apellidos": cliente_obj.apellidos if cliente_obj else "",
-                    "correo": cliente_obj.correo or "" if cliente_obj else "",
-                    "celular": cliente_obj.celular or "" if cliente_obj else "",
-                    "status": cliente_obj.status or "" if cliente_obj else "",
-                    "provincia": cliente_obj.provincia or "" if cliente_obj else "",
-                    "codigo_referido": cliente_obj.codigo_referido or "" if cliente_obj else "",
-                    "nombre_referido": cliente_obj.nombre_referido or "" if cliente_obj else "",
-                    "cuenta_banco_referido": cliente_obj.cuenta_banco_referido or "" if cliente_obj else "",
-                    "cuenta_interbancario_referido": cliente_obj.cuenta_interbancario_referido or "" if cliente_obj else "",
-                    #faltan esos 2
-                    "costo_por_porcentaje": tarifa_obj.costo_por_porcentaje if tarifa_obj else 0,
-                    "costo_fijo": tarifa_obj.costo_fijo if tarifa_obj else 0,
-                    #faltan los 2 de arriba
-                    # Datos calculados automáticamente
-                    "saldo": f"{bcp_temp.saldo:.2f}",
-                    "comision": f"{bcp_temp.comision:.2f}",
-                    "lm_pagar": f"{bcp_temp.lm_pagar:.2f}",
-                    "tarifa_default": tarifa_obj.cod_tarifa if tarifa_obj else "",
-                    "saldo_inicial_default": saldo_inicial_default,
-                    "Ganancia_Referido": f"{bcp_temp.ganancia_referido:.2f}",
-
-                    "cod_tarifa": cliente_obj.cod_tarifa or "" if cliente_obj else "",
-                }
-
-                rows.append(row)
-
-            # Contexto para renderizar el template
-            context = {
-                "rows": rows,
-                "clientes": Cliente.objects.all(),
-                "tarifas": TarifaOperacion.objects.all(),
-                "form": form,
-            }
-
-            return render(request, "banco/preview.html", context)
+def _exportar(request, formato, content_type, nombre):
+    """
+    Respuesta en streaming con la exportación de BCP en ``formato``, filtrada
+    por los parámetros GET.
+    """
+    errores, partes, omitidas = _partes_exportacion(request, formato)
+    if errores:
+        return JsonResponse({"errores": errores}, status=400)
+    return _respuesta_exportacion(partes, content_type, nombre, omitidas)
 
-    else:
-        form = UploadExcelForm()
 
-    return render(request, "banco/importar_excel.html", {"form": form})
+async def _exportar_async(request, formato, content_type, nombre):
+    """
+    Igual que _exportar, para ASGI: las consultas y la generación del archivo
+    corren en el hilo de la petición y el envío de las partes en el event loop,
+    así una descarga lenta no ocupa un worker mientras el cliente la recibe.
+    """
+    errores, partes, omitidas = await sync_to_async(_partes_exportacion)(request, formato)
+    if errores:
+        return JsonResponse({"errores": errores}, status=400)
+    return _respuesta_exportacion(iterar_async(partes), content_type, nombre, omitidas)
 
 
+@presupuesto(consultas=15)
 def exportar_excel(request):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "BCP"
-
-    # Estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    center_alignment = Alignment(horizontal="center", vertical="center")
-    money_format = "#,##0.00"
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
+    """
+    Descarga los movimientos BCP en Excel, filtrados por los parámetros GET
+    de FiltroExportacionForm (rango de fecha y fecha valuta, cliente, tarifa,
+    código, n° de operación). Sin parámetros se exporta toda la tabla.
+
+    El archivo se arma y se envía por partes (StreamingHttpResponse), así la
+    memoria y el tiempo hasta el primer byte no dependen del tamaño de la tabla.
+    Si hay más movimientos de los que caben en una hoja se exportan los
+    primeros y el header X-Filas-Omitidas indica cuántos quedaron afuera.
+    """
+    return _exportar(
+        request, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "BCP.xlsx"
     )
 
-    # Encabezados
-    headers = [
-        "Código BCP", "Fecha", "Fecha Valuta", "Descripción", 
-        "Monto", "Sucursal/Agencia", "N° Operación", "Usuario",
-        "Saldo", "Comisión", "LM Pagar", "Código", "Ganancia Referido",
-        "Cliente", "Tarifa"
-    ]
-    ws.append(headers)
-
-    for col_num, _ in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = center_alignment
-        cell.border = thin_border
-
-    # Filas de datos
-    for i, bcp in enumerate(BCP.objects.all(), start=2):
-        row = [
-            bcp.cod_bcp,
-            bcp.fecha,
-            bcp.fecha_valuta,
-            bcp.descripcion,
-            float(bcp.monto or 0),
-            bcp.sucursal_agencia,
-            bcp.n_operacion,
-            bcp.usuario,
-            float(bcp.saldo or 0),
-            float(bcp.comision or 0),
-            float(bcp.lm_pagar or 0),
-            bcp.codigo,
-            float(bcp.ganancia_referido or 0),
-            bcp.cliente.cod_cliente if bcp.cliente else "",
-            bcp.tarifa.cod_tarifa if bcp.tarifa else ""
-        ]
-        ws.append(row)
-
-        # Aplicar bordes y formato monetario
-        for col_num, value in enumerate(row, 1):
-            cell = ws.cell(row=i, column=col_num)
-            cell.border = thin_border
-            if col_num in [5, 9, 10, 11, 13]:  # columnas de dinero
-                cell.number_format = money_format
-
-        # Efecto zebra
-        if i % 2 == 0:
-            for col_num in range(1, len(row)+1):
-                ws.cell(row=i, column=col_num).fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-
-    # Ajuste automático de ancho
-    for col in ws.columns:
-        max_length = max(len(str(cell.value)) if cell.value else 0 for cell in col) + 2
-        ws.column_dimensions[col[0].column_letter].width = max_length
-
-    # Respuesta HTTP
-    response = HttpResponse(
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+@presupuesto(consultas=15)
+def exportar_csv(request):
+    """
+    Descarga los movimientos BCP en CSV, con las mismas columnas y filtros
+    que exportar_excel. Pensado para procesos automáticos (sin estilos).
+    """
+    return _exportar(request, "csv", "text/csv; charset=utf-8", "BCP.csv")
+
+
+@presupuesto(consultas=15)
+def exportar_parquet(request):
+    """
+    Descarga los movimientos BCP en Parquet (columnar), con las mismas
+    columnas y filtros que exportar_excel. Necesita pyarrow.
+    """
+    if not parquet_disponible():
+        return JsonResponse({"errores": ["La exportación Parquet necesita pyarrow instalado."]}, status=501)
+    return _exportar(request, "parquet", "application/vnd.apache.parquet", "BCP.parquet")
+
+
+# --- Versiones async (ASGI) de la importación y las exportaciones ---
+
+@presupuesto(consultas=5, milisegundos=2000)
+async def importar_excel_async(request):
+    """
+    importar_excel para ASGI. El cuerpo de la subida ya lo recibe Django sin
+    bloquear (ASGIHandler lo lee antes de llamar a la vista); el formulario,
+    la copia del archivo y las consultas corren en el hilo de la petición, y
+    la lectura del Excel (lo que usa CPU) sigue en el pool de trabajos.
+    """
+    return await sync_to_async(importar_excel)(request)
+
+
+# La segunda consulta es el UPDATE que marca como fallido un trabajo perdido
+@presupuesto(consultas=2, milisegundos=200)
+async def estado_trabajo_json_async(request, trabajo_id):
+    """
+    estado_trabajo_json para ASGI: la página del trabajo lo consulta cada
+    pocos segundos mientras dura la importación.
+    """
+    try:
+        trabajo = await TrabajoImportacion.objects.aget(pk=trabajo_id)
+    except TrabajoImportacion.DoesNotExist:
+        raise Http404
+    trabajo = await sync_to_async(revisar_trabajo)(trabajo)
+    return JsonResponse(estado_trabajo(trabajo))
+
+
+@presupuesto(consultas=15)
+async def exportar_excel_async(request):
+    """
+    exportar_excel para ASGI (ver _exportar_async).
+    """
+    return await _exportar_async(
+        request, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "BCP.xlsx"
     )
-    response["Content-Disposition"] = 'attachment; filename="BCP.xlsx"'
-    wb.save(response)
-    return response
 
-@transaction.atomic
+
+@presupuesto(consultas=15)
+async def exportar_csv_async(request):
+    """
+    exportar_csv para ASGI (ver _exportar_async).
+    """
+    return await _exportar_async(request, "csv", "text/csv; charset=utf-8", "BCP.csv")
+
+
+@presupuesto(consultas=15)
+async def exportar_parquet_async(request):
+    """
+    exportar_parquet para ASGI (ver _exportar_async).
+    """
+    if not parquet_disponible():
+        return JsonResponse({"errores": ["La exportación Parquet necesita pyarrow instalado."]}, status=501)
+    return await _exportar_async(request, "parquet", "application/vnd.apache.parquet", "BCP.parquet")
+
+
+@presupuesto(consultas=2, milisegundos=500)
+def resumen_diario(request):
+    """
+    Totales de movimientos (cantidad, monto, comisión, LM a pagar y ganancia
+    de referido) por cliente, tarifa y fecha, en JSON.
+
+    Parámetros GET (FiltroResumenForm): ``fecha_desde``, ``fecha_hasta``,
+    ``cliente``, ``tarifa`` y ``agrupar`` (repetible: fecha, cliente, tarifa).
+    Se lee de ResumenDiario, que se mantiene al guardar movimientos, así que
+    no recorre BCP.
+    """
+    filtro = FiltroResumenForm(request.GET)
+    if not filtro.is_valid():
+        return JsonResponse({"errores": filtro.errors}, status=400)
+
+    grupos, total = totales_resumen(filtro.filtrar(ResumenDiario.objects.all()), filtro.columnas())
+    return JsonResponse({"grupos": grupos, "total": total})
+
+
+# La página, más la sesión y el usuario que lee la autenticación de DRF
+@presupuesto(consultas=3, milisegundos=500)
+@api_view(["GET"])
+def listar_bcp_api(request):
+    """
+    Lista movimientos BCP del más reciente al más antiguo, por páginas.
+
+    Parámetros GET (ListadoBCPForm): los filtros de la exportación (cliente,
+    tarifa, rangos de fecha...), ``campos`` (por ejemplo
+    ``campos=cod_bcp,fecha,monto``), ``limite`` y ``cursor``. La respuesta
+    trae ``siguiente``: el cursor para pedir la página que sigue (null en la
+    última). La paginación es por (fecha, id), sin OFFSET.
+    """
+    filtro = ListadoBCPForm(request.GET)
+    if not filtro.is_valid():
+        return Response({"errores": filtro.errors}, status=400)
+
+    datos = filtro.cleaned_data
+    filas, siguiente = pagina_bcp(
+        filtro.filtrar(BCP.objects.all()), datos["campos"], datos["cursor"], datos["limite"]
+    )
+    return Response({"resultados": filas, "siguiente": siguiente})
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def ingerir_movimientos_api(request):
+    """
+    API para cargar movimientos BCP desde otros sistemas, sin pasar por Excel.
+
+    El cuerpo es JSON (una lista de movimientos o {"movimientos": [...]}) o
+    NDJSON (Content-Type application/x-ndjson, un movimiento por línea, que
+    se lee a medida que llega). Cada movimiento tiene fecha, fecha_valuta
+    (AAAA-MM-DD), descripcion, monto, sucursal_agencia, n_operacion, usuario,
+    codigo, cod_bcp y saldo_inicial opcionales, y el cliente por COD_CLIENTE
+    (``cliente``) o DNI (``dni``); sin ninguno se identifica por la
+    descripción (DNI, COD_CLIENTE o nombre, ver coincidencias).
+
+    Solo para usuarios autenticados (sesión o Basic). Responde con un
+    resultado por movimiento (ver ingerir_movimientos). Si llegan más de
+    MAX_MOVIMIENTOS se guardan solo esos y la respuesta trae
+    ``"truncado": true``: ``recibidos`` dice desde dónde reenviar.
+    """
+    try:
+        if request.content_type.startswith("application/x-ndjson"):
+            # DRF deja stream en None si el cuerpo está vacío o no tiene
+            # Content-Length (chunked): Django no lo lee y se perdería sin aviso
+            if request.stream is None:
+                if "CONTENT_LENGTH" not in request.META:
+                    return Response({"errores": ["Falta el header Content-Length."]}, status=411)
+                return Response({"errores": ["El cuerpo está vacío."]}, status=400)
+            movimientos = movimientos_ndjson(request.stream)
+        else:
+            movimientos = movimientos_json(request.data)
+    except MovimientoInvalido as e:
+        return Response({"errores": [str(e)]}, status=400)
+
+    resultados, completo = ingerir_movimientos(movimientos)
+    estados = [r["estado"] for r in resultados]
+    respuesta = {
+        "recibidos": len(resultados),
+        "guardados": estados.count("guardado"),
+        "duplicados": estados.count("duplicado"),
+        "con_error": estados.count("error"),
+        # Lo recibido ya se guardó: un 413 haría reenviar (y duplicar) todo
+        "truncado": not completo,
+        "resultados": resultados,
+    }
+    if not completo:
+        respuesta["errores"] = [
+            f"Se admiten como máximo {MAX_MOVIMIENTOS} movimientos por petición; "
+            f"se procesaron los primeros {MAX_MOVIMIENTOS} y el resto no."
+        ]
+    return Response(respuesta)
+
+
+@presupuesto(consultas=6, milisegundos=1000)
 def confirmar_import(request):
     """
     Función que guarda los registros confirmados desde la preview.
+
+    Las filas se leen de la importación temporal del token; del formulario
+    solo llegan las filas que el usuario editó. El guardado corre en
+    segundo plano y se redirige a la página del trabajo.
     """
     if request.method != "POST":
         return redirect(reverse("banco:importar_excel"))
 
-    # Obtenemos listas de cada campo
-    cod_bcp_list = request.POST.getlist("cod_bcp")
-    fecha_list = request.POST.getlist("fecha")
-    fecha_valuta_list = request.POST.getlist("fecha_valuta")
-    descripcion_list = request.POST.getlist("descripcion")
-    monto_list = request.POST.getlist("monto")
-    sucursal_list = request.POST.getlist("sucursal_agencia")
-    n_operacion_list = request.POST.getlist("n_operacion")
-    usuario_list = request.POST.getlist("usuario")
-    saldo_inicial_list = request.POST.getlist("saldo_inicial")
-    codigo_list = request.POST.getlist("codigo")
-    cliente_list = request.POST.getlist("cliente")
-    tarifa_list = request.POST.getlist("tarifa")
-
-    saved = 0
-    errors = []
-    total = len(descripcion_list)
-
-    for i in range(total):
-        try:
-            cod_bcp = cod_bcp_list[i] if i < len(cod_bcp_list) else None
-
-            # Fechas
-            f_raw = fecha_list[i] if i < len(fecha_list) else ""
-            try:
-                fecha = pd.to_datetime(f_raw).date() if f_raw else None
-            except:
-                fecha = None
-
-            fv_raw = fecha_valuta_list[i] if i < len(fecha_valuta_list) else ""
-            try:
-                fecha_valuta = pd.to_datetime(fv_raw).date() if fv_raw else None
-            except:
-                fecha_valuta = None
-
-            descripcion = descripcion_list[i]
-            monto = Decimal(monto_list[i].replace(",", "")) if monto_list[i] else Decimal('0.00')
-            sucursal_agencia = sucursal_list[i] if i < len(sucursal_list) else ""
-            n_operacion = n_operacion_list[i] if i < len(n_operacion_list) else ""
-            usuario = usuario_list[i] if i < len(usuario_list) else ""
-            saldo_inicial = Decimal(saldo_inicial_list[i].replace(",", "")) if saldo_inicial_list[i] else Decimal('0.00')
-            codigo = codigo_list[i] if i < len(codigo_list) else ""
-
-            cliente_obj = Cliente.objects.filter(cod_cliente=cliente_list[i]).first() if cliente_list and cliente_list[i] else None
-            tarifa_obj = TarifaOperacion.objects.filter(cod_tarifa=tarifa_list[i]).first() if tarifa_list and tarifa_list[i] else None
-
-            if cod_bcp and BCP.objects.filter(cod_bcp=cod_bcp).exists():
-                continue
-
-            b = BCP(
-                cod_bcp=cod_bcp or f"autogen_{i}",
-                fecha=fecha,
-                fecha_valuta=fecha_valuta,
-                descripcion=descripcion,
-                monto=monto,
-                sucursal_agencia=sucursal_agencia,
-                n_operacion=n_operacion,
-                usuario=usuario,
-                codigo=codigo,
-                cliente=cliente_obj,
-                tarifa=tarifa_obj
-            )
+    importacion = obtener_importacion(request.POST.get("token"))
+    if importacion is None:
+        return _render(request, "banco/result.html", {
+            "saved": 0,
+            "errors": ["La importación no existe, expiró o ya fue confirmada."],
+        })
+
+    # Si ya se está confirmando (doble envío) se muestra ese mismo trabajo
+    trabajo = importacion.trabajos.filter(
+        tipo=TrabajoImportacion.CONFIRMACION,
+        estado__in=[TrabajoImportacion.PENDIENTE, TrabajoImportacion.EN_PROCESO],
+    ).first()
+    if trabajo is None:
+        trabajo = iniciar_confirmacion(importacion, ediciones_desde_post(request.POST))
+
+    return redirect(reverse("banco:ver_trabajo", args=[trabajo.id]))
+
+
+@presupuesto(consultas=2, milisegundos=500)
+def ver_trabajo(request, trabajo_id):
+    """
+    Página de avance de un trabajo de importación. Al terminar lleva a la
+    preview (lectura del Excel) o muestra el resultado (confirmación).
+    """
+    trabajo = revisar_trabajo(get_object_or_404(TrabajoImportacion, pk=trabajo_id))
+
+    if trabajo.estado == TrabajoImportacion.TERMINADO and trabajo.tipo == TrabajoImportacion.PREVIEW:
+        return redirect(reverse("banco:ver_preview", args=[trabajo.token]))
 
-            b.saldo_inicial = saldo_inicial
-            b.save()
-            saved += 1
-        except Exception as e:
-            errors.append(f"Fila {i}: {str(e)}")
+    if trabajo.estado in (TrabajoImportacion.TERMINADO, TrabajoImportacion.FALLIDO):
+        return _render(request, "banco/result.html", {
+            "saved": trabajo.filas_guardadas,
+            "errors": trabajo.errores,
+        })
 
-    return render(request, "banco/result.html", {"saved": saved, "errors": errors})
+    return _render(request, "banco/trabajo.html", {"trabajo": trabajo})
+
+
+@presupuesto(consultas=4, milisegundos=200)
+def autocompletar_clientes(request):
+    """
+    Clientes para los selectores con autocompletado (formulario de
+    importación y preview), en el formato de select2.
+
+    Parámetros GET: ``q`` (prefijo de COD_CLIENTE, DNI, nombre o apellidos)
+    y ``limite``. Devuelve como mucho ``limite`` clientes; ver buscar_clientes.
+    """
+    try:
+        limite = int(request.GET.get("limite", LIMITE_AUTOCOMPLETAR))
+    except ValueError:
+        limite = LIMITE_AUTOCOMPLETAR
+    clientes = buscar_clientes(request.GET.get("q", ""), limite)
+    return JsonResponse({
+        "results": [{"id": c["cod_cliente"], "text": texto_cliente(c), **c} for c in clientes],
+    })
+
+
+# La segunda consulta es el UPDATE que marca como fallido un trabajo perdido
+@presupuesto(consultas=2, milisegundos=200)
+def estado_trabajo_json(request, trabajo_id):
+    """
+    Estado de un trabajo en JSON: filas procesadas, fallidas y filas por segundo.
+    Un trabajo perdido (sin latido hace rato) se informa como fallido.
+    """
+    trabajo = revisar_trabajo(get_object_or_404(TrabajoImportacion, pk=trabajo_id))
+    return JsonResponse(estado_trabajo(trabajo))
+
+
+def metricas(request):
+    """
+    Consultas, tiempo de base de datos, latencia (promedio, p95, máximo) y
+    tiempo por etapa de cada vista y trabajo de este proceso, en JSON (ver
+    instrumentacion.py). Solo responde a las IPs de settings.BANCO_METRICAS_IPS.
+    """
+    if request.META.get("REMOTE_ADDR") not in getattr(settings, "BANCO_METRICAS_IPS", ["127.0.0.1", "::1"]):
+        raise Http404
+    return JsonResponse({"vistas": registro.resumen()})
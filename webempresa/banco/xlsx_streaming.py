@@ -0,0 +1,258 @@
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+
+
+# Estilos compartidos de la hoja. Cada celda solo referencia el índice del
+# estilo (atributo s=), así no se crea un objeto de estilo por celda.
+# Orden: encabezado, y para los datos (texto, dinero, fecha) normal y zebra.
+ESTILOS = {
+    "encabezado": 1,
+    "texto": 2,
+    "dinero": 3,
+    "fecha": 4,
+    "texto_zebra": 5,
+    "dinero_zebra": 6,
+    "fecha_zebra": 7,
+}
+
+# Filas que Excel admite en una hoja (incluido el encabezado)
+MAX_FILAS_HOJA = 1048576
+
+FORMATO_DINERO = "#,##0.00"
+FORMATO_FECHA = "yyyy-mm-dd"
+
+_EPOCA_EXCEL = date(1899, 12, 30)
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{titulo}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# Mismos estilos que usaba la exportación con openpyxl: encabezado azul con
+# letra blanca en negrita, bordes finos, formato de dinero y filas zebra.
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="2">'
+    f'<numFmt numFmtId="164" formatCode="{FORMATO_DINERO}"/>'
+    f'<numFmt numFmtId="165" formatCode="{FORMATO_FECHA}"/>'
+    '</numFmts>'
+    '<fonts count="2">'
+    '<font><sz val="11"/><name val="Calibri"/><family val="2"/></font>'
+    '<font><b/><sz val="11"/><color rgb="FFFFFFFF"/><name val="Calibri"/><family val="2"/></font>'
+    '</fonts>'
+    '<fills count="4">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="004F81BD"/><bgColor rgb="004F81BD"/></patternFill></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="00D9E1F2"/><bgColor rgb="00D9E1F2"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="2">'
+    '<border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="8">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="1" xfId="0" applyFont="1" applyFill="1" '
+    'applyBorder="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="0" applyBorder="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="1" xfId="0" applyNumberFormat="1" applyBorder="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="1" xfId="0" applyNumberFormat="1" applyBorder="1"/>'
+    '<xf numFmtId="0" fontId="0" fillId="3" borderId="1" xfId="0" applyFill="1" applyBorder="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="3" borderId="1" xfId="0" applyNumberFormat="1" applyFill="1" '
+    'applyBorder="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="3" borderId="1" xfId="0" applyNumberFormat="1" applyFill="1" '
+    'applyBorder="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+class SalidaEnPartes:
+    """
+    Destino de escritura que solo acumula bytes; el generador los entrega por
+    partes. Al no tener seek, zipfile escribe cada archivo con data descriptor
+    (en streaming); también sirve para el ParquetWriter de pyarrow.
+    """
+
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+        self.closed = False
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def writable(self):
+        return True
+
+    def close(self):
+        # Lo que quedó pendiente se puede seguir leyendo con vaciar()
+        self.closed = True
+
+    def vaciar(self):
+        datos = b"".join(self.partes)
+        self.partes = []
+        return datos
+
+
+def _texto(valor):
+    return escape(ILLEGAL_CHARACTERS_RE.sub("", str(valor)))
+
+
+def _celda(ref, valor, estilo):
+    if valor is None or valor == "":
+        return f'<c r="{ref}" s="{estilo}"/>'
+    if isinstance(valor, bool):
+        return f'<c r="{ref}" s="{estilo}" t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c r="{ref}" s="{estilo}"><v>{valor}</v></c>'
+    if isinstance(valor, datetime):
+        dias = (valor - datetime(1899, 12, 30)).total_seconds() / 86400
+        return f'<c r="{ref}" s="{estilo}"><v>{dias}</v></c>'
+    if isinstance(valor, date):
+        return f'<c r="{ref}" s="{estilo}"><v>{(valor - _EPOCA_EXCEL).days}</v></c>'
+    return f'<c r="{ref}" s="{estilo}" t="inlineStr"><is><t xml:space="preserve">{_texto(valor)}</t></is></c>'
+
+
+def anchos_por_muestra(encabezados, muestra):
+    """
+    Ancho de cada columna como el largo del texto más largo + 2, calculado
+    sobre los encabezados y una muestra de filas (no sobre toda la tabla).
+    """
+    anchos = [len(str(e)) for e in encabezados]
+    for fila in muestra:
+        for n, valor in enumerate(fila):
+            if valor is not None and valor != "":
+                anchos[n] = max(anchos[n], len(str(valor)))
+    return [a + 2 for a in anchos]
+
+
+def filas_xml(filas, tipos, inicio=2, filas_por_bloque=500):
+    """
+    XML (bytes UTF-8) de las filas de datos de la hoja, en bloques de
+    ``filas_por_bloque`` filas. ``inicio`` es el número de la primera fila
+    (2 si va justo después del encabezado); con él se puede seguir una hoja
+    ya generada agregando filas al final.
+
+    ``tipos`` indica por columna "texto", "dinero" o "fecha" (el formato de
+    la celda). Las filas pares llevan el fondo zebra, como la exportación original.
+    Las filas después de MAX_FILAS_HOJA no se escriben: Excel no abriría el
+    archivo (quien exporta debe recortar antes, ver exportacion.limitar_filas_xlsx).
+    """
+    letras = [get_column_letter(n) for n in range(1, len(tipos) + 1)]
+    estilos = [ESTILOS[t] for t in tipos]
+    estilos_zebra = [ESTILOS[f"{t}_zebra"] for t in tipos]
+
+    partes = []
+    for r, fila in enumerate(filas, start=inicio):
+        if r > MAX_FILAS_HOJA:
+            break
+        fila_estilos = estilos_zebra if r % 2 == 0 else estilos
+        partes.append(f'<row r="{r}">')
+        for letra, valor, estilo in zip(letras, fila, fila_estilos):
+            partes.append(_celda(f"{letra}{r}", valor, estilo))
+        partes.append("</row>")
+
+        if (r - inicio + 1) % filas_por_bloque == 0:
+            yield "".join(partes).encode("utf-8")
+            partes = []
+    if partes:
+        yield "".join(partes).encode("utf-8")
+
+
+def empaquetar_xlsx(encabezados, partes_xml, anchos=None, titulo="Hoja1"):
+    """
+    Genera el .xlsx por partes (bytes) con el encabezado y las filas ya
+    convertidas a XML (ver filas_xml), con memoria constante: sirve para un
+    StreamingHttpResponse. ``anchos`` son los anchos de columna (ver anchos_por_muestra).
+    """
+    salida = SalidaEnPartes()
+    with zipfile.ZipFile(salida, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK.format(titulo=_texto(titulo)))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        zf.writestr("xl/styles.xml", _STYLES)
+        yield salida.vaciar()
+
+        # El tamaño de la hoja no se conoce de antemano: sin zip64 una hoja de
+        # más de 2 GiB falla al cerrarla
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as hoja:
+            partes = [
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            ]
+            if anchos:
+                partes.append("<cols>")
+                for n, ancho in enumerate(anchos, 1):
+                    partes.append(f'<col min="{n}" max="{n}" width="{ancho}" customWidth="1"/>')
+                partes.append("</cols>")
+            partes.append('<sheetData><row r="1">')
+            for n, encabezado in enumerate(encabezados, 1):
+                partes.append(_celda(f"{get_column_letter(n)}1", encabezado, ESTILOS["encabezado"]))
+            partes.append("</row>")
+            hoja.write("".join(partes).encode("utf-8"))
+
+            for parte in partes_xml:
+                hoja.write(parte)
+                datos = salida.vaciar()
+                if datos:
+                    yield datos
+
+            hoja.write(b"</sheetData></worksheet>")
+
+    yield salida.vaciar()
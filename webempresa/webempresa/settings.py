@@ -37,10 +37,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rest_framework',
     'banco'
 ]
 
 MIDDLEWARE = [
+    # Primero, para medir la petición completa (banco/instrumentacion.py)
+    'banco.instrumentacion.InstrumentacionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -126,3 +129,42 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Importaciones BCP en segundo plano
+# https://docs.python.org/3/library/concurrent.futures.html#threadpoolexecutor
+
+# Hilos por proceso que leen, calculan y guardan importaciones
+BANCO_TRABAJOS_WORKERS = 2
+
+# Segundos sin latido tras los cuales un trabajo pendiente o en proceso se da
+# por perdido (reinicio del proceso o caída del hilo) y se marca como fallido
+BANCO_TRABAJOS_TIMEOUT = 600
+
+# Filas que se guardan por lote (un bulk_create y una transacción) al confirmar
+BANCO_CONFIRMACION_LOTE = 1000
+
+# Cache de tarifas y reglas de referido (banco/tarifas.py, banco/referidos.py)
+# Alias de CACHES donde se publica la versión de cada catálogo; con un cache
+# compartido (Redis, Memcached) un cambio se ve en todos los workers
+BANCO_TARIFAS_CACHE = "default"
+
+# Segundos máximos que un worker usa los catálogos sin volver a leerlos
+BANCO_TARIFAS_TTL = 300
+
+# Instrumentación de las vistas (banco/instrumentacion.py)
+# True = pasar el presupuesto de consultas o tiempo de una vista lanza un error (para los tests)
+BANCO_PRESUPUESTOS_ESTRICTOS = False
+
+# IPs que pueden ver banco/metricas/
+BANCO_METRICAS_IPS = ["127.0.0.1", "::1"]
+
+# Carpeta donde se guardan las exportaciones para reutilizarlas (banco/cache_exportaciones.py)
+# None = carpeta temporal del sistema; con varios servidores conviene una carpeta compartida
+BANCO_EXPORTACIONES_DIR = None
+
+# Identificación del cliente por la descripción al importar (banco/coincidencias.py)
+# Confianza mínima (0 a 1) para asignar el cliente encontrado; por debajo la fila queda sin cliente
+BANCO_CONFIANZA_MINIMA_CLIENTE = 0.6
+
+# Segundos que un worker usa el índice de clientes antes de volver a leer CLIENTE completo
+BANCO_INDICE_CLIENTES_TTL = 3600
@@ -0,0 +1,26 @@
+"""
+Settings para el benchmark de banco (manage.py benchmark_banco): SQLite local
+en lugar de SQL Server, así se puede correr en cualquier máquina sin tocar
+la base de datos real.
+"""
+import tempfile
+from pathlib import Path
+
+from .settings import *  # noqa: F401,F403
+
+
+_TEMPORAL = Path(tempfile.gettempdir())
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': _TEMPORAL / 'banco_benchmark.sqlite3',
+        # El benchmark trabaja sobre la base de test (se crea y se borra en cada tamaño)
+        'TEST': {'NAME': _TEMPORAL / 'banco_benchmark_test.sqlite3'},
+        'OPTIONS': {'timeout': 30},
+    }
+}
+
+DEBUG = False
+
+BANCO_EXPORTACIONES_DIR = tempfile.mkdtemp(prefix='banco_benchmark_')